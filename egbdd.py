@@ -0,0 +1,288 @@
+#	Existential Graph Manipulation Library
+#
+#	egbdd.py
+#
+#	Binary decision diagrams: what an alpha graph means (see egtruth.py), for graphs with too many atoms for a truth table.
+#
+#	A graph is compiled into a reduced ordered BDD, in which every function of the atoms has exactly one node.  Two graphs
+#	compiled into the same BDD are equivalent exactly when they compile to the same node, so equivalence costs as much as
+#	building the diagrams (which depends on their size, not on 2 ** atoms).  All the diagrams of a BDD share one table of
+#	nodes, and the results of conjoin() and negate() are cached, as are the nodes of the subgraphs compiled so far (by
+#	fingerprint), so a graph that changes a little at a time is cheap to compile again.
+#
+#	How big a diagram gets depends on the order of its atoms.  variable_order() picks one:
+#		appearance		the order the atoms are first met in going down through the graphs (atoms that appear together
+#						stay close together)
+#		frequency		the atoms that appear most often first
+#		sorted			alphabetical
+#		best			whichever of those makes the smallest diagram
+#	A BDD holds at most max_nodes nodes; going past that raises an EGBDDError rather than running out of memory.
+#
+#	To check that every rule in a proof log keeps (or, for insertion and removal, only weakens) the meaning of the Sheet,
+#	as well as everything eglog checks:		python3 -m egbdd proof.log
+
+from egml import preorder, postorder
+import collections
+import eglog
+import sys
+
+FALSE = 0
+TRUE = 1
+MAX_NODES = 1000000
+HEURISTICS = ["appearance", "frequency", "sorted"]
+
+_TERMINAL = sys.maxsize		# The variable of FALSE and TRUE: below every real variable
+
+# EGBDDError: raised when a diagram gets too big, or when a step of a log changes the meaning of the Sheet.
+class EGBDDError(Exception):
+	def __init__(self, str):
+		self.string = str
+	def __str__(self):
+		return self.string
+
+# A BDD is a table of nodes shared by the diagrams built in it.  A diagram is a node number: FALSE, TRUE, or a node with
+# a variable (an atom's place in order) and the nodes for when that atom is false (low) and true (high).
+#	atoms - the variable order to start with (more atoms are added at the end as they are met)
+#	max_nodes - how many nodes the table may hold
+class BDD:
+	def __init__(self, atoms = (), max_nodes = MAX_NODES):
+		self.order = {}			# atom -> variable
+		self.atoms = []			# variable -> atom
+		self.max_nodes = max_nodes
+		self._var = [_TERMINAL, _TERMINAL]
+		self._low = [FALSE, TRUE]
+		self._high = [FALSE, TRUE]
+		self._unique = {}		# (variable, low, high) -> node
+		self._and_cache = {}
+		self._not_cache = {}
+		self._graphs = {}		# fingerprint -> node
+		for atom in atoms:
+			self.variable(atom)
+
+	# How many nodes the table holds.
+	def __len__(self):
+		return len(self._var)
+
+	def _node(self, var, low, high):
+		if low == high:
+			return low
+		key = (var, low, high)
+		node = self._unique.get(key)
+		if node is None:
+			if len(self._var) >= self.max_nodes:
+				raise EGBDDError("The diagram needs more than %d nodes." % self.max_nodes)
+			node = len(self._var)
+			self._var.append(var)
+			self._low.append(low)
+			self._high.append(high)
+			self._unique[key] = node
+		return node
+
+	# The diagram that is true when atom is.
+	def variable(self, atom):
+		if not atom in self.order:
+			self.order[atom] = len(self.atoms)
+			self.atoms.append(atom)
+		return self._node(self.order[atom], FALSE, TRUE)
+
+	# Both operations are done with an explicit stack (like egml's traversals), so there is no limit on the number of
+	# atoms from Python's recursion limit.  Each entry is either a pair still to do, or (done is True) a pair whose
+	# low and high results are the last two on results.
+
+	def negate(self, node):
+		results = []
+		stack = [(node, False)]
+		while stack:
+			node, done = stack.pop()
+			if done:
+				high = results.pop()
+				low = results.pop()
+				result = self._node(self._var[node], low, high)
+				self._not_cache[node] = result
+				self._not_cache[result] = node
+				results.append(result)
+			elif node <= TRUE:
+				results.append(TRUE - node)
+			elif node in self._not_cache:
+				results.append(self._not_cache[node])
+			else:
+				stack.append((node, True))
+				stack.append((self._high[node], False))
+				stack.append((self._low[node], False))
+		return results[0]
+
+	def conjoin(self, first, second):
+		results = []
+		stack = [(first, second, False)]
+		while stack:
+			first, second, done = stack.pop()
+			if done:
+				high = results.pop()
+				low = results.pop()
+				result = self._node(min(self._var[first], self._var[second]), low, high)
+				self._and_cache[first, second] = result
+				results.append(result)
+				continue
+			if first > second:
+				first, second = second, first
+			if first == FALSE or first == second:
+				results.append(first)
+			elif first == TRUE:
+				results.append(second)
+			elif (first, second) in self._and_cache:
+				results.append(self._and_cache[first, second])
+			else:
+				var = min(self._var[first], self._var[second])
+				first_low, first_high = (self._low[first], self._high[first]) if self._var[first] == var else (first, first)
+				second_low, second_high = (self._low[second], self._high[second]) if self._var[second] == var else (second, second)
+				stack.append((first, second, True))
+				stack.append((first_high, second_high, False))
+				stack.append((first_low, second_low, False))
+		return results[0]
+
+	def implies(self, first, second):
+		return self.conjoin(first, self.negate(second)) == FALSE
+
+	# The diagram of the graph under level (the Sheet, a Level on it, or a disconnected Level; see egtruth.py).
+	def compile(self, level):
+		for item in postorder(level, lambda item: not item.fingerprint() in self._graphs):
+			key = item.fingerprint()
+			if key in self._graphs:
+				continue
+			node = TRUE
+			for atom in sorted(set(item.atoms), key = lambda atom: -self._var[self.variable(atom)]):
+				node = self.conjoin(node, self.variable(atom))
+			for child in item.children:
+				node = self.conjoin(node, self.negate(self._graphs[child.fingerprint()]))
+			self._graphs[key] = node
+		return self._graphs[level.fingerprint()]
+
+	# How many nodes the diagrams of nodes use between them (counting FALSE and TRUE).
+	def size(self, nodes):
+		seen = set()
+		stack = list(nodes)
+		while stack:
+			node = stack.pop()
+			if not node in seen:
+				seen.add(node)
+				if node > TRUE:
+					stack.append(self._low[node])
+					stack.append(self._high[node])
+		return len(seen)
+
+	# An assignment (a dict from atom to True or False, for the atoms it depends on) that makes node true, or None.
+	def satisfy(self, node):
+		if node == FALSE:
+			return None
+		assignment = {}
+		while node != TRUE:
+			atom = self.atoms[self._var[node]]
+			if self._low[node] != FALSE:
+				assignment[atom] = False
+				node = self._low[node]
+			else:
+				assignment[atom] = True
+				node = self._high[node]
+		return assignment
+
+# Returns the atoms of graphs in the order the heuristic (one of HEURISTICS) gives.
+def variable_order(graphs, heuristic = "appearance"):
+	counts = collections.OrderedDict()
+	for graph in graphs:
+		for level in preorder(graph):
+			for atom in sorted(level.atoms):
+				counts[atom] = counts.get(atom, 0) + 1
+	if heuristic == "appearance":
+		return list(counts)
+	elif heuristic == "frequency":
+		return sorted(counts, key = lambda atom: -counts[atom])
+	elif heuristic == "sorted":
+		return sorted(counts)
+	raise ValueError("Unknown variable order '%s'." % heuristic)
+
+# Compiles graphs into one new BDD, with the atoms in the order the heuristic gives (or "best").
+# Returns the BDD and the list of the graphs' diagrams.
+def compile_graphs(graphs, heuristic = "appearance", max_nodes = MAX_NODES):
+	if heuristic != "best":
+		bdd = BDD(variable_order(graphs, heuristic), max_nodes)
+		return bdd, [bdd.compile(graph) for graph in graphs]
+	best = None
+	error = None
+	for heuristic in HEURISTICS:
+		try:
+			bdd, nodes = compile_graphs(graphs, heuristic, max_nodes)
+		except EGBDDError:
+			type_, error, tb_ = sys.exc_info()
+			continue
+		if best is None or bdd.size(nodes) < best[0].size(best[1]):
+			best = bdd, nodes
+	if best is None:
+		raise error
+	return best
+
+def is_equivalent(graph, other, heuristic = "appearance", max_nodes = MAX_NODES):
+	bdd, nodes = compile_graphs([graph, other], heuristic, max_nodes)
+	return nodes[0] == nodes[1]
+
+# Whether other is true whenever graph is.
+def implies(graph, other, heuristic = "appearance", max_nodes = MAX_NODES):
+	bdd, nodes = compile_graphs([graph, other], heuristic, max_nodes)
+	return bdd.implies(nodes[0], nodes[1])
+
+# An assignment (of the atoms it depends on) under which graph and other differ, or None.
+def difference(graph, other, heuristic = "appearance", max_nodes = MAX_NODES):
+	bdd, nodes = compile_graphs([graph, other], heuristic, max_nodes)
+	first_only = bdd.conjoin(nodes[0], bdd.negate(nodes[1]))
+	second_only = bdd.conjoin(nodes[1], bdd.negate(nodes[0]))
+	return bdd.satisfy(bdd.negate(bdd.conjoin(bdd.negate(first_only), bdd.negate(second_only))))
+
+################# Checking Proofs #################
+
+# A check for eglog.verify() that each rule keeps the meaning of the Sheet the same, or (for insertion and removal)
+# makes it weaker: the Sheet after the step has to follow from the Sheet before it.
+class StepCheck:
+	EQUIVALENT = set(["dc+", "dc-", "iterate", "deiterate"])
+	WEAKENING = set(["insert", "remove"])
+
+	def __init__(self, max_nodes = MAX_NODES):
+		self.bdd = BDD(max_nodes = max_nodes)
+		self.meaning = None
+
+	def __call__(self, replayer, action):
+		if not replayer.solving:
+			return
+		name = action.split(" ", 1)[0]
+		meaning = self.bdd.compile(replayer.sheet)
+		if name in StepCheck.EQUIVALENT and meaning != self.meaning:
+			raise EGBDDError("'%s' changed the meaning of the Sheet." % name)
+		if name in StepCheck.WEAKENING and not self.bdd.implies(self.meaning, meaning):
+			raise EGBDDError("'%s' made the Sheet say something that didn't follow from it." % name)
+		self.meaning = meaning
+
+# Checks a log like eglog.verify(), also checking the meaning of each step.  Returns an eglog.Verdict.
+def check_log(lines, max_nodes = MAX_NODES):
+	return eglog.verify(lines, StepCheck(max_nodes))
+
+def main(argv = None):
+	if argv is None:
+		argv = sys.argv[1:]
+	if len(argv) != 1:
+		sys.stderr.write("usage: python3 -m egbdd <log file>  (- for stdin)\n")
+		return 2
+	try:
+		if argv[0] == "-":
+			verdict = check_log(sys.stdin)
+		else:
+			with open(argv[0]) as lines:
+				verdict = check_log(lines)
+	except IOError:
+		type_, value_, tb_ = sys.exc_info()
+		sys.stderr.write("egbdd: " + str(value_) + "\n")
+		return 2
+	print(verdict)
+	if verdict.ok:
+		return 0
+	return 1
+
+if __name__ == "__main__":
+	sys.exit(main())
@@ -0,0 +1,304 @@
+#	Existential Graph Manipulation Library
+#
+#	egbench.py
+#
+#	Benchmarks: times the main egml operations on synthetic graphs of a given size.
+#
+#	From the command line:		python3 -m egbench [--size 10000] [--repeat 5] [--only NAME] [--output FILE] [--compare FILE]
+#
+#	Each benchmark builds its graph first (untimed), then times the operation; the best and median of --repeat runs are
+#	reported.  --output writes the results as JSON (with the commit and Python version they came from), and --compare
+#	reads an earlier --output file and shows how each benchmark has changed since.
+
+from egml import Sheet, copy_graph, preorder, set_sink
+import argparse
+import egsave
+import io
+import json
+import platform
+import random
+import reason
+import subprocess
+import sys
+import time
+
+################ Graph Generators ##################
+
+# Each generator returns a new Sheet holding a graph with about size Levels.
+
+# A random tree: each new Level goes into a Level picked at random, and about one in three Levels gets a random atom.
+def random_graph(size, seed = 0):
+	rng = random.Random(seed)
+	sheet = Sheet()
+	levels = [sheet]
+	for i in range(size):
+		parent = rng.choice(levels)
+		parent.create()
+		levels.append(parent.children[-1])
+		if rng.random() < 0.34:
+			levels[-1].create(rng.choice("ABCDEFGH"))
+	return sheet
+
+# A chain of doublecuts size Levels deep, with the atom A at the bottom.
+def deep_graph(size):
+	sheet = Sheet()
+	level = sheet
+	for i in range(size):
+		level.create()
+		level = level.children[0]
+	level.create("A")
+	return sheet
+
+# size sibling cuts on the Sheet, each holding an atom.
+def wide_graph(size):
+	sheet = Sheet()
+	for i in range(size):
+		sheet.create()
+		sheet.children[-1].create("ABCDEFGH"[i % 8])
+	return sheet
+
+# A chain of cuts size Levels deep, each Level of which holds the atom A and the subgraph (A (B)), so that there are
+# justifications for iteration and deiteration at every depth.
+def iteration_graph(size):
+	sheet = Sheet()
+	level = sheet
+	for i in range(size):
+		level.create("A")
+		level.create()
+		level.children[-1].create("A")
+		level.children[-1].create()
+		level.children[-1].children[-1].create("B")
+		level.create()
+		level = level.children[-1]
+	level.create("A")
+	return sheet
+
+# The Levels of sheet (not counting the Sheet itself), in pre-order.
+def _levels(sheet):
+	levels = list(preorder(sheet))
+	return levels[1:]
+
+# The Level at the bottom of a deep_graph() or iteration_graph() chain.
+def _bottom(sheet):
+	level = sheet
+	while level.children:
+		level = level.children[-1]
+	return level
+
+#################### Benchmarks ####################
+
+# Each benchmark takes the size and returns the function to time (everything it needs is built before it returns).
+
+def bench_find(size):
+	sheet = random_graph(size)
+	ids = [level.id for level in random.Random(1).sample(_levels(sheet), min(size, 1000))]
+	top = sheet.children[0]
+	def run():
+		for id in ids:
+			sheet.find(id)
+			top.find(id)
+	return run
+
+# Compares two random graphs built the same way (their fingerprints are worked out first, so only the comparison is timed).
+def bench_equal(size):
+	sheets = [random_graph(size), random_graph(size)]
+	for sheet in sheets:
+		sheet.fingerprint()
+	def run():
+		sheets[0].equal(sheets[1], confirm = True)
+	return run
+
+# Copies the top cut of a deep graph, or all of the cuts of a wide one.
+def _copy_graph(generator):
+	def bench(size):
+		sheet = generator(size)
+		graphs = sheet.children
+		def run():
+			for graph in graphs:
+				copy_graph(sheet, graph)
+		return run
+	return bench
+
+def bench_set_depth(size):
+	sheet = random_graph(size)
+	levels = sheet.children
+	def run():
+		for level in levels:
+			level.set_depth(1)
+	return run
+
+# Loads a save file of a random graph (the time it takes is mostly making the Levels).
+def _load(binary):
+	def bench(size):
+		stream = io.BytesIO()
+		egsave.save(stream, random_graph(size), binary = binary)
+		data = stream.getvalue()
+		def run():
+			egsave.load(io.BytesIO(data))
+		return run
+	return bench
+
+def _repr(generator):
+	def bench(size):
+		sheet = generator(size)
+		def run():
+			repr(sheet)
+		return run
+	return bench
+
+# The rules are each applied (and then undone, so that every run starts from the same graph) 100 times at the bottom of a
+# deep graph, where a recursive implementation would be slowest.  Doublecut removal and deiteration are timed together
+# with the insertion and iteration they undo; an inserted or removed atom is put back with delete() or create().
+def _rule(generator, apply, undo = None):
+	def bench(size):
+		sheet = generator(size)
+		level = _bottom(sheet)
+		def run():
+			for i in range(100):
+				result = apply(level)
+				if undo:
+					undo(level, result)
+		return run
+	return bench
+
+def _ins_doublecut(level):
+	level.ins_doublecut()
+
+def _rem_doublecut(level, result):
+	level.parent.rem_doublecut()
+
+def _insert(level):
+	if not level.odd:
+		level = level.parent
+	level.insert(atom = "A")
+	return level
+
+def _remove_inserted(level, inserted):
+	inserted.delete(atom = "A")
+
+def _remove(level):
+	if level.odd:
+		level = level.parent
+	level.remove(atom = "A")
+	return level
+
+def _add_removed(level, removed):
+	removed.create("A")
+
+def _iterate(level):
+	level.iterate(level = copy_graph(level.sheet, level.sheet.children[0]))
+
+def _deiterate_iterated(level, result):
+	level.deiterate(level = level.children[-1])
+
+def _iterate_atom(level):
+	level.iterate(atom = "A")
+
+def _deiterate_atom(level, result):
+	level.deiterate(atom = "A")
+
+# The end-to-end test: a script of commands that builds a random graph in setup mode and then applies rules to it.
+def bench_script(size):
+	rng = random.Random(2)
+	lines = ["new sheet"]
+	ids = [0]
+	for i in range(size):
+		lines.append("select %d" % rng.choice(ids))
+		lines.append("create level")
+		ids.append(i + 1)
+	lines.append("select 0")
+	lines.append("create atom A")
+	lines.append("mode solve")
+	for i in range(min(size, 1000)):
+		lines.append("select %d" % rng.choice(ids[1:]))
+		lines.append("insert doublecut")
+		lines.append("iterate A")
+	lines.append("quit")
+	def run():
+		reason.EG_batch(lines, confirm = True)
+	return run
+
+BENCHMARKS = [
+	("find", bench_find),
+	("equal", bench_equal),
+	("copy_graph_deep", _copy_graph(deep_graph)),
+	("copy_graph_wide", _copy_graph(wide_graph)),
+	("set_depth", bench_set_depth),
+	("repr", _repr(random_graph)),
+	("repr_wide", _repr(wide_graph)),
+	("load", _load(True)),
+	("load_text", _load(False)),
+	("doublecut", _rule(deep_graph, _ins_doublecut, _rem_doublecut)),
+	("insert", _rule(deep_graph, _insert, _remove_inserted)),
+	("remove", _rule(iteration_graph, _remove, _add_removed)),
+	("iteration", _rule(iteration_graph, _iterate, _deiterate_iterated)),
+	("iteration_atom", _rule(iteration_graph, _iterate_atom, _deiterate_atom)),
+	("script", bench_script),
+]
+
+# Runs the named benchmarks (all of them by default) at the given size, and returns their results by name:
+# the best and median run times (in seconds) and all of the runs.
+def run(size, repeat = 5, only = None):
+	results = {}
+	previous_sink = set_sink(None)
+	try:
+		for name, bench in BENCHMARKS:
+			if only and not name in only:
+				continue
+			timed = bench(size)
+			runs = []
+			for i in range(repeat):
+				start = time.perf_counter()
+				timed()
+				runs.append(time.perf_counter() - start)
+			runs.sort()
+			results[name] = {"best": runs[0], "median": runs[len(runs) // 2], "runs": runs}
+	finally:
+		set_sink(previous_sink)
+	return results
+
+# The commit the benchmarks are being run on (None if it can't be found).
+def _commit():
+	try:
+		output = subprocess.check_output(["git", "rev-parse", "HEAD"], stderr = subprocess.DEVNULL)
+	except (OSError, subprocess.CalledProcessError):
+		return None
+	return output.decode().strip()
+
+def main(argv = None):
+	parser = argparse.ArgumentParser(prog = "egbench", description = "Time egml operations on synthetic graphs.")
+	parser.add_argument("--size", type = int, default = 10000, help = "how many Levels each graph has")
+	parser.add_argument("--repeat", type = int, default = 5, help = "how many times to run each benchmark")
+	parser.add_argument("--only", action = "append", metavar = "NAME", help = "only run this benchmark (may be repeated)")
+	parser.add_argument("--output", metavar = "FILE", help = "write the results to FILE as JSON")
+	parser.add_argument("--compare", metavar = "FILE", help = "compare with the results in FILE (from --output)")
+	args = parser.parse_args(argv)
+
+	previous = None
+	if args.compare:
+		try:
+			with open(args.compare) as stream:
+				previous = json.load(stream)["results"]
+		except (IOError, ValueError, KeyError):
+			type_, value_, tb_ = sys.exc_info()
+			sys.stderr.write("egbench: can't read " + args.compare + ": " + str(value_) + "\n")
+			return 2
+
+	results = run(args.size, args.repeat, args.only)
+
+	for name in results:
+		line = "%-16s best %10.6fs  median %10.6fs" % (name, results[name]["best"], results[name]["median"])
+		if previous and name in previous:
+			line += "  (%.2fx of before)" % (results[name]["best"] / previous[name]["best"])
+		print(line)
+
+	if args.output:
+		report = {"commit": _commit(), "python": platform.python_version(), "size": args.size, "repeat": args.repeat,
+			"results": results}
+		with open(args.output, "w") as stream:
+			json.dump(report, stream, indent = 1, sort_keys = True)
+			stream.write("\n")
+	return 0
+
+if __name__ == "__main__":
+	sys.exit(main())
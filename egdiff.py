@@ -0,0 +1,245 @@
+#	Existential Graph Manipulation Library
+#
+#	egdiff.py
+#
+#	Structural diffs: where two graphs differ (e.g. a student's sheet and the expected one), not just whether they do.
+#
+#	The two graphs are gone through from the top together.  At each pair of Levels, the children with equal fingerprints
+#	are matched with each other first, and are not looked at again, since they are equal all the way down.  Only what is
+#	left over is aligned: the unmatched children are paired by a bounded tree edit distance (the fewest atoms and cuts to
+#	insert or remove to turn one into the other, counting anything over bound as just "too far", and looking only depth
+#	Levels down, below which each unmatched cut counts as one edit), cheapest pairs first.  A pair is only kept when
+#	editing one into the other costs less than removing one and inserting the other, though a single unmatched cut on
+#	each side is always paired.  The pairs are then gone through in the same way, and what is left unpaired is reported
+#	as removed or inserted whole.  Finally, a cut removed in one place and an equal one inserted in another are reported
+#	as moved, as is an atom.
+#
+#	Once the fingerprints are known (they are cached on each Level, and kept up to date as it changes), the time this
+#	takes depends on how much differs (and on how long the paths down to the differences are, and how many children the
+#	Levels along them have), not on the size of the graphs: two big sheets that differ in a few places are diffed by
+#	going down a few paths.
+#
+#	To diff two save files (see egsave.py; only the Sheets are compared):		python3 -m egdiff expected.eg answer.eg
+
+from egml import preorder
+import collections
+import egsave
+import sys
+
+BOUND = 100
+DEPTH = 1
+MAX_PAIRS = 10000
+
+# A Change is one difference between graph and other:
+#	kind - "insert", "remove" or "move"
+#	atom - the atom, or None for a cut
+#	id - for a cut, its id in graph (None for an insert); for an atom, the id of the Level in graph it was in
+#	parent - for a cut, the id of the Level in graph it was in (None for an insert); unused for an atom
+#	other_id - for a cut, its id in other (None for a remove); for an atom, the id of the Level in other it is in
+#	other_parent - for a cut, the id of the Level in other it is in (None for a remove); unused for an atom
+class Change:
+	def __init__(self, kind, atom = None, id = None, parent = None, other_id = None, other_parent = None):
+		self.kind = kind
+		self.atom = atom
+		self.id = id
+		self.parent = parent
+		self.other_id = other_id
+		self.other_parent = other_parent
+		self._level = None		# The cut removed or inserted (while moves are being found)
+
+	def __str__(self):
+		if self.atom:
+			if self.kind == "insert":
+				return "insert %s into %d" % (self.atom, self.other_id)
+			elif self.kind == "remove":
+				return "remove %s from %d" % (self.atom, self.id)
+			return "move %s from %d to %d" % (self.atom, self.id, self.other_id)
+		if self.kind == "insert":
+			return "insert cut %d into %d" % (self.other_id, self.other_parent)
+		elif self.kind == "remove":
+			return "remove cut %d from %d" % (self.id, self.parent)
+		return "move cut %d from %d to %d (as %d)" % (self.id, self.parent, self.other_parent, self.other_id)
+
+	def __repr__(self):
+		return "<Change: %s>" % self
+
+# Returns the Changes that turn graph into other (both Levels: Sheets, or disconnected Levels), in the order they
+# were found going down.  Equal graphs have no Changes.
+def diff(graph, other, bound = BOUND, depth = DEPTH):
+	return Differ(bound, depth).diff(graph, other)
+
+# The size of the graph under level (its cut, and each atom and cut in it), counting no further than cap.
+def _size(level, cap):
+	size = 0
+	for item in preorder(level):
+		size += 1 + len(item.atoms)
+		if size > cap:
+			break
+	return size
+
+# The children of level and of other that have no child with the same fingerprint on the other side.
+def _unmatched(level, other):
+	counts = dict(other.child_prints())
+	first = []
+	for child in level.children:
+		child_print = child.fingerprint()
+		if counts.get(child_print):
+			counts[child_print] -= 1
+		else:
+			first.append(child)
+	counts = dict(level.child_prints())
+	second = []
+	for child in other.children:
+		child_print = child.fingerprint()
+		if counts.get(child_print):
+			counts[child_print] -= 1
+		else:
+			second.append(child)
+	return first, second
+
+# The atoms in level but not in other, and those in other but not in level (with repeats).
+def _atom_changes(level, other):
+	atoms = collections.Counter(level.atoms)
+	other_atoms = collections.Counter(other.atoms)
+	return sorted((atoms - other_atoms).elements()), sorted((other_atoms - atoms).elements())
+
+# A Differ keeps the distances it has worked out (by the fingerprints of the pair), so they are only worked out once.
+#	bound - how far apart two graphs can be before they count as unrelated
+#	depth - how many Levels down a distance looks; below that, each unmatched cut on the bigger side counts as one edit
+class Differ:
+	def __init__(self, bound = BOUND, depth = DEPTH):
+		self.bound = bound
+		self.depth = depth
+		self._distances = {}	# (fingerprint, fingerprint, depth) -> (distance, whether it is exact or just more than bound)
+
+	# The edit distance between the graphs under level and other (looking depth Levels down), or something more than
+	# bound if it is more.  Chains of single unmatched cuts are followed in a loop rather than recursed into.
+	def distance(self, level, other, bound, depth):
+		key = (level.fingerprint(), other.fingerprint(), depth)
+		known = self._distances.get(key)
+		if known and (known[1] or known[0] > bound):
+			return known[0]
+		cost = 0
+		while cost <= bound and level.fingerprint() != other.fingerprint():
+			removed, inserted = _atom_changes(level, other)
+			cost += len(removed) + len(inserted)
+			first, second = _unmatched(level, other)
+			if not depth:
+				cost += max(len(first), len(second))
+				break
+			depth -= 1
+			if len(first) == 1 and len(second) == 1:
+				level, other = first[0], second[0]
+			elif cost <= bound:
+				cost += self.align(first, second, bound - cost, depth)[0]
+				break
+		self._distances[key] = (cost, cost <= bound)
+		return cost
+
+	# Pairs up the children in first with those in second, by their distances depth Levels down.
+	# Returns (cost, pairs, the unpaired children of first, the unpaired children of second).
+	def align(self, first, second, bound, depth):
+		if len(first) == 1 and len(second) == 1:
+			return self.distance(first[0], second[0], bound, depth), [(first[0], second[0])], [], []
+		sizes = [_size(child, bound) for child in first]
+		other_sizes = [_size(child, bound) for child in second]
+		candidates = []
+		for i in range(len(first)):
+			for j in range(len(second)):
+				if len(candidates) >= MAX_PAIRS:
+					break
+				apart = sizes[i] + other_sizes[j]
+				distance = self.distance(first[i], second[j], min(bound, apart - 1), depth)
+				if distance < apart:
+					candidates.append((distance, i, j))
+		candidates.sort()
+		cost = 0
+		pairs = []
+		paired = set()
+		other_paired = set()
+		for distance, i, j in candidates:
+			if not i in paired and not j in other_paired:
+				paired.add(i)
+				other_paired.add(j)
+				pairs.append((first[i], second[j]))
+				cost += distance
+		unpaired = [first[i] for i in range(len(first)) if not i in paired]
+		other_unpaired = [second[j] for j in range(len(second)) if not j in other_paired]
+		cost += sum(sizes[i] for i in range(len(first)) if not i in paired)
+		cost += sum(other_sizes[j] for j in range(len(second)) if not j in other_paired)
+		return cost, pairs, unpaired, other_unpaired
+
+	# Returns the Changes that turn graph into other (see diff()).
+	def diff(self, graph, other):
+		changes = []
+		stack = [(graph, other)]
+		while stack:
+			level, other_level = stack.pop()
+			if level.fingerprint() == other_level.fingerprint():
+				continue
+			removed, inserted = _atom_changes(level, other_level)
+			for atom in removed:
+				changes.append(Change("remove", atom, id = level.id, other_id = other_level.id))
+			for atom in inserted:
+				changes.append(Change("insert", atom, id = level.id, other_id = other_level.id))
+			first, second = _unmatched(level, other_level)
+			if not first and not second:
+				continue
+			cost, pairs, unpaired, other_unpaired = self.align(first, second, self.bound, self.depth)
+			for child in unpaired:
+				changes.append(Change("remove", id = child.id, parent = level.id))
+				changes[-1]._level = child
+			for child in other_unpaired:
+				changes.append(Change("insert", other_id = child.id, other_parent = other_level.id))
+				changes[-1]._level = child
+			stack.extend(reversed(pairs))
+		return _find_moves(changes)
+
+# Turns each removed cut (or atom) that has an equal inserted one into a move (in the removal's place).
+def _find_moves(changes):
+	inserted = collections.defaultdict(list)
+	for index, change in enumerate(changes):
+		if change.kind == "insert":
+			inserted[change.atom or change._level.fingerprint()].append(index)
+	moves = {}
+	for index, change in enumerate(changes):
+		if change.kind == "remove":
+			key = change.atom or change._level.fingerprint()
+			if inserted.get(key):
+				moves[index] = inserted[key].pop(0)
+	dropped = set(moves.values())
+	result = []
+	for index, change in enumerate(changes):
+		if index in moves:
+			target = changes[moves[index]]
+			result.append(Change("move", change.atom, change.id, change.parent, target.other_id, target.other_parent))
+		elif not index in dropped:
+			result.append(change)
+	for change in result:
+		change._level = None
+	return result
+
+def main(argv = None):
+	if argv is None:
+		argv = sys.argv[1:]
+	if len(argv) != 2:
+		sys.stderr.write("usage: python3 -m egdiff <save file> <save file>\n")
+		return 2
+	sheets = []
+	try:
+		for path in argv:
+			with open(path, "rb") as stream:
+				sheets.append(egsave.load(stream)[0])
+	except (IOError, egsave.EGLoadError):
+		type_, value_, tb_ = sys.exc_info()
+		sys.stderr.write("egdiff: " + str(value_) + "\n")
+		return 2
+	changes = diff(sheets[0], sheets[1])
+	for change in changes:
+		print(change)
+	if changes:
+		return 1
+	return 0
+
+if __name__ == "__main__":
+	sys.exit(main())
@@ -0,0 +1,314 @@
+#	Existential Graph Manipulation Library
+#
+#	eggrade.py
+#
+#	The "Grade Grinder": a local HTTP service that checks proof logs (see eglog.py) and sends back verdicts.
+#
+#	From the command line:		python3 -m eggrade [--port 8080 | --unix PATH] [--workers N] [--queue 100] [--timeout 10]
+#
+#	Requests:
+#		POST /grade		the body is one proof log; the response is its verdict, as JSON:
+#							{"ok": ..., "steps": ..., "line": ..., "error": ..., "hash": ..., "cached": ...}
+#		POST /batch		the body is lines of JSON, each {"id": <anything>, "log": <a proof log>}; the response streams
+#						back one line of JSON per log (its verdict, plus its "id") as each one is graded
+#		GET /status		counts of the logs graded so far, as JSON
+#
+#	Logs are checked by eglog.verify() on a pool of worker processes, each job with a time limit (and, where the OS
+#	allows it, the workers with a memory limit).  A log also fails if it has no proof in it (it never goes into solve
+#	mode) or its last line is cut off.  Verdicts are cached by the SHA-256 of the log, so a log that was already graded
+#	gets its verdict straight back; a log that timed out, or whose worker failed, is graded again if it is sent again.
+#	Jobs wait for a worker in a bounded queue: when it is full, /grade answers 503 (try again later).  A batch has no
+#	more of its logs in the queue at once than there are workers, and waits for room before queueing the next one, so
+#	a big batch can't fill the queue and shut /grade out.
+#
+#	(This module needs Python 3.7 or later, for asyncio.run() and async/await.)
+
+import eglog
+import argparse
+import asyncio
+import collections
+import concurrent.futures
+import hashlib
+import json
+import multiprocessing
+import sys
+import time
+
+try:
+	import resource
+except ImportError:
+	resource = None
+
+# EGGradeBusy: raised when a log can't be queued because the queue is full.
+class EGGradeBusy(Exception):
+	def __init__(self, str):
+		self.string = str
+	def __str__(self):
+		return self.string
+
+############### Worker Processes ###############
+
+class _TimedOut(Exception):
+	pass
+
+# Gives up (by raising _TimedOut) once the deadline has passed, between one line of the log and the next.
+def _until(lines, deadline):
+	for line in lines:
+		if time.monotonic() > deadline:
+			raise _TimedOut()
+		yield line
+
+# Notes whether the log it checks gets as far as solve mode (see eglog.verify()).
+class _Solving:
+	def __init__(self):
+		self.solving = False
+	def __call__(self, replayer, action):
+		self.solving = replayer.solving
+
+# Checks one log (run in a worker process).  Returns the verdict as a dict, and whether it is the log's own verdict
+# (rather than a time or memory limit running out), so that it can be cached.
+# A log that eglog accepts still fails if it has no proof (it never goes into solve mode, e.g. it is just a header) or
+# if its last line was cut off.
+def grade_log(text, timeout):
+	solving = _Solving()
+	try:
+		verdict = eglog.verify(_until(text.splitlines(True), time.monotonic() + timeout), solving)
+	except _TimedOut:
+		return {"ok": False, "steps": None, "line": None, "error": "timed out."}, False
+	except MemoryError:
+		return {"ok": False, "steps": None, "line": None, "error": "out of memory."}, False
+	if verdict.ok and text and not text.endswith("\n"):
+		return {"ok": False, "steps": verdict.steps, "line": text.count("\n") + 1, "error": "the log is truncated."}, True
+	if verdict.ok and not solving.solving:
+		error = "the log has no proof (it never goes into solve mode)."
+		return {"ok": False, "steps": verdict.steps, "line": None, "error": error}, True
+	return {"ok": verdict.ok, "steps": verdict.steps, "line": verdict.line, "error": verdict.error}, True
+
+# Run in each worker process as it starts: limits how much memory it can use.
+def _limit_memory(limit):
+	if limit and resource:
+		resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+################### The Service ###################
+
+# A GradingService grades logs (with grade()) and serves the HTTP requests above (with serve()).
+#	workers - how many worker processes to grade with (by default, one per CPU)
+#	queue_size - how many logs can wait for a worker
+#	timeout - how many seconds each log may take
+#	memory - how many bytes each worker process may use (None for no limit)
+#	cache_size - how many verdicts to keep; past that, the least recently used are dropped
+#	max_log - the largest log (in bytes) that is accepted
+class GradingService:
+	def __init__(self, workers = None, queue_size = 100, timeout = 10.0, memory = None, cache_size = 10000, max_log = 16 * 2 ** 20):
+		self.workers = workers or multiprocessing.cpu_count()
+		self.memory = memory
+		self.pool = self._new_pool()
+		self.queue = asyncio.Queue(queue_size)
+		self.timeout = timeout
+		self.cache = collections.OrderedDict()	# hash -> verdict
+		self.cache_size = cache_size
+		self.max_log = max_log
+		self.pending = {}		# hash -> the Future of its verdict, for logs being graded right now
+		self.counts = {"graded": 0, "cached": 0, "busy": 0}
+		self.tasks = []
+
+	# The workers are spawned rather than forked, so that they don't hold on to copies of the server's open sockets.
+	def _new_pool(self):
+		context = multiprocessing.get_context("spawn")
+		return concurrent.futures.ProcessPoolExecutor(self.workers, context, _limit_memory, (self.memory,))
+
+	# Starts the tasks that hand queued logs to the workers.  (Called by serve(), or call it before using grade() alone.)
+	def start(self):
+		if not self.tasks:
+			self.tasks = [asyncio.ensure_future(self._work()) for i in range(self.workers)]
+
+	def close(self):
+		for task in self.tasks:
+			task.cancel()
+		self.tasks = []
+		self.pool.shutdown(wait = False)
+
+	# Returns the verdict (a dict) of a log, given as bytes.
+	# If the queue is full, this raises EGGradeBusy, or waits for room if wait is True.
+	async def grade(self, log, wait = False):
+		hash = hashlib.sha256(log).hexdigest()
+		if hash in self.cache:
+			self.cache.move_to_end(hash)
+			self.counts["cached"] += 1
+			return dict(self.cache[hash], hash = hash, cached = True)
+		future = self.pending.get(hash)
+		if future is None:
+			if self.queue.full() and not wait:
+				self.counts["busy"] += 1
+				raise EGGradeBusy("the queue is full.")
+			future = self.pending[hash] = asyncio.get_event_loop().create_future()
+			try:
+				await self.queue.put((hash, log))
+			except BaseException:
+				del self.pending[hash]
+				raise
+		verdict = await asyncio.shield(future)
+		return dict(verdict, hash = hash, cached = False)
+
+	async def _work(self):
+		loop = asyncio.get_event_loop()
+		while True:
+			hash, log = await self.queue.get()
+			try:
+				text = log.decode("utf-8")
+			except UnicodeDecodeError:
+				verdict, final = {"ok": False, "steps": None, "line": None, "error": "the log is not UTF-8 text."}, True
+			else:
+				# The worker stops itself at the timeout; this is in case it can't (e.g. it is stuck on one line).
+				# (A pool that broke between jobs raises as soon as it is given one.)
+				pool = self.pool
+				try:
+					job = loop.run_in_executor(pool, grade_log, text, self.timeout)
+					verdict, final = await asyncio.wait_for(job, self.timeout * 2 + 1)
+				except asyncio.TimeoutError:
+					verdict, final = {"ok": False, "steps": None, "line": None, "error": "timed out."}, False
+					self._replace_pool(pool)
+				except concurrent.futures.process.BrokenProcessPool:
+					verdict, final = {"ok": False, "steps": None, "line": None, "error": "grading failed: a worker died."}, False
+					self._replace_pool(pool)
+				except Exception:
+					type_, value_, tb_ = sys.exc_info()
+					verdict, final = {"ok": False, "steps": None, "line": None, "error": "grading failed: " + str(value_)}, False
+			# Only the log's own verdict is kept: after a timeout or a failure, sending the log again grades it again.
+			if final:
+				self.cache[hash] = verdict
+				if len(self.cache) > self.cache_size:
+					self.cache.popitem(last = False)
+			self.counts["graded"] += 1
+			self.pending.pop(hash).set_result(verdict)
+
+	# Starts over with new workers, when one is stuck or has died.  The old workers are terminated, since a stuck one
+	# would otherwise keep running (shutdown() only waits for them, or doesn't).  The other jobs they had fail, and are
+	# graded again if they are sent again.  (Nothing is done if pool, the one that failed, was already replaced.)
+	def _replace_pool(self, pool):
+		if not pool is self.pool:
+			return
+		processes = list((pool._processes or {}).values())
+		pool.shutdown(wait = False)
+		for process in processes:
+			process.terminate()
+		self.pool = self._new_pool()
+
+	def status(self):
+		return dict(self.counts, queued = self.queue.qsize(), workers = self.workers, cache = len(self.cache))
+
+	################## HTTP ##################
+
+	# Serves HTTP on host and port, or on the Unix socket at path (if given), until cancelled.
+	async def serve(self, host = "127.0.0.1", port = 8080, path = None):
+		self.start()
+		if path:
+			server = await asyncio.start_unix_server(self._handle, path)
+		else:
+			server = await asyncio.start_server(self._handle, host, port)
+		try:
+			await server.serve_forever()
+		finally:
+			server.close()
+			self.close()
+
+	async def _handle(self, reader, writer):
+		try:
+			try:
+				method, target, body = await self._read_request(reader)
+			except (ValueError, asyncio.IncompleteReadError):
+				await self._respond(writer, 400, {"error": "bad request."})
+				return
+			if body is None:
+				await self._respond(writer, 413, {"error": "the log is too big."})
+			elif method == "POST" and target == "/grade":
+				try:
+					await self._respond(writer, 200, await self.grade(body))
+				except EGGradeBusy:
+					await self._respond(writer, 503, {"error": "busy, try again later."}, ["Retry-After: 1"])
+			elif method == "POST" and target == "/batch":
+				await self._batch(writer, body)
+			elif method == "GET" and target == "/status":
+				await self._respond(writer, 200, self.status())
+			else:
+				await self._respond(writer, 404, {"error": "not found."})
+		except ConnectionError:
+			pass
+		finally:
+			writer.close()
+
+	# Returns the method, target and body of a request (the body is None if it is bigger than max_log).
+	async def _read_request(self, reader):
+		request = (await reader.readline()).decode("latin-1").split()
+		if len(request) != 3:
+			raise ValueError("bad request line")
+		length = 0
+		while True:
+			line = (await reader.readline()).decode("latin-1")
+			if line in ("\r\n", "\n", ""):
+				break
+			name, colon, value = line.partition(":")
+			if name.strip().lower() == "content-length":
+				length = int(value)
+		if length < 0:
+			raise ValueError("bad length")
+		if length > self.max_log:
+			return request[0], request[1], None
+		return request[0], request[1], await reader.readexactly(length)
+
+	async def _respond(self, writer, status, result, headers = ()):
+		body = (json.dumps(result) + "\n").encode()
+		head = ["HTTP/1.1 %d %s" % (status, _REASONS[status]), "Content-Type: application/json",
+			"Content-Length: %d" % len(body), "Connection: close"] + list(headers)
+		writer.write(("\r\n".join(head) + "\r\n\r\n").encode() + body)
+		await writer.drain()
+
+	# Grades each log of a batch, sending each verdict back (in a chunk of its own) as soon as it is ready.
+	# Only as many logs as there are workers are queued or being graded at once (the rest wait their turn here, not in
+	# the queue), so a big batch can't crowd everyone else out.
+	async def _batch(self, writer, body):
+		try:
+			jobs = [json.loads(line) for line in body.decode("utf-8").splitlines() if line.strip()]
+			if not all(type(job) is dict and type(job.get("log")) is str for job in jobs):
+				raise ValueError("each line needs a log")
+		except ValueError:
+			await self._respond(writer, 400, {"error": "each line must be JSON with a \"log\"."})
+			return
+		head = ["HTTP/1.1 200 OK", "Content-Type: application/x-ndjson", "Transfer-Encoding: chunked", "Connection: close"]
+		writer.write(("\r\n".join(head) + "\r\n\r\n").encode())
+		window = asyncio.Semaphore(self.workers)
+		async def grade(job):
+			async with window:
+				return dict(await self.grade(job["log"].encode("utf-8"), wait = True), id = job.get("id"))
+		for finished in asyncio.as_completed([grade(job) for job in jobs]):
+			line = (json.dumps(await finished) + "\n").encode()
+			writer.write(b"%x\r\n" % len(line) + line + b"\r\n")
+			await writer.drain()
+		writer.write(b"0\r\n\r\n")
+		await writer.drain()
+
+_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 413: "Payload Too Large", 503: "Service Unavailable"}
+
+def main(argv = None):
+	parser = argparse.ArgumentParser(prog = "eggrade", description = "Grade EGML proof logs over HTTP.")
+	parser.add_argument("--host", default = "127.0.0.1", help = "the address to listen on")
+	parser.add_argument("--port", type = int, default = 8080, help = "the port to listen on")
+	parser.add_argument("--unix", metavar = "PATH", help = "listen on a Unix socket instead")
+	parser.add_argument("--workers", type = int, help = "how many worker processes to use (default: one per CPU)")
+	parser.add_argument("--queue", type = int, default = 100, help = "how many logs can wait to be graded")
+	parser.add_argument("--timeout", type = float, default = 10.0, help = "how many seconds each log may take")
+	parser.add_argument("--memory", type = int, metavar = "MB", help = "how much memory each worker may use")
+	parser.add_argument("--cache", type = int, default = 10000, help = "how many verdicts to keep")
+	args = parser.parse_args(argv)
+
+	async def run():
+		service = GradingService(args.workers, args.queue, args.timeout, args.memory and args.memory * 2 ** 20, args.cache)
+		await service.serve(args.host, args.port, args.unix)
+	try:
+		asyncio.run(run())
+	except KeyboardInterrupt:
+		pass
+	return 0
+
+if __name__ == "__main__":
+	sys.exit(main())
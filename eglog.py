@@ -0,0 +1,398 @@
+#	Existential Graph Manipulation Library
+#
+#	eglog.py
+#
+#	Proof logs: an append-only record of every setup and solve action done to a Sheet, and a verifier that replays one.
+#
+#	A log is a header line followed by one line per action:
+#
+#		EGML-LOG 1
+#		<checksum> <action>
+#		<checksum> <action>
+#		...
+#
+#	Each checksum is the CRC-32 (8 hex digits) of the action, chained from the checksum of the line before it (the first
+#	one from the header), so changing, dropping or reordering any line breaks every checksum after it.
+#
+#	The actions are (<id> is the id of the Level the action was done to):
+#		sheet						a new Sheet of assertion (always the first action)
+#		solve						the switch to solve mode; from here on only the rules are allowed
+#		checkout <version>			undo, redo or checkout: the Sheet goes back (or forward) to the given version
+#									(version 0 is the Sheet at the switch to solve mode, and each rule makes a new one)
+#		create <id> <child id>		create level (the new Level gets <child id>)
+#		create <id> <atom>			create atom
+#		delete <id>					delete level
+#		delete <id> <atom>			delete atom
+#		dc+ <id> <first id> [atoms]	insert doublecut (around the Level, or around the comma-separated atoms in it);
+#									the two new Levels get <first id> and <first id> + 1
+#		dc- <id>					remove doublecut
+#		insert <id> <atom>			insert an atom
+#		insert <id> <graph>			insert a graph
+#		remove <id> <atom>			remove an atom
+#		remove <id> <child id>		remove a child Level
+#		iterate <id> <atom>			iterate an atom
+#		iterate <id> <graph>		iterate a graph
+#		deiterate <id> <atom>		deiterate an atom
+#		deiterate <id> <child id>	deiterate a child Level
+#
+#	A <graph> is written out in full, with its ids, as (<id> <atoms...> <graphs...>), e.g. (12 A B (13 C)).
+#
+#	To check a log from the command line:  python3 -m eglog proof.log
+
+from egml import Sheet, Level, Event, is_atom_name, preorder, set_sink
+import sys
+import zlib
+
+LOG_HEADER = "EGML-LOG 1"
+
+# EGLogError: errors raised from malformed (or tampered-with) logs.
+class EGLogError(Exception):
+	def __init__(self, str):
+		self.string = str
+	def __str__(self):
+		return self.string
+
+# Writes a graph (a Level and everything in it) out in the log's (<id> <atoms...> <graphs...>) notation.
+def format_graph(level):
+	parts = []
+	stack = [level]
+	while stack:
+		item = stack.pop()
+		if item is None:
+			parts.append(")")
+			continue
+		parts.append("(" + str(item.id))
+		parts.extend(item.atoms)
+		stack.append(None)
+		stack.extend(reversed(item.children))
+	return " ".join(parts).replace(" )", ")")
+
+# Builds the disconnected graph written out by format_graph(), drawing its ids from (but not attaching it to) sheet.
+def parse_graph(text, sheet):
+	tokens = text.replace("(", " ( ").replace(")", " ) ").split()
+	root = None
+	stack = []
+	expect_id = False
+	for token in tokens:
+		if token == "(":
+			if expect_id:
+				raise EGLogError("missing id in graph.")
+			expect_id = True
+		elif expect_id:
+			if not token.isdigit():
+				raise EGLogError("missing id in graph.")
+			id = int(token)
+			if id < 1 or sheet.find(id):
+				raise EGLogError("graph id %d is already in use." % id)
+			if stack:
+				level = Level(stack[-1], new_id = id)
+				stack[-1]._add_child(level)
+			elif root is None:
+				level = root = Level(None, new_id = id, sheet = sheet)
+			else:
+				raise EGLogError("more than one graph given.")
+			if id >= sheet.next_id:
+				sheet.next_id = id + 1
+			stack.append(level)
+			expect_id = False
+		elif token == ")":
+			if not stack:
+				raise EGLogError("unbalanced parentheses in graph.")
+			stack.pop()
+		elif is_atom_name(token) and stack:
+			stack[-1]._add_atom(token)
+		else:
+			raise EGLogError("unexpected '%s' in graph." % token)
+	if root is None or stack or expect_id:
+		raise EGLogError("incomplete graph.")
+	return root
+
+# A ProofLog is an event sink (see egml.set_sink()) that records the actions done to one Sheet to a file-like object.
+# It records the first Sheet created after it starts listening; work done on disconnected Levels isn't recorded until
+# it is inserted or iterated into that Sheet, at which point the whole graph is written out.
+class ProofLog:
+	# The following variables are defined:
+	#	stream - where the log is written
+	#	sheet - the Sheet being recorded
+	#	checksum - the checksum of the last line written
+	#	size - how many lines are buffered before they are written out
+
+	def __init__(self, stream, size = 1000):
+		self.stream = stream
+		self.size = size
+		self.sheet = None
+		self.buffer = []
+		self.stream.write(LOG_HEADER + "\n")
+		self.checksum = zlib.crc32(LOG_HEADER.encode())
+
+	# Records the switch to solve mode (egml itself has no modes, so whoever switches has to call this).
+	def solve(self):
+		self.record("solve")
+
+	def record(self, action):
+		self.checksum = zlib.crc32(action.encode(), self.checksum)
+		self.buffer.append("%08x %s\n" % (self.checksum, action))
+		if len(self.buffer) >= self.size:
+			self.flush()
+
+	def emit(self, event):
+		level = event.level
+		if event.kind == Event.CREATED:
+			if self.sheet is None and type(level) is Sheet:
+				self.sheet = level
+				self.record("sheet")
+			return
+		if event.kind == Event.HISTORY:
+			if level is self.sheet:
+				self.record("checkout %d" % event.data["version"])
+			return
+		if not (event.kind == Event.RULE or event.kind == Event.SETUP):
+			return
+		if self.sheet is None or not level.sheet is self.sheet or not level.get_sheet():
+			return
+		data = event.data
+		if event.kind == Event.SETUP:
+			if data["action"] == "load":
+				self._record_graph(level)
+			elif "child" in data:
+				self.record("create %d %d" % (event.id, data["child"]))
+			elif data["action"] == "create":
+				self.record("create %d %s" % (event.id, data["atom"]))
+			elif "atom" in data:
+				self.record("delete %d %s" % (event.id, data["atom"]))
+			else:
+				self.record("delete %d" % event.id)
+			return
+		rule = data["rule"]
+		if rule == "ins_doublecut":
+			atoms = data["atoms"]
+			if not atoms:
+				self.record("dc+ %d %d" % (event.id, data["first"]))
+			elif type(atoms) is str:
+				self.record("dc+ %d %d %s" % (event.id, data["first"], atoms))
+			else:
+				self.record("dc+ %d %d %s" % (event.id, data["first"], ",".join(atoms)))
+		elif rule == "rem_doublecut":
+			self.record("dc- %d" % event.id)
+		elif "atom" in data:
+			self.record("%s %d %s" % (rule, event.id, data["atom"]))
+		elif rule == "insert" or rule == "iterate":
+			self.record("%s %d %s" % (rule, event.id, format_graph(self.sheet.find(data["level"]))))
+		else:
+			self.record("%s %d %d" % (rule, event.id, data["level"]))
+
+	# Records the graph under level (built all at once, e.g. loaded from a file) as the creates that would have built it.
+	def _record_graph(self, level):
+		for item in preorder(level):
+			if not item is level:
+				self.record("create %d %d" % (item.parent.id, item.id))
+			for atom in item.atoms:
+				self.record("create %d %s" % (item.id, atom))
+
+	def flush(self):
+		if self.buffer:
+			self.stream.write("".join(self.buffer))
+			self.buffer = []
+		self.stream.flush()
+
+	def close(self):
+		self.flush()
+		self.stream.close()
+
+# The outcome of verifying a log:
+#	ok - True if every step was well-formed and legal
+#	steps - how many actions were replayed successfully
+#	line - the line number of the first bad line (None if there wasn't one)
+#	error - what was wrong with it
+#	sheet - the Sheet as it was after the last good step
+class Verdict:
+	def __init__(self, ok, steps, line = None, error = None, sheet = None):
+		self.ok = ok
+		self.steps = steps
+		self.line = line
+		self.error = error
+		self.sheet = sheet
+
+	def __str__(self):
+		if self.ok:
+			return "ok: %d steps" % self.steps
+		return "line %d: %s" % (self.line, self.error)
+
+# Replays the actions of a log, one at a time, against a fresh Sheet.
+class Replayer:
+	def __init__(self):
+		self.sheet = None
+		self.solving = False
+
+	def _level(self, id):
+		level = self.sheet.find(int(id)) if id.isdigit() else False
+		if not level:
+			raise EGLogError("no Level with id %s in the Sheet." % id)
+		return level
+
+	# The next id the Sheet hands out has to be the one the log says was handed out.
+	def _next_id(self, id):
+		if not id.isdigit() or int(id) < self.sheet.next_id:
+			raise EGLogError("id %s is out of order." % id)
+		self.sheet.next_id = int(id)
+
+	# Looks up the child Level of level with the given id.
+	def _child(self, level, id):
+		child = self._level(id)
+		if not child.parent is level:
+			raise EGLogError("Level %s is not a child of Level %d." % (id, level.id))
+		return child
+
+	def apply(self, action):
+		words = action.split(" ", 2)
+		if len(words) == 1:
+			if action == "sheet":
+				if self.sheet:
+					raise EGLogError("there is already a Sheet.")
+				self.sheet = Sheet()
+			elif not self.sheet:
+				raise EGLogError("the log doesn't start with a Sheet.")
+			elif action == "solve":
+				if self.solving:
+					raise EGLogError("already in solve mode.")
+				self.solving = True
+				self.sheet.start_history()
+			else:
+				raise EGLogError("unrecognized action '%s'." % action)
+			return
+		if not self.sheet:
+			raise EGLogError("the log doesn't start with a Sheet.")
+		if words[0] == "checkout" and len(words) == 2:
+			if not self.solving:
+				raise EGLogError("'checkout' is only allowed in solve mode.")
+			if not words[1].isdigit():
+				raise EGLogError("bad version '%s'." % words[1])
+			self.sheet.history.checkout(int(words[1]))
+			return
+		action_function = Replayer.ACTIONS.get((words[0], len(words)))
+		if not action_function:
+			raise EGLogError("unrecognized action '%s'." % action)
+		if self.solving and action_function in Replayer.SETUP_ACTIONS:
+			raise EGLogError("'%s' is not allowed in solve mode." % words[0])
+		action_function(self, self._level(words[1]), words[2] if len(words) == 3 else None)
+
+	def _create(self, level, arg):
+		if is_atom_name(arg):
+			level.create(arg)
+		else:
+			self._next_id(arg)
+			level.create()
+
+	def _delete(self, level, arg):
+		if arg:
+			level.delete(arg)
+		else:
+			level.delete()
+
+	def _ins_doublecut(self, level, arg):
+		first = arg.split(" ")
+		self._next_id(first[0])
+		if len(first) == 1:
+			level.ins_doublecut()
+		elif len(first) == 2:
+			level.ins_doublecut(first[1].split(","))
+		else:
+			raise EGLogError("too many arguments to dc+.")
+
+	def _rem_doublecut(self, level, arg):
+		level.rem_doublecut()
+
+	def _insert(self, level, arg):
+		if is_atom_name(arg):
+			level.insert(atom = arg)
+		else:
+			level.insert(level = parse_graph(arg, self.sheet))
+
+	def _remove(self, level, arg):
+		if is_atom_name(arg):
+			level.remove(atom = arg)
+		else:
+			level.remove(level = self._child(level, arg))
+
+	def _iterate(self, level, arg):
+		if is_atom_name(arg):
+			level.iterate(atom = arg)
+		else:
+			level.iterate(level = parse_graph(arg, self.sheet))
+
+	def _deiterate(self, level, arg):
+		if is_atom_name(arg):
+			level.deiterate(atom = arg)
+		else:
+			level.deiterate(level = self._child(level, arg))
+
+	# The actions, by (name, number of words).
+	ACTIONS = {
+		("create", 3): _create, ("delete", 2): _delete, ("delete", 3): _delete,
+		("dc+", 3): _ins_doublecut, ("dc-", 2): _rem_doublecut,
+		("insert", 3): _insert, ("remove", 3): _remove, ("iterate", 3): _iterate, ("deiterate", 3): _deiterate,
+	}
+	SETUP_ACTIONS = set([_create, _delete])
+
+# Checks a log, given as an iterable of lines (e.g. an open file, which is read one line at a time), and returns a Verdict.
+# Every checksum has to match and every action has to be legal (and, after "solve", a rule).
+# If check is given, it is called with the Replayer and the action after each action is done; if it raises an exception,
+# the log fails at that line just as if the action had been illegal.
+def verify(lines, check = None):
+	replayer = Replayer()
+	steps = 0
+	number = 0
+	previous_sink = set_sink(None)
+	try:
+		checksum = None
+		for line in lines:
+			number += 1
+			line = line.rstrip("\r\n")
+			if checksum is None:
+				if line != LOG_HEADER:
+					return Verdict(False, steps, number, "not an EGML log (bad header).")
+				checksum = zlib.crc32(LOG_HEADER.encode())
+				continue
+			if not line:
+				continue
+			action = line[9:]
+			checksum = zlib.crc32(action.encode(), checksum)
+			if line[8:9] != " " or line[:8] != "%08x" % checksum:
+				return Verdict(False, steps, number, "checksum mismatch.", replayer.sheet)
+			try:
+				replayer.apply(action)
+				if check:
+					check(replayer, action)
+			except Exception:
+				type_, value_, tb_ = sys.exc_info()
+				return Verdict(False, steps, number, str(value_), replayer.sheet)
+			steps += 1
+		if checksum is None:
+			return Verdict(False, steps, number + 1, "empty log.")
+		return Verdict(True, steps, sheet = replayer.sheet)
+	finally:
+		set_sink(previous_sink)
+
+def main(argv = None):
+	if argv is None:
+		argv = sys.argv[1:]
+	if len(argv) != 1:
+		sys.stderr.write("usage: python3 -m eglog <log file>  (- for stdin)\n")
+		return 2
+	try:
+		if argv[0] == "-":
+			verdict = verify(sys.stdin)
+		else:
+			with open(argv[0]) as lines:
+				verdict = verify(lines)
+	except IOError:
+		type_, value_, tb_ = sys.exc_info()
+		sys.stderr.write("eglog: " + str(value_) + "\n")
+		return 2
+	print(verdict)
+	if verdict.ok:
+		return 0
+	return 1
+
+if __name__ == "__main__":
+	sys.exit(main())
@@ -4,6 +4,13 @@
 #	Trevor Toryk (torykt@rpi.edu)
 #	Mark Sgobba (sgobbm@rpi.edu)
 
+import collections
+import hashlib
+import io
+import logging
+import time
+import weakref
+
 # Exceptions (errors)
 # EGDoublecutError: errors raised from attempts to add or remove doublecuts in illogical ways.
 class EGDoublecutError(Exception):
@@ -35,123 +42,568 @@ class EGCopyError(Exception):
 		self.string = str
 	def __str__(self):
 		return self.string
+# EGHistoryError: errors raised from attempts to undo, redo or check out versions that don't exist.
+class EGHistoryError(Exception):
+	def __init__(self, str):
+		self.string = str
+	def __str__(self):
+		return self.string
+# EGInitializationException: errors raised when a Level cannot be given an id.
+class EGInitializationException(Exception):
+	def __init__(self, str):
+		self.string = str
+	def __str__(self):
+		return self.string
+
+# Events
+# egml doesn't print anything itself.  Everything it does to a graph is reported as an Event to the sink set with set_sink().
+# Without a sink (the default) no Events are even made, so using egml as a library costs nothing extra.
+class Event:
+	# The kinds of event:
+	CREATED = "created"				# a Level (or Sheet) was made (data: depth)
+	DEPTH = "depth"					# a Level (and everything in it) was moved to a new depth (data: depth)
+	ATOM_ADDED = "atom added"		# (data: atom)
+	ATOM_REMOVED = "atom removed"	# (data: atom)
+	LEVEL_ADDED = "level added"		# a Level was linked in as a child (data: child, the id of the child)
+	LEVEL_REMOVED = "level removed"	# a child Level was unlinked (data: child)
+	RULE = "rule"					# one of the solve mode rules was applied (data: rule, plus its arguments)
+	SETUP = "setup"					# a setup mode function was called (data: action, plus its arguments), or a
+									# whole graph was built at once (action "load", with levels, how many Levels)
+	HISTORY = "history"				# the Sheet was moved to another version by undo, redo or checkout (data: version)
+	
+	def __init__(self, kind, subject, **data):
+		self.kind = kind
+		self.level = subject
+		self.id = subject.id
+		self.context = subject.context_repr
+		self.data = data
+	
+	def __str__(self):
+		if self.kind == Event.CREATED:
+			return self.context + " depth " + str(self.data["depth"]) + " created"
+		elif self.kind == Event.DEPTH:
+			return self.context + " updated: new depth is " + str(self.data["depth"])
+		elif self.kind == Event.ATOM_ADDED:
+			return self.context + " updated: added atom " + self.data["atom"]
+		elif self.kind == Event.ATOM_REMOVED:
+			return self.context + " updated: removed atom " + self.data["atom"]
+		elif self.kind == Event.LEVEL_ADDED:
+			return self.context + " updated: added child level " + str(self.data["child"])
+		elif self.kind == Event.LEVEL_REMOVED:
+			return self.context + " updated: removed child level " + str(self.data["child"])
+		elif self.kind == Event.HISTORY:
+			return self.context + " updated: now at version " + str(self.data["version"])
+		elif self.kind == Event.SETUP:
+			args = ", ".join("%s = %s" % (key, self.data[key]) for key in sorted(self.data) if key != "action")
+			return self.context + " updated: " + self.data["action"] + "(" + args + ")"
+		else:
+			args = ", ".join("%s = %s" % (key, self.data[key]) for key in sorted(self.data) if key != "rule")
+			return self.context + " updated: applied " + self.data["rule"] + "(" + args + ")"
+	
+	def __repr__(self):
+		return "Event(%r, %d, %r)" % (self.kind, self.id, self.data)
+
+# Sinks: anything with emit(event) and flush() methods can be given to set_sink().  These are the ones egml comes with.
+# NullSink: drops every Event (setting it is the same as having no sink at all).
+class NullSink:
+	def emit(self, event):
+		pass
+	def flush(self):
+		pass
+
+# BufferedSink: writes Events as lines of text to a file-like object, size at a time (or whenever flush() is called).
+class BufferedSink:
+	def __init__(self, stream, size = 1000):
+		self.stream = stream
+		self.size = size
+		self.buffer = []
+	def emit(self, event):
+		self.buffer.append(str(event))
+		if len(self.buffer) >= self.size:
+			self.flush()
+	def flush(self):
+		if self.buffer:
+			self.stream.write("\n".join(self.buffer) + "\n")
+			self.buffer = []
+		self.stream.flush()
+
+# LoggingSink: passes Events on to a logger from the logging module (the "egml" logger by default).
+# The Event itself is attached to each record as record.egml_event.
+class LoggingSink:
+	def __init__(self, logger = None, level = logging.INFO):
+		self.logger = logger or logging.getLogger("egml")
+		self.level = level
+	def emit(self, event):
+		if self.logger.isEnabledFor(self.level):
+			self.logger.log(self.level, "%s", event, extra = {"egml_event": event})
+	def flush(self):
+		pass
+
+# MultiSink: sends every Event on to each of the given sinks, in order.
+class MultiSink:
+	def __init__(self, *sinks):
+		self.sinks = list(sinks)
+	def emit(self, event):
+		for sink in self.sinks:
+			sink.emit(event)
+	def flush(self):
+		for sink in self.sinks:
+			sink.flush()
+
+_sink = None
+
+# Sets the sink that Events are sent to (None or a NullSink to stop sending them), and returns the previous one.
+def set_sink(sink = None):
+	global _sink
+	previous = _sink
+	if isinstance(sink, NullSink):
+		sink = None
+	_sink = sink
+	return previous
+
+# Stats
+# Counts and times calls to the rules and the main helpers, once enable_stats() is called.  It works by putting timing
+# wrappers in place of the functions in _PROFILED, and disable_stats() puts the originals back, so while it's off (the
+# default) it costs nothing at all.
+# The times are exclusive: when one timed function calls another (a rule calling justification(), say), the time spent
+# in the inner one counts only for it, so the totals add up to no more than the time actually spent.
+_PROFILED = ["ins_doublecut", "rem_doublecut", "insert", "remove", "iterate", "deiterate", "create", "delete",
+	"find", "equal", "set_depth", "copy", "fingerprint", "justification"]
+_stats = None
+
+class _Stats:
+	def __init__(self, samples):
+		self.samples = samples
+		self.calls = {}		# name -> [count, total seconds, the times of the last samples calls]
+		self.originals = []	# (class, name, function) for each function replaced
+		self.inner = []		# For each timed call under way, the seconds spent so far in the timed calls it made
+	
+	def record(self, name, seconds):
+		entry = self.calls.get(name)
+		if entry is None:
+			entry = self.calls[name] = [0, 0.0, collections.deque(maxlen = self.samples)]
+		entry[0] += 1
+		entry[1] += seconds
+		entry[2].append(seconds)
+
+def _timed(name, function):
+	def timed(*args, **kwargs):
+		stats = _stats
+		if stats:
+			stats.inner.append(0.0)
+		start = time.perf_counter()
+		try:
+			return function(*args, **kwargs)
+		finally:
+			if stats:
+				seconds = time.perf_counter() - start
+				stats.record(name, seconds - stats.inner.pop())
+				if stats.inner:
+					stats.inner[-1] += seconds
+	return timed
+
+# Starts counting (again from nothing).  Percentiles are taken over the last samples calls of each function.
+def enable_stats(samples = 10000):
+	global _stats
+	disable_stats()
+	_stats = _Stats(samples)
+	for owner in (Level, Sheet):
+		for name in _PROFILED:
+			if name in owner.__dict__:
+				_stats.originals.append((owner, name, owner.__dict__[name]))
+				setattr(owner, name, _timed("copy_graph" if name == "copy" else name, owner.__dict__[name]))
+
+def disable_stats():
+	global _stats
+	if _stats:
+		for owner, name, function in _stats.originals:
+			setattr(owner, name, function)
+	_stats = None
+
+def stats_enabled():
+	return _stats is not None
+
+# Returns the stats as a dict:
+#	calls - for each function called since enable_stats(): count, total (seconds), mean, p50, p90, p99 and max (seconds),
+#		all of them not counting the time spent in the other timed functions it called
+#	levels, atoms - how many Levels (including the Sheet) and atoms are in sheet, if it is given
+def get_stats(sheet = None):
+	calls = {}
+	if _stats:
+		for name in _stats.calls:
+			count, total, samples = _stats.calls[name]
+			samples = sorted(samples)
+			calls[name] = {"count": count, "total": total, "mean": total / count, "max": samples[-1],
+				"p50": _percentile(samples, 50), "p90": _percentile(samples, 90), "p99": _percentile(samples, 99)}
+	result = {"calls": calls}
+	if sheet:
+		result["levels"] = len(sheet.levels)
+		result["atoms"] = sum(sum(level._atom_counts().values()) for level in sheet.levels.values())
+	return result
+
+def _percentile(samples, percent):
+	return samples[min(len(samples) - 1, len(samples) * percent // 100)]
+
+# Traversals
+# These walk a graph with an explicit stack instead of recursion, so they work no matter how deeply the cuts are nested.
+# None of them expect the graph to be changed while they are walking it.
+
+# Yields level and every Level under it, each Level before the Levels in it (children in order).
+def preorder(level):
+	stack = [level]
+	while stack:
+		item = stack.pop()
+		yield item
+		if item.children:
+			stack.extend(reversed(item.children))
+
+# Like preorder(), but yields (item, depth) pairs, where depth is how many cuts item is below level.
+def walk(level):
+	stack = [(level, 0)]
+	while stack:
+		item, depth = stack.pop()
+		yield item, depth
+		if item.children:
+			depth += 1
+			stack.extend((child, depth) for child in reversed(item.children))
+
+# Yields level and every Level under it, each Level after the Levels in it.
+# If descend is given, the Levels under an item are only visited when descend(item) is true (the item is still yielded).
+def postorder(level, descend = None):
+	stack = [(level, False)]
+	while stack:
+		item, visited = stack.pop()
+		if visited or (descend and not descend(item)) or not item.children:
+			yield item
+		else:
+			stack.append((item, True))
+			stack.extend((child, False) for child in reversed(item.children))
+
+# Like preorder(), but doesn't look inside copy-on-write views (see Level.copy()), whose Levels don't exist yet.
+def _existing(level):
+	stack = [level]
+	while stack:
+		item = stack.pop()
+		yield item
+		if item._source is None and item._children:
+			stack.extend(reversed(item._children))
+
+# Yields level, then the Level containing it, and so on out to the Sheet (or the top of a disconnected graph).
+def ancestors(level):
+	while level:
+		yield level
+		level = level.parent
+
+# Rendering
+# Writes the graph under level to stream (any file-like object with a write() method), one line per Level, indented by depth:
+#	[id]['A', 'B']
+# The lines are written size at a time, so nothing close to the whole drawing is ever held in memory.
+# Levels more than max_depth cuts below level are left out, and at most max_children children of any one Level are shown;
+# what is left out is marked with a "..." line.  (A disconnected graph is drawn as if it were on the Sheet.)
+def render(level, stream, max_depth = None, max_children = None, size = 1000):
+	depth = level.depth
+	if type(depth) is not int:
+		depth = 0
+	lines = []
+	stack = [(level, 0)]
+	while stack:
+		item, below = stack.pop()
+		indent = "\t"*(depth + below)
+		if type(item) is str:
+			lines.append(indent + item + "\n")
+		else:
+			lines.append(indent + '[' + str(item.id) + ']' + repr(item.atoms) + "\n")
+			children = item.children
+			if children and max_depth is not None and below >= max_depth:
+				lines.append(indent + "\t... (levels not shown: %d)\n" % len(children))
+			elif children:
+				if max_children is not None and len(children) > max_children:
+					stack.append(("... (more levels: %d)" % (len(children) - max_children), below + 1))
+					children = children[:max_children]
+				stack.extend((child, below + 1) for child in reversed(children))
+		if len(lines) >= size:
+			stream.write("".join(lines))
+			lines = []
+	if lines:
+		stream.write("".join(lines))
 
 # This is a function which makes a copy of any graph given it and returns the copy.
+# The copy is a copy-on-write view of graph, so it costs the same however big graph is.  (See Level.copy().)
 def copy_graph(sheet, graph):
 	if type(graph) is Level:
-		new_level = Level(None, sheet.get_next_id())
-		for child in graph.children:
-			new_child = copy_graph(sheet, child)
-			new_level.children.append(new_child)
-			new_child.parent = graph
-		return new_level
+		return graph.copy(sheet)
 	elif type(graph) is Sheet:
 		raise EGCopyError("Cannot copy a sheet of assertion.")
 	else:
 		raise EGCopyError("Not a recognized type.")
 
+# Returned in place of a Level's child fingerprint counts before it has any, and of its children.
+_EMPTY = {}
+_NO_CHILDREN = ()
+
+# Copy-on-write
+# A copy made by Level.copy() starts out as a view of the Level it copies (its source): it has its own id and atoms, but
+# its children are only made (as views of the source's children) the first time they are needed.  Until then the view
+# and its source share everything underneath them, so a copy costs the same however big the graph is.
+# Before a Level changes, any view of it or of a Level containing it is given its children (down the path to the change),
+# so a view never sees changes made to its source after it was copied.  Changing a view gives it its children first too.
+# A view takes its fingerprint from its source, so a source always has a fingerprint while it has views, and a change
+# under it has to be on a path of Levels with fingerprints: only that path (the one _changed() clears anyway) is looked
+# at for views.  Sources keep weak references to their views, so views that are thrown away cost nothing;
+# _pending_views counts the ones still waiting, and while there are none a change doesn't look for them at all.
+# Few Levels are ever copied, so the views are kept here rather than in a slot of every Level.
+_pending_views = 0
+_views = weakref.WeakKeyDictionary()	# source Level -> {id(view): weak reference to the view}
+
+def _view_dropped(ref):
+	global _pending_views
+	_pending_views -= 1
+
+# Atoms
+# An atom is named by a letter followed by any number of letters, digits and underscores (e.g. A, p, rain, P_2).
+def is_atom_name(name):
+	return type(name) is str and name[:1].isalpha() and name.replace("_", "").isalnum()
+
+# Each atom name is interned once as a symbol (a small int), and Levels count their atoms by symbol.
+_symbols = {}		# atom name -> symbol
+_atom_names = []	# symbol -> atom name
+
+def intern_atom(name):
+	symbol = _symbols.get(name)
+	if symbol is None:
+		symbol = _symbols[name] = len(_atom_names)
+		_atom_names.append(name)
+	return symbol
+
+# Counts a list of atom names by symbol, or returns None if one of them has never been used (so no Level can hold it).
+def _count_atoms(atoms):
+	counts = {}
+	for atom in atoms:
+		symbol = _symbols.get(atom)
+		if symbol is None:
+			return None
+		counts[symbol] = counts.get(symbol, 0) + 1
+	return counts
+
+# A Level keeps its atoms (Level._atoms) in the smallest form that holds them, since most Levels have none or a few:
+#	None						no atoms
+#	a symbol					one atom
+#	a tuple of symbols			up to _FEW_ATOMS atoms, in order (repeats together)
+#	a dict of counts by symbol	more than that
+# Returns that form of counts (a dict of counts by symbol, in order, which a Level holding many atoms keeps as it is).
+_FEW_ATOMS = 8
+
+def _pack_atoms(counts):
+	total = 0
+	for symbol in counts:
+		total += counts[symbol]
+	if total > _FEW_ATOMS:
+		return counts
+	return _pack_symbols([symbol for symbol in counts for i in range(counts[symbol])])
+
+# The form of a list of no more than _FEW_ATOMS symbols (repeats together), and the other way around.
+def _pack_symbols(symbols):
+	if not symbols:
+		return None
+	elif len(symbols) == 1:
+		return symbols[0]
+	return tuple(symbols)
+
+def _unpack_symbols(atoms):
+	if atoms is None:
+		return []
+	elif type(atoms) is int:
+		return [atoms]
+	return list(atoms)
+
+# Changes
+# The solve mode rules change a graph in small steps, each of which is undone by its opposite:
+#	(_LINK, parent, child, index, register)		makes child the index'th child of parent
+#	(_UNLINK, parent, child, index, register)	takes child (the index'th child of parent) out of parent
+#	(_ADD_ATOMS, level, counts)					adds atoms (a dict of counts by symbol) to level
+#	(_REMOVE_ATOMS, level, counts, order)		takes them out again (order is the order level's atoms were in, so that
+#												undoing it puts them back where they were; see _removal())
+# register says what joins (or leaves) the Sheet's index along with the link: _SUBTREE for child and everything in it,
+# _LEVEL for child alone, or None when child is just being moved around inside the Sheet.
+_LINK = "link"
+_UNLINK = "unlink"
+_ADD_ATOMS = "add atoms"
+_REMOVE_ATOMS = "remove atoms"
+_OPPOSITE = {_LINK: _UNLINK, _UNLINK: _LINK, _ADD_ATOMS: _REMOVE_ATOMS, _REMOVE_ATOMS: _ADD_ATOMS}
+_SUBTREE = "subtree"
+_LEVEL = "level"
+
+def _step(step, undo = False):
+	kind = _OPPOSITE[step[0]] if undo else step[0]
+	if kind == _LINK:
+		step[1]._link(*step[2:])
+	elif kind == _UNLINK:
+		step[1]._unlink(*step[2:])
+	elif kind == _ADD_ATOMS:
+		step[1]._add_atoms(step[2])
+		if undo:
+			step[1]._reorder_atoms(step[3])
+	else:
+		step[1]._remove_atoms(step[2])
+
+# History: the versions of a Sheet, so that the rules applied to it can be undone and redone (see Sheet.start_history()).
+# Version 0 is the Sheet as it was when the History was started, and every rule applied to the Sheet since makes a new
+# version.  Moving between versions undoes (or redoes) one change at a time, and each change costs about what the rule
+# itself did, however big the Sheet is.  Applying a rule after going back drops the versions that came after.
+# (Rules applied to disconnected graphs don't make versions; those graphs aren't part of the Sheet yet.)
+class History:
+	def __init__(self, sheet):
+		self.sheet = sheet
+		self.changes = []	# The steps of each change; version n is the Sheet with the first n of them made
+		self.version = 0
+	
+	@property
+	def latest(self):
+		return len(self.changes)
+	
+	def record(self, steps):
+		del self.changes[self.version:]
+		self.changes.append(steps)
+		self.version += 1
+	
+	def checkout(self, version):
+		if not (type(version) is int and 0 <= version <= len(self.changes)):
+			raise EGHistoryError("There is no version %s." % version)
+		while self.version > version:
+			self.version -= 1
+			for step in reversed(self.changes[self.version]):
+				_step(step, undo = True)
+		while self.version < version:
+			for step in self.changes[self.version]:
+				_step(step)
+			self.version += 1
+		if _sink:
+			_sink.emit(Event(Event.HISTORY, self.sheet, version = version))
+	
+	def undo(self):
+		if not self.version:
+			raise EGHistoryError("There is nothing to undo.")
+		self.checkout(self.version - 1)
+	
+	def redo(self):
+		if self.version == len(self.changes):
+			raise EGHistoryError("There is nothing to redo.")
+		self.checkout(self.version + 1)
+
 # A level is a sublevel, also known as a "cut".  Its id is used internally.
 class Level:	
+	# Levels use __slots__ (no per-object __dict__), since there can be a great many of them.
+	# (The views of a Level, if it is copied, are kept in _views rather than here; see "Copy-on-write" above.)
+	__slots__ = ("sheet", "id", "parent", "_odd", "_depth", "_depth_epoch", "_atoms", "_children",
+		"_fingerprint", "_child_prints", "_stale_children", "_source", "__weakref__")
+	
 	# The following variables are defined:
 	#	parent - the Level containing this Level
 	#	id - the (internal) ID of the level (used mainly for searching)
-	#	depth - the level of this level (parent depth +1 in this instance)
-	#	children - the Levels which are a part of this Level
-	#	atoms - the atoms which are in this level (represented as letters)
+	#	depth - the level of this level (parent depth +1 in this instance), computed on demand (see below)
+	#	odd - whether the depth is odd (None while the Level is disconnected)
+	#	children - the Levels which are a part of this Level (see the children property below)
+	#	atoms - the atoms which are in this level, as a list of names (see the atoms property below)
+	#	_atoms - the atoms in this level, by symbol (see intern_atom()), in the form _pack_atoms() gives them
+	#	_children - the list of children (None until there are any)
+	#	_source - for a copy-on-write view, the Level it is a view of (see "Copy-on-write" above); otherwise None
 	
 	################ Solve Mode Functions ################
 	
 	### DOUBLECUT INSERTION
 	def ins_doublecut(self, atoms = None):
 		if not atoms:
+			parent = self.parent
+			if not parent:
+				raise EGDoublecutError("A disconnected Level has no parent to insert the doublecut into.")
 			# Create 2 new levels and link them to each other and to this level's parent level
-			first_new_level = Level(self.parent)
+			first_new_level = Level(parent)
 			second_new_level = Level(first_new_level)
-			# Set this level's parent to the second new level
-			self.parent = second_new_level
-			# Modify the depth of this level and its children
-			self.set_depth(self.depth + 2)
-			# Remove this level from the children of its original parent
-			first_new_level.parent.children.remove(self)
-			# Add the first new level to the same original parent
-			first_new_level.parent.children.append(first_new_level)
-			# Make the second new level a child of the first new level
-			first_new_level.children.append(second_new_level)
-			# Make this level a child of the second new level
-			second_new_level.children.append(self)
+			# Move this level from its original parent into the second new level.
+			# The depth of this level and its children goes up by 2 (their parity doesn't change)
+			self._change([
+				(_UNLINK, parent, self, parent.children.index(self), None),
+				(_LINK, parent, first_new_level, len(parent.children) - 1, _LEVEL),
+				(_LINK, first_new_level, second_new_level, 0, _LEVEL),
+				(_LINK, second_new_level, self, 0, None)])
+			if _sink:
+				_sink.emit(Event(Event.DEPTH, self, depth = self.depth))
 		elif type(atoms) is str:
-			if atoms in self.atoms:
-				first_new_level = Level(self)
-				second_new_level = Level(first_new_level)
-				self.children.append(first_new_level)
-				first_new_level.children.append(second_new_level)
-				second_new_level.atoms.append(atoms)
-				self.atoms.remove(atoms)
-			else:
-				raise EGDoublecutError("One of the passed atoms is not in the list of atoms.")
+			first_new_level = self._wrap_atoms([atoms])
 		elif type(atoms) is list:
-			for atom in atoms:
-				if atom not in self.atoms:
-					raise EGDoublecutError("One of the passed atoms is not in the list of atoms.")
-			first_new_level = Level(self)
-			second_new_level = Level(first_new_level)
-			self.children.append(first_new_level)
-			first_new_level.children.append(second_new_level)
-			for atom in atoms:
-				second_new_level.atoms.append(atom)
-				self.atoms.remove(atom)
+			first_new_level = self._wrap_atoms(atoms)
 		else:
-			return TypeError("atoms can only be an alphabetic string of length 1 or a list of such strings.")
+			raise TypeError("atoms can only be an atom name or a list of atom names.")
+		if _sink:
+			_sink.emit(Event(Event.RULE, self, rule = "ins_doublecut", atoms = atoms, first = first_new_level.id))
+	
+	# Moves the given atoms (a list of names, which may repeat) out of this Level and into a new doublecut, all at once.
+	# Returns the outer Level of the doublecut.
+	def _wrap_atoms(self, atoms):
+		counts = _count_atoms(atoms)
+		own = self._atom_counts()
+		if counts is None or any(own.get(symbol, 0) < counts[symbol] for symbol in counts):
+			raise EGDoublecutError("One of the passed atoms is not in the list of atoms.")
+		first_new_level = Level(self)
+		second_new_level = Level(first_new_level)
+		self._change([
+			(_LINK, self, first_new_level, len(self.children), _LEVEL),
+			(_LINK, first_new_level, second_new_level, 0, _LEVEL),
+			(_ADD_ATOMS, second_new_level, counts),
+			self._removal(counts)])
+		return first_new_level
 	
 	### DOUBLECUT REMOVAL
 	def rem_doublecut(self):
 		# This one is a bit of an oddity.  Why?  Because we can remove this level and the one above it, or this and the one below it.
 		# Note that the default behavior will be to remove the one above.  If it can't do that it will remove the level below.
-		if type(self.parent) is Level and len(self.parent.children) == 1 and len(self.parent.atoms) == 0:
-			for child in self.children:
-				child.set_depth(child.depth - 2)
-				child.parent = self.parent.parent
-				self.parent.parent.children.append(child)
-			for atom in self.atoms:
-				self.parent.parent.atoms.append(atom)
-			self.parent.parent.children.remove(self.parent)
-			self.children = []
-			new_context = self.parent.parent
-			self.parent.parent = None
-			return new_context
-		elif len(self.children) == 1 and len(self.atoms) == 0 and type(self.children[0]) is Level:
-			for child in self.children[0].children:
-				child.parent = self.parent
-				child.set_depth(child.depth - 2)
-				self.parent.children.append(child)
-			for atom in self.children[0].atoms:
-				self.parent.atoms.append(atom)
-			self.parent.children.remove(self)
-			self.children[0].children = []
-			new_context = self.parent
-			self.parent = None
-			return new_context
+		# (The Event is sent first here, while this Level is still in the Sheet.)
+		if type(self.parent) is Level and len(self.parent.children) == 1 and self.parent._atoms is None:
+			outer, inner = self.parent, self
+		elif len(self.children) == 1 and self._atoms is None and type(self.children[0]) is Level:
+			outer, inner = self, self.children[0]
 		else:
 			raise EGDoublecutError("This Level is not eligible for the doublecut rule.")
+		new_context = outer.parent
+		if not new_context:
+			raise EGDoublecutError("A disconnected Level has no parent to remove the doublecut into.")
+		if _sink:
+			_sink.emit(Event(Event.RULE, self, rule = "rem_doublecut"))
+		# The contents of the inner cut move out to the Level containing the doublecut, and then both cuts are unlinked.
+		# Only the two cuts themselves leave the Sheet's index, since their contents were just moved.
+		children = inner.children
+		steps = [(_UNLINK, inner, children[index], index, None) for index in reversed(range(len(children)))]
+		base = len(new_context.children)
+		steps.extend((_LINK, new_context, child, base + index, None) for index, child in enumerate(children))
+		if inner._atoms is not None:
+			counts = dict(inner._atom_counts())
+			steps.append(inner._removal(counts))
+			steps.append((_ADD_ATOMS, new_context, counts))
+		steps.append((_UNLINK, outer, inner, 0, _LEVEL))
+		steps.append((_UNLINK, new_context, outer, new_context.children.index(outer), _LEVEL))
+		self._change(steps)
+		return new_context
 	
 	### INSERTION OF ANY GRAPH
 	def insert(self, atom = None, level = None):
-		if type(self.depth) is int and not self.depth % 2 == 1:
+		if self.odd is False:
 			raise EGInsertionError("To use insertion, level must be odd.")
 			
 		if atom and level:
 			raise EGInsertionError("Only pass EITHER a new atom OR a new level to insert at this point.")
 
-		if atom and type(atom) is str and atom.isalpha() and len(atom) == 1:
-			self.atoms.append(atom)
+		if atom and is_atom_name(atom):
+			self._change([(_ADD_ATOMS, self, {intern_atom(atom): 1})])
+			if _sink:
+				_sink.emit(Event(Event.RULE, self, rule = "insert", atom = atom))
 		elif atom and type(atom) is str:
-			raise ValueError("Atom name must be exactly one letter in length.")
+			raise ValueError("Atom name must be a letter followed by letters, digits or underscores.")
 		elif atom:
-			raise TypeError("Atom must be a string of length 1.")
+			raise TypeError("Atom must be a string.")
 		elif level and type(level) is Level and level.parent == None:	# That last condition is to ensure that this isn't a different part of the tree we're taking!
-			self.children.append(level)
-			level.parent = self
-			level.set_depth(self.depth + 1)
+			self._change([(_LINK, self, level, len(self.children), _SUBTREE)])
+			if _sink:
+				_sink.emit(Event(Event.RULE, self, rule = "insert", level = level.id))
 		elif level and type(level) is Level:
 			raise EGInsertionError("The level to be inserted must not already have a parent somewhere in the tree.")
 		elif level:
@@ -163,22 +615,25 @@ class Level:
 	# When called without arguments, removes this sublevel.
 	# When called with the single argument atom, removes the atom from this sublevel.
 	def remove(self, atom = None, level = None):
-		if type(self.depth) is int and not self.depth % 2 == 0:
+		if self.odd:
 			raise EGRemovalError("You attempted to make a removal on an odd level.")
 			
 		if atom and level:
 			raise EGRemovalError("Only set either atom OR level.")
 		
 		if atom and type(atom) is str:
-			self.atoms.remove(atom)
-			print(self.context_repr + " updated: removed " + atom)
+			if not self.has_atom(atom):
+				raise ValueError("atom not in this level's atoms.")
+			self._change([self._removal({_symbols[atom]: 1})])
+			if _sink:
+				_sink.emit(Event(Event.RULE, self, rule = "remove", atom = atom))
 		elif atom:
-			raise TypeError("atom must be a single-character alphabetic string.")
+			raise TypeError("atom must be a string naming an atom.")
 		elif level and type(level) is Level:
 			if level in self.children:
-				self.children.remove(level)
-				print(self.context_repr + " updated: removed " + str(level))
-				level.parent = None
+				self._change([(_UNLINK, self, level, self.children.index(level), _SUBTREE)])
+				if _sink:
+					_sink.emit(Event(Event.RULE, self, rule = "remove", level = level.id))
 			else:
 				raise EGRemovalError("level is not a child of this sublevel.")
 		elif level:
@@ -203,40 +658,24 @@ class Level:
 			raise EGIterationError("Only specify either the Level (subgraph) OR atom to iterate.")
 		
 		if atom:
-			if type(atom) is str and atom.isalpha() and len(atom) == 1:
-				context = self.parent
-				found = False
-				while context:
-					if atom in context.atoms:
-						found = True
-						break
-					context = context.parent
-				if found:
-					self.atoms.append(atom)
-					print(self.context_repr + " updated: added atom " + atom)
+			if is_atom_name(atom):
+				if self.justification(atom = atom):
+					self._change([(_ADD_ATOMS, self, {_symbols[atom]: 1})])
+					if _sink:
+						_sink.emit(Event(Event.RULE, self, rule = "iterate", atom = atom))
 				else:
-					raise EGIterationError("atom not found in any of the containing Levels.")
+					raise EGIterationError("atom not found in this or any of the containing Levels.")
 			else:
-				raise ValueError("atom must be set to a one-character alphabetic string.")
+				raise ValueError("atom must be set to an atom name.")
 				
 		elif level:
 			if type(level) is Level and level.parent == None:		# Again, last condition ensures that we're not borrowing a level from somewhere else in the graph
-				context = self.parent
-				found = False
-				while context:
-					for child in context.children:
-						if level.equal(child):
-							found = True
-							break
-					if found:
-						break
-				if found:
-					self.children.append(level)
-					level.parent = self
-					level.set_depth(self.depth + 1)
-					print(self.context_repr + " updated: added " + level.context_repr + " to level's children[]")
+				if self.justification(level = level):
+					self._change([(_LINK, self, level, len(self.children), _SUBTREE)])
+					if _sink:
+						_sink.emit(Event(Event.RULE, self, rule = "iterate", level = level.id))
 				else:
-					raise EGIterationError("level not found in any of the levels above this one.")
+					raise EGIterationError("level not found in this level or any of the levels above it.")
 			elif type(level) is Level:
 				raise EGIterationError("level must not already have a parent somewhere in this tree.")
 			else:
@@ -250,165 +689,772 @@ class Level:
 			raise EGIterationError("Only specify either the Level (subgraph) OR atom to iterate.")
 		
 		if atom:
-			if type(atom) is str and atom.isalpha() and len(atom) == 1:
-				context = self.parent
-				found = False
-				while context:
-					if atom in context.atoms:
-						found = True
-						break
-					context = context.parent
-				if found:
-					self.atoms.remove(atom)
-					print(self.context_repr + " updated: removed " + atom + " from level's atoms[]")
+			if is_atom_name(atom):
+				if not self.has_atom(atom):
+					raise EGIterationError("atom not found in this level's atoms.")
+				if self.justification(atom = atom, copies = 2):
+					self._change([self._removal({_symbols[atom]: 1})])
+					if _sink:
+						_sink.emit(Event(Event.RULE, self, rule = "deiterate", atom = atom))
 				else:
-					raise EGIterationError("atom not found in any of the containing Levels.")
+					raise EGIterationError("atom not found in this or any of the containing Levels.")
 			else:
-				raise ValueError("atom must be set to a one-character alphabetic string.")
+				raise ValueError("atom must be set to an atom name.")
 				
 		elif level:
 			if type(level) is Level:
-				context = self.parent
-				found = False
-				while context:
-					for child in context.children:
-						if level.equal(child):
-							found = True
-							break
-					if found:
-						break
-				if found:
-					try:
-						self.children.remove(level)
-					except:
-						raise EGIterationError("level not found in this level's children.")
-						
-					level.parent = None
-					print(self.context_repr + " updated: removed child level " + level.context_repr)
+				if not level.parent is self:
+					raise EGIterationError("level not found in this level's children.")
+				if self.justification(level = level, copies = 2):
+					self._change([(_UNLINK, self, level, self.children.index(level), _SUBTREE)])
+					if _sink:
+						_sink.emit(Event(Event.RULE, self, rule = "deiterate", level = level.id))
 				else:
-					raise EGIterationError("level not found in any of the levels above this one.")
+					raise EGIterationError("level not found in this level or any of the levels above it.")
 			else:
 				raise TypeError("level must be set to an instance of a Level object.")
 		else:
 			raise ValueError("Either the atom or the level must be set.")
 	
+	### SIMPLIFICATION
+	# Simplifies the graph under this Level in one post-order pass, using only rules that keep its meaning:
+	#	- every doublecut with nothing else in it is removed (what is in the inner cut moves out)
+	#	- every atom and subgraph with a copy further out is deiterated, as are all but one of any copies side by side
+	#	  (on the Sheet, where there is no deiteration, the extra copies are removed instead)
+	# Each Level is done after everything in it, so the rules only ever change the Level being done.  Each rule is a
+	# version in the History and is reported to the sink, just as if it had been typed in.
+	# The pass carries down the atoms and child fingerprints of the Levels containing the one it is in (adding a Level's
+	# on the way in and taking them out on the way out), so it can tell what is justified without looking up through
+	# the Levels above each time, as justification() does; the rules are applied directly, since the pass has already
+	# checked them.  So the whole pass costs about as much as the graph is big, however deep it is.
+	# Returns the steps, in order, as (rule, id, atom or child id) tuples (the last is None for rem_doublecut, whose id
+	# is the inner cut's).  One pass may not get everything: removing a doublecut can bring copies together that the pass
+	# has already gone by, so simplifying again can take a few more steps.
+	def simplify(self):
+		steps = []
+		atoms = collections.Counter()	# The atoms of the Levels containing the one being looked at, by symbol
+		prints = collections.Counter()	# The fingerprints of their children (other than the ones on the way down)
+		path = self
+		for level in ancestors(self.parent):
+			atoms.update(level._atom_counts())
+			prints.update(level.child_prints())
+			prints[path.fingerprint()] -= 1
+			path = level
+		# Each entry is [Level, the fingerprints of its children it has added to prints, the children still to go into]
+		stack = [[self, None, None]]
+		while stack:
+			entry = stack[-1]
+			level = entry[0]
+			if entry[1] is None:
+				atoms.update(level._atom_counts())
+				entry[1] = collections.Counter(child.fingerprint() for child in level.children)
+				prints.update(entry[1])
+				entry[2] = list(reversed(level.children))
+			if entry[2]:
+				child = entry[2].pop()
+				child_print = child.fingerprint()
+				entry[1][child_print] -= 1
+				prints[child_print] -= 1
+				stack.append([child, None, None])
+				continue
+			stack.pop()
+			atoms.subtract(level._atom_counts())
+			prints.subtract(entry[1])
+			level._simplify(atoms, prints, steps)
+			if stack:
+				level_print = level.fingerprint()
+				stack[-1][1][level_print] += 1
+				prints[level_print] += 1
+		return steps
+	
+	# Simplifies this Level's own atoms and children, for simplify(); atoms and prints are those of the Levels containing it.
+	def _simplify(self, atoms, prints, steps):
+		on_sheet = type(self) is Sheet
+		rule = "remove" if on_sheet else "deiterate"
+		for child in list(self.children):
+			if child._atoms is None and len(child.children) == 1:
+				inner = child.children[0]
+				inner.rem_doublecut()
+				steps.append(("rem_doublecut", inner.id, None))
+		own = self._atom_counts()
+		for atom in sorted(_atom_names[symbol] for symbol in own):
+			symbol = _symbols[atom]
+			keep = 0 if atoms[symbol] > 0 else 1
+			for count in range(own[symbol] - keep):
+				self._change([self._removal({symbol: 1})])
+				if _sink:
+					_sink.emit(Event(Event.RULE, self, rule = rule, atom = atom))
+				steps.append((rule, self.id, atom))
+		seen = set()
+		removed = 0
+		for index, child in enumerate(list(self.children)):
+			child_print = child.fingerprint()
+			if not child_print in seen and prints[child_print] <= 0:
+				seen.add(child_print)
+				continue
+			self._change([(_UNLINK, self, child, index - removed, _SUBTREE)])
+			removed += 1
+			if _sink:
+				_sink.emit(Event(Event.RULE, self, rule = rule, level = child.id))
+			steps.append((rule, self.id, child.id))
+	
 	############## Setup Mode Functions #################
 	
 	def create(self, atom = None):
 		if not atom:
 			new_level = Level(self)
-			self.children.append(new_level)
-		elif type(atom) is str and len(atom) == 1 and atom.isalpha():
-			self.atoms.append(atom)
-			print(self.context_repr + " updated: added atom " + atom)
+			self._add_child(new_level)
+			self._attached(new_level, False)
+			if _sink:
+				_sink.emit(Event(Event.SETUP, self, action = "create", child = new_level.id))
+		elif is_atom_name(atom):
+			self._add_atom(atom)
+			if _sink:
+				_sink.emit(Event(Event.SETUP, self, action = "create", atom = atom))
 		else:
-			raise ValueError("atom must be set to a one-character alphabetic string.")
+			raise ValueError("atom must be set to an atom name.")
 	
 	def delete(self, atom = None):
 		if not atom:
-			self.parent.children.remove(self)
+			# (The Event is sent first here, while this Level is still in the Sheet.)
+			if _sink:
+				_sink.emit(Event(Event.SETUP, self, action = "delete"))
+			self.parent._remove_child(self)
 			new_context = self.parent
 			self.parent = None
-			print(self.context_repr + " and all atoms and children deleted")
+			new_context._detached(self)
 			return new_context
-		elif type(atom) is str and len(atom) == 1 and atom.isalpha() and atom in self.atoms:
-			self.atoms.remove(atom)
-			print(self.context_repr + " updated: deleted atom " + atom)
-		elif not atom in self.atoms:
+		elif is_atom_name(atom) and self.has_atom(atom):
+			self._remove_atom(atom)
+			if _sink:
+				_sink.emit(Event(Event.SETUP, self, action = "delete", atom = atom))
+		elif not self.has_atom(atom):
 			raise NameError("atom not in this level's atoms.")
 		else:
-			raise ValueError("atom must be set to a one-character alphabetic string.")
+			raise ValueError("atom must be set to an atom name.")
 	
 	############ Internal Class Functions ###############
 	
+	# Returns a disconnected copy of this Level (and everything in it), drawing its ids from sheet.
+	# The copy is a copy-on-write view: only the copy itself is made now, and the Levels in it are made as they are needed.
+	def copy(self, sheet):
+		new_level = Level(None, sheet = sheet)
+		new_level._copy_atoms(self)
+		new_level._mirror(self)
+		return new_level
+	
+	# Gives this (new, empty) Level the atoms of source.
+	def _copy_atoms(self, source):
+		atoms = source._atoms
+		if atoms is not None:
+			self._atoms = dict(atoms) if type(atoms) is dict else atoms
+			if _sink:
+				for atom in self.atoms:
+					_sink.emit(Event(Event.ATOM_ADDED, self, atom = atom))
+	
+	# Makes all of the Levels of any copy-on-write views under this Level now, e.g. so that they have ids.
+	def materialize(self):
+		for level in preorder(self):
+			pass
+	
+	# The children of a view are only made when they are first asked for.
+	@property
+	def children(self):
+		if self._source is not None:
+			self._materialize()
+		return self._children or _NO_CHILDREN
+	
+	# Makes this (new, childless) Level a view of source (or of the Level source is a view of).
+	def _mirror(self, source):
+		global _pending_views
+		while source._source is not None:
+			source = source._source
+		self._source = source
+		self._fingerprint = source.fingerprint()
+		views = _views.get(source)
+		if views is None:
+			views = _views[source] = {}
+		views[id(self)] = weakref.ref(self, _view_dropped)
+		_pending_views += 1
+	
+	# Stops this Level being a view: it gets children of its own, which are views of its source's children.
+	def _materialize(self):
+		global _pending_views
+		source = self._source
+		views = _views[source]
+		del views[id(self)]
+		if not views:
+			del _views[source]
+		_pending_views -= 1
+		self._fill(source)
+	
+	# (Nothing about this Level changes, so its fingerprint stays.  The new children are counted in its child_prints()
+	# when they are needed.)
+	def _fill(self, source):
+		self._source = None
+		children = []
+		for source_child in source.children:
+			child = Level(self)
+			self._attached(child, False)
+			child._copy_atoms(source_child)
+			child._mirror(source_child)
+			children.append(child)
+			if _sink:
+				_sink.emit(Event(Event.LEVEL_ADDED, self, child = child.id))
+		if children:
+			self._children = children
+			self._stale_children = True
+	
+	# Called before the atoms or children of this Level change (see "Copy-on-write" above).
+	def _unshare(self):
+		global _pending_views
+		if self._source is not None:
+			self._materialize()
+		if not _pending_views:
+			return
+		path = []
+		level = self
+		while level and level._fingerprint is not None:
+			path.append(level)
+			level = level.parent
+		while path:
+			level = path.pop()
+			views = _views.pop(level, None)
+			if views:
+				for ref in views.values():
+					view = ref()
+					if view is not None:
+						_pending_views -= 1
+						view._fill(level)
+	
+	# Returns the Sheet this Level is attached to, or None if it is (part of) a disconnected graph.
 	def get_sheet(self):
-		if self.parent:
-			return self.parent.get_sheet()
+		if self.sheet and self.sheet.levels.get(self.id) is self:
+			return self.sheet
+		else:
+			return None
+	
+	# The atoms of this Level as a list of names, each repeated as many times as it occurs.  They are listed in the order
+	# they were added to the Level (repeats together, where the first of them was added), which is how they are printed.
+	# The list is built on each use; has_atom() and count_atom() answer for a single atom without building it.
+	@property
+	def atoms(self):
+		atoms = self._atoms
+		if atoms is None:
+			return []
+		elif type(atoms) is int:
+			return [_atom_names[atoms]]
+		elif type(atoms) is tuple:
+			return [_atom_names[symbol] for symbol in atoms]
+		names = []
+		for symbol, count in atoms.items():
+			names.extend([_atom_names[symbol]] * count)
+		return names
+	
+	def count_atom(self, atom):
+		return self._count_symbol(_symbols.get(atom))
+	
+	def has_atom(self, atom):
+		return self.count_atom(atom) > 0
+	
+	# Keeps the Sheet's id index (and the parity of the Levels) up to date when a subgraph is linked into or unlinked from this Level.
+	def _attached(self, level, subtree = True):
+		if self.get_sheet():
+			self.sheet.register(level, subtree)
+	
+	def _detached(self, level, subtree = True):
+		if self.sheet:
+			self.sheet.unregister(level, subtree)
+	
+	# The depth of a Level is not stored outright, since the doublecut rules would then have to update every Level they move.
+	# Instead it is computed from the nearest ancestor with a memoized depth that is still current: the Sheet counts the
+	# changes that move Levels (self.sheet.depth_epoch), and a memo is only current if it was made since the last one.
+	# Whether a Level is odd or even is all the rules need, and that never changes when a doublecut is inserted or removed,
+	# so it is stored directly (self._odd) and set when a Level is created or linked into the Sheet.
+	@property
+	def depth(self):
+		sheet = self.get_sheet()
+		if not sheet:
+			return "?"
+		path = []
+		level = self
+		while not (level is sheet or level._depth_epoch == sheet.depth_epoch):
+			path.append(level)
+			level = level.parent
+		depth = level._depth
+		while path:
+			level = path.pop()
+			depth += 1
+			level._depth = depth
+			level._depth_epoch = sheet.depth_epoch
+		return depth
+	
+	# Called when Levels in the Sheet are moved to a different depth; it makes every memoized depth out of date.
+	def _moved(self):
+		if self.get_sheet():
+			self.sheet.depth_epoch += 1
+	
+	@property
+	def odd(self):
+		if self.get_sheet():
+			return self._odd
 		else:
 			return None
 	
+	# Memoizes new_depth as the depth of this Level, and the matching depths of everything under it.
+	# The rules don't need this (see depth above); it is here to fill in the memos of a whole subgraph at once.
 	def set_depth(self, new_depth):
 		if not (type(new_depth) is int):
 			raise TypeError("'new_depth' must be an integer.")
-		self.depth = new_depth
-		print(self.context_repr + " updated: new depth is " + str(self.depth))
-		for item in self.children:
-			item.set_depth(new_depth + 1)
-	
-	def equal(self, other_level):
-		# Check atoms:
-		if not len(self.atoms) == len(other_level.atoms):
+		sheet = self.get_sheet()
+		if not sheet:
+			raise ValueError("A disconnected Level has no depth.")
+		if new_depth != self.depth:
+			raise ValueError("new_depth does not match where this Level is in the Sheet.")
+		for level, depth in walk(self):
+			level._depth = new_depth + depth
+			level._depth_epoch = sheet.depth_epoch
+		if _sink:
+			_sink.emit(Event(Event.DEPTH, self, depth = new_depth))
+	
+	# Two Levels are equal when they hold the same multiset of atoms and equal children, in any order.
+	# Comparing fingerprints decides this in one step; pass confirm = True to also check the structures themselves.
+	def equal(self, other_level, confirm = False):
+		if self.fingerprint() != other_level.fingerprint():
 			return False
-		for atom in self.atoms:
-			if not atom in other_level.atoms:
+		if not confirm:
+			return True
+		pairs = [(self, other_level)]
+		while pairs:
+			level, other_level = pairs.pop()
+			if level.fingerprint() != other_level.fingerprint():
 				return False
-		# Check levels:
-		if not len(self.children) == len(other_level.children):
-			return False
-		for child in self.children:
-			are_equal = False
-			for other_child in other_level.children:
-				if child.equal(other_child):
-					are_equal = True
-			if not are_equal:
+			if level._atom_counts() != other_level._atom_counts() or len(level.children) != len(other_level.children):
 				return False
+			# Children with equal fingerprints line up once both lists are sorted by fingerprint.
+			children = sorted(level.children, key = Level.fingerprint)
+			other_children = sorted(other_level.children, key = Level.fingerprint)
+			pairs.extend(zip(children, other_children))
 		return True
 	
-	######### Recursive Item Finding Function ###########
+	# The fingerprint is a digest of this Level's sorted atoms followed by the sorted fingerprints of its children,
+	# so structurally equal Levels (up to the order of atoms and children) share the same fingerprint.
+	# It is cached until something in or underneath this Level changes (see _changed()).
+	# The Levels that need a new fingerprint are done from the bottom up, so each one's children are ready when it is.
+	def fingerprint(self):
+		if self._fingerprint is None:
+			for level in postorder(self, Level._needs_fingerprint):
+				if level._fingerprint is None:
+					digest = hashlib.sha1(",".join(sorted(level.atoms)).encode())
+					digest.update(b";")
+					child_prints = level.child_prints()
+					for child_print in sorted(child_prints):
+						digest.update(child_print * child_prints[child_print])
+					level._fingerprint = digest.digest()
+		return self._fingerprint
+	
+	def _needs_fingerprint(self):
+		return self._fingerprint is None
+	
+	# Called whenever the atoms or children of this Level change.  It drops the cached fingerprint here and on every
+	# ancestor (an ancestor can only have a fingerprint if this Level still has one too), and marks each of them as
+	# stale in its parent's count of child fingerprints.
+	def _changed(self):
+		if self._fingerprint is None:
+			return
+		for level in ancestors(self):
+			if level._fingerprint is None:
+				break
+			if level.parent:
+				level.parent._uncount(level)
+			level._fingerprint = None
+	
+	# The atoms and children of a Level must only be changed through these functions, which keep the fingerprints
+	# and the justification index (self._atoms and self._child_prints) up to date.
+	def _add_atom(self, atom):
+		self._add_atoms({intern_atom(atom): 1})
+	
+	def _remove_atom(self, atom):
+		symbol = _symbols.get(atom)
+		if not self._count_symbol(symbol):
+			raise ValueError("atom not in this level's atoms.")
+		self._remove_atoms({symbol: 1})
+	
+	# The bulk versions take a dict of counts by symbol (see _count_atoms()), so many atoms cost one _changed().
+	# (A Level holding many atoms changes its dict in place; the smaller forms are made again each time.)
+	def _add_atoms(self, counts):
+		self._unshare()
+		self._changed()
+		atoms = self._atoms
+		if type(atoms) is dict:
+			for symbol in counts:
+				atoms[symbol] = atoms.get(symbol, 0) + counts[symbol]
+		else:
+			symbols = _unpack_symbols(atoms)
+			for symbol in counts:
+				# (A new atom goes at the end, and a repeat next to the others.)
+				index = symbols.index(symbol) if symbol in symbols else len(symbols)
+				symbols[index:index] = [symbol] * counts[symbol]
+			if len(symbols) > _FEW_ATOMS:
+				atoms = {}
+				for symbol in symbols:
+					atoms[symbol] = atoms.get(symbol, 0) + 1
+				self._atoms = atoms
+			else:
+				self._atoms = _pack_symbols(symbols)
+		if _sink:
+			for symbol in counts:
+				for i in range(counts[symbol]):
+					_sink.emit(Event(Event.ATOM_ADDED, self, atom = _atom_names[symbol]))
+	
+	# (The caller checks that this Level has all of the atoms.)
+	def _remove_atoms(self, counts):
+		self._unshare()
+		self._changed()
+		atoms = self._atoms
+		if type(atoms) is dict:
+			for symbol in counts:
+				if atoms[symbol] == counts[symbol]:
+					del atoms[symbol]
+				else:
+					atoms[symbol] -= counts[symbol]
+			# (Only a dict with few symbols left is worth adding up, to see if it fits a smaller form.)
+			if len(atoms) <= _FEW_ATOMS:
+				self._atoms = _pack_atoms(atoms)
+		else:
+			symbols = _unpack_symbols(atoms)
+			for symbol in counts:
+				for i in range(counts[symbol]):
+					symbols.remove(symbol)
+			self._atoms = _pack_symbols(symbols)
+		if _sink:
+			for symbol in counts:
+				for i in range(counts[symbol]):
+					_sink.emit(Event(Event.ATOM_REMOVED, self, atom = _atom_names[symbol]))
+	
+	# The step that takes atoms (a dict of counts by symbol) out of this Level.  It notes the order this Level's atoms are
+	# in, since an atom taken out altogether and then put back would otherwise come back at the end.
+	def _removal(self, counts):
+		atoms = self._atoms
+		return (_REMOVE_ATOMS, self, counts, tuple(atoms) if type(atoms) is dict else atoms)
+	
+	# Puts this Level's atoms in the given order (symbols in the order they come, which may repeat, or a single symbol),
+	# as they were before a removal was undone.
+	def _reorder_atoms(self, order):
+		if self._atoms is not None:
+			atoms = self._atom_counts()
+			if type(order) is int:
+				order = (order,)
+			ordered = dict((symbol, atoms[symbol]) for symbol in order or () if symbol in atoms)
+			for symbol in atoms:
+				if not symbol in ordered:
+					ordered[symbol] = atoms[symbol]
+			self._atoms = _pack_atoms(ordered)
+	
+	# The count of each atom in this Level, as a dict by symbol, in order.  (It is the Level's own dict if it holds many
+	# atoms, so it must not be changed.)
+	def _atom_counts(self):
+		atoms = self._atoms
+		if atoms is None:
+			return _EMPTY
+		elif type(atoms) is int:
+			return {atoms: 1}
+		elif type(atoms) is tuple:
+			counts = {}
+			for symbol in atoms:
+				counts[symbol] = counts.get(symbol, 0) + 1
+			return counts
+		return atoms
+	
+	# How many of the atom with the given symbol are in this Level.
+	def _count_symbol(self, symbol):
+		atoms = self._atoms
+		if atoms is None:
+			return 0
+		elif type(atoms) is int:
+			return 1 if atoms == symbol else 0
+		elif type(atoms) is tuple:
+			return atoms.count(symbol)
+		return atoms.get(symbol, 0)
+	
+	def _add_child(self, level, index = None):
+		self._unshare()
+		self._changed()
+		if self._children is None:
+			self._children = [level]
+		elif index is None:
+			self._children.append(level)
+		else:
+			self._children.insert(index, level)
+		# The fingerprint of the new child is only counted once it is needed.
+		if self._stale_children is None:
+			self._stale_children = set([level])
+		elif self._stale_children is not True:
+			self._stale_children.add(level)
+		if _sink:
+			_sink.emit(Event(Event.LEVEL_ADDED, self, child = level.id))
+	
+	def _remove_child(self, level, index = None):
+		self._unshare()
+		if index is None:
+			self._children.remove(level)
+		else:
+			del self._children[index]
+		if not self._children:
+			self._children = None
+		self._changed()
+		self._uncount(level)
+		if self._stale_children is not True:
+			self._stale_children.discard(level)
+			if not self._stale_children:
+				self._stale_children = None
+		if _sink:
+			_sink.emit(Event(Event.LEVEL_REMOVED, self, child = level.id))
+	
+	# The steps of a change (see _step()).  Linking a Level in or out keeps the Sheet's index and depths up to date too.
+	def _link(self, child, index, register):
+		self._add_child(child, index)
+		child.parent = self
+		if register:
+			self._attached(child, register == _SUBTREE)
+		else:
+			self._moved()
+	
+	def _unlink(self, child, index, register):
+		self._remove_child(child, index)
+		child.parent = None
+		if register:
+			self._detached(child, register == _SUBTREE)
+		else:
+			self._moved()
+	
+	# Makes a change (a list of steps) to the graph, and records it as a new version if the Sheet keeps a History.
+	def _change(self, steps):
+		history = self.get_sheet() and self.sheet.history
+		for step in steps:
+			_step(step)
+		if history:
+			history.record(steps)
 	
+	# Takes the (about to be invalidated) fingerprint of a child out of self._child_prints.
+	# (self._stale_children is the set of children not counted in it yet, None if there are none, or True if none of the
+	# children are, as in a graph that was just built.)
+	def _uncount(self, level):
+		if self._stale_children is None:
+			self._stale_children = set()
+		elif self._stale_children is True or level in self._stale_children:
+			return
+		if self._child_prints[level._fingerprint] == 1:
+			del self._child_prints[level._fingerprint]
+		else:
+			self._child_prints[level._fingerprint] -= 1
+		self._stale_children.add(level)
+	
+	# Returns a dict from the fingerprint of each child of this Level to the number of children that have it.
+	def child_prints(self):
+		if self._stale_children:
+			if self._child_prints is None:
+				self._child_prints = {}
+			if self._stale_children is True:
+				self._stale_children = set(self._children or ())
+			while self._stale_children:
+				child_print = self._stale_children.pop().fingerprint()
+				self._child_prints[child_print] = self._child_prints.get(child_print, 0) + 1
+			self._stale_children = None
+		return self._child_prints or _EMPTY
+	
+	############ Justification (Iteration) Index #########
+	
+	# Looks for the justification for iterating atom or level (a subgraph) into this Level: a copy of it in this Level or
+	# in one of the Levels containing it.  Returns the Level holding the copy, or None.
+	# For deiteration, pass copies = 2, since the item itself (in this Level) can't be its own justification.
+	# Each Level counts its own atoms and the fingerprints of its children, so this is O(depth).
+	def justification(self, atom = None, level = None, copies = 1):
+		if atom:
+			symbol = _symbols.get(atom)
+			if symbol is None:
+				return None
+		else:
+			level_print = level.fingerprint()
+		path = None	# The child of context that this Level is in (which a subgraph can't be iterated into)
+		for context in ancestors(self):
+			if atom:
+				atoms = context._atoms
+				if atoms is None:
+					found = 0
+				elif type(atoms) is int:
+					found = 1 if atoms == symbol else 0
+				else:
+					found = context._count_symbol(symbol)
+			else:
+				found = context.child_prints().get(level_print, 0)
+				if path and path.fingerprint() == level_print:
+					found -= 1
+			if found >= copies:
+				return context
+			copies = 1
+			path = context
+		return None
+	
+	# Returns the atoms visible from this Level (this Level's and those of the Levels containing it).
+	def visible_atoms(self):
+		atoms = set()
+		for context in ancestors(self):
+			atoms.update(_atom_names[symbol] for symbol in context._atom_counts())
+		return atoms
+	
+	# Returns the fingerprints of the subgraphs visible from this Level (children of this Level or of the Levels containing it).
+	def visible_prints(self):
+		prints = set()
+		for context in ancestors(self):
+			prints.update(context.child_prints())
+		return prints
+	
+	############### Item Finding Function ###############
+	
+	# Levels attached to the sheet are looked up in the Sheet's id index, and only the (O(depth)) walk
+	# back up to this Level is needed to check that the result is actually underneath it.
+	# Disconnected graphs are not indexed, so they are still searched Level by Level.
 	def find(self, id):
-		retval = False
-		if self.id == id:
-			return self
-		for item in self.children:
-			if item.id == id and not retval:
+		if self.get_sheet():
+			item = self.sheet.levels.get(id)
+			if item:
+				for context in ancestors(item):
+					if context is self:
+						return item
+			return False
+		
+		for item in preorder(self):
+			if item.id == id:
 				return item
-			elif not retval:
-				retval = item.find(id)
-		return retval
+		return False
 	
 	################### Initialization ###################
 	
-	def __init__(self, new_parent, new_id = None):
+	def __init__(self, new_parent, new_id = None, sheet = None):
+		# The sheet this Level belongs to (and draws its ids from), even while it is disconnected.
+		if new_parent:
+			self.sheet = new_parent.sheet
+		else:
+			self.sheet = sheet
+		
 		if new_id:
 			self.id = new_id
 		else:
 			try:
-				self.id = new_parent.get_sheet().get_next_id()
+				self.id = self.sheet.get_next_id()
 			except:
 				raise EGInitializationException("To initialize a Level you need either a parent node or an ID from the sheet of assertion.")
 		
 		self.parent = new_parent
-		if new_parent and type(new_parent.depth) is int:
-			self.depth = self.parent.depth + 1
-		else:
-			self.depth = "?"
+		# A new Level is only put in the Sheet's index (and given its parity) once it is linked in; see _attached().
+		self._odd = None
+		self._depth = None
+		self._depth_epoch = None
 			
-		self.atoms = []
-		self.children = []
+		self._source = None
+		self._fingerprint = None
+		# These four are only made once they are needed (most Levels are leaves, and many have no atoms).
+		self._children = None
+		self._atoms = None
+		self._child_prints = None
+		self._stale_children = None
 		
-		self.context_repr = 'Level id %d' % self.id 
-		
-		print("Level id " + str(self.id) + " depth " + str(self.depth) + " created")
+		if _sink:
+			# (Its depth is counted from the nearest Level above it that is linked in, as its parent may be new as well.)
+			level = new_parent
+			depth = 1
+			while level and not level.get_sheet():
+				level = level.parent
+				depth += 1
+			_sink.emit(Event(Event.CREATED, self, depth = level.depth + depth if level else "?"))
+	
+	# Building graphs all at once
+	# These make a big graph (e.g. one being loaded; see egsave.py) quickly, by skipping what create() does for each
+	# Level and atom: there are no Events, and nothing is registered with the Sheet, until _built() is called on the top
+	# of the graph.  They are only for filling in a new Level (or Sheet) that has nothing in it yet.
+	
+	# Makes a new, empty Level at the end of this Level's children, and returns it.  (Its slots are the ones __init__ sets.)
+	def _build_child(self):
+		child = Level.__new__(Level)
+		sheet = child.sheet = self.sheet
+		child.id = sheet.next_id
+		sheet.next_id += 1
+		child.parent = self
+		child._odd = None if self._odd is None else not self._odd
+		child._depth = None
+		child._depth_epoch = None
+		child._source = None
+		child._fingerprint = None
+		child._children = None
+		child._atoms = None
+		child._child_prints = None
+		child._stale_children = None
+		if self._children is None:
+			self._children = [child]
+			self._stale_children = True
+		else:
+			self._children.append(child)
+		return child
+	
+	# Gives this Level its atoms (a dict of counts by symbol, which is kept).
+	def _build_atoms(self, counts):
+		self._atoms = _pack_atoms(counts) if counts else None
+	
+	# Finishes the graph under this Level, given the Levels made for it (by _build_child()).  If this is the Sheet, they
+	# are put in its index.  One SETUP Event (the action "load", with the number of Levels made) stands for the lot.
+	def _built(self, levels):
+		if type(self) is Sheet:
+			self.levels.update((level.id, level) for level in levels)
+		if _sink:
+			_sink.emit(Event(Event.SETUP, self, action = "load", levels = len(levels)))
 		
 	################## String Representation ###############
 	
+	# The name of this Level used in messages and the reason.py prompt.
+	@property
+	def context_repr(self):
+		return 'Level id %d' % self.id
+	
+	# The whole graph under this Level, as drawn by render().
 	def __repr__(self):
-		ret = "\t"*self.depth+'['+str(self.id)+']'+repr(self.atoms)+"\n"
-		for child in self.children:
-			ret += child.__repr__()
-		return ret
+		buffer = io.StringIO()
+		render(self, buffer)
+		return buffer.getvalue()
 
 # The sheet of assertion is just a specific "Level", namely level 0.  Right now it also has an id of 0 for sake of ease of identification.
 class Sheet(Level):
+	__slots__ = ("next_id", "levels", "depth_epoch", "history")
+	
+	context_repr = 'Sheet id 0'
+	
 	############## Object Identity Tracking ##############
 	
-	next_id = 1
+	# The Sheet is the root that depths are counted from.
+	depth = 0
+	_depth = 0
 	
 	def get_next_id(self):
 		ret = self.next_id
 		self.next_id += 1
 		return ret
+	
+	# The Sheet keeps an index (self.levels) of every Level attached to it by id, so that find() is a single lookup.
+	# Disconnected graphs (e.g. from "create level" or copy_graph()) are added when they are linked into the tree.
+	# Linking a Level in also gives it its parity, and linking a subgraph in moves its Levels to a new depth.
+	def register(self, level, subtree = True):
+		if subtree:
+			self.depth_epoch += 1
+		for item in _existing(level) if subtree else [level]:
+			self.levels[item.id] = item
+			item._odd = not item.parent._odd
+	
+	# Evicts a Level (and, by default, everything below it) from the index once it has been unlinked from the tree.
+	# (Levels evicted by a rule are kept by the History, if there is one, and registered again if the rule is undone.)
+	def unregister(self, level, subtree = True):
+		for item in _existing(level) if subtree else [level]:
+			if self.levels.get(item.id) is item:
+				del self.levels[item.id]
 		
 	################ Solve Mode Functions ################
 	
@@ -418,32 +1464,18 @@ class Sheet(Level):
 			# On the sheet of assertion, we just create 2 new Levels and make the necessary links.
 			first_new_level = Level(self)
 			second_new_level = Level(first_new_level)
-			self.children.append(first_new_level)
-			first_new_level.children.append(second_new_level)
+			self._change([
+				(_LINK, self, first_new_level, len(self.children), _LEVEL),
+				(_LINK, first_new_level, second_new_level, 0, _LEVEL)])
 		# In other cases, its just like it is in the Level class.
 		elif type(atoms) is str:
-			if atoms in self.atoms:
-				first_new_level = Level(self)
-				second_new_level = Level(first_new_level)
-				self.children.append(first_new_level)
-				first_new_level.children.append(second_new_level)
-				second_new_level.atoms.append(atoms)
-				self.atoms.remove(atoms)
-			else:
-				raise EGDoublecutError("One of the passed atoms is not in the list of atoms.")
+			first_new_level = self._wrap_atoms([atoms])
 		elif type(atoms) is list:
-			for atom in atoms:
-				if atom not in self.atoms:
-					raise EGDoublecutError("One of the passed atoms is not in the list of atoms.")
-			first_new_level = Level(self)
-			second_new_level = Level(first_new_level)
-			self.children.append(first_new_level)
-			first_new_level.children.append(second_new_level)
-			for atom in atoms:
-				second_new_level.atoms.append(atom)
-				self.atoms.remove(atom)
+			first_new_level = self._wrap_atoms(atoms)
 		else:
-			raise TypeError("atoms can only be an alphabetic string of length 1 or a list of such strings.")
+			raise TypeError("atoms can only be an atom name or a list of atom names.")
+		if _sink:
+			_sink.emit(Event(Event.RULE, self, rule = "ins_doublecut", atoms = atoms, first = first_new_level.id))
 	
 	### DOUBLECUT REMOVAL
 	#def rem_doublecut(self)
@@ -478,46 +1510,65 @@ class Sheet(Level):
 		#	This function works just fine as imported...except that it doesn't if the user attempts to delete the Sheet.
 		if not atom:
 			raise EGRemovalError("Cannot remove the Sheet of Assertion.")
-		elif type(atom) is str and len(atom) == 1 and atom.isalpha() and atom in self.atoms:
-			self.atoms.remove(atom)
-			print(self.context_repr + " updated: deleted atom " + atom)
-		elif not atom in self.atoms:
+		elif is_atom_name(atom) and self.has_atom(atom):
+			self._remove_atom(atom)
+			if _sink:
+				_sink.emit(Event(Event.SETUP, self, action = "delete", atom = atom))
+		elif not self.has_atom(atom):
 			raise NameError("atom not in this level's atoms.")
 		else:
-			raise ValueError("atom must be set to a one-character alphabetic string.")
+			raise ValueError("atom must be set to an atom name.")
 		
 	############ Internal Class Functions ###############
 	
+	def copy(self, sheet):
+		raise EGCopyError("Cannot copy a sheet of assertion.")
+	
 	def get_sheet(self):
 		#	This function is slightly different:
 		return self
 	
 	def set_depth(self, new_depth):
 		#	This function won't be used on the Sheet of Assertion.  Just in case...
+		#	(Its depth is always 0; see the class variables above.)
 		raise ValueError("Why are you attempting to change the depth of the Sheet of Assertion?")
 	
 	#def equal(self, other_level):
 	#	This function works just fine as imported.
 	
-	######### Recursive Item Finding Function ###########
+	# Starts keeping the History of this Sheet (if it isn't already), and returns it.
+	def start_history(self):
+		if self.history is None:
+			self.history = History(self)
+		return self.history
 	
-	#def find(self, id):
-	#	This function works just fine as imported.
+	############### Item Finding Function ###############
+	
+	def find(self, id):
+		return self.levels.get(id, False)
 	
 	################### Initialization ###################
 	
 	def __init__(self):
 		self.parent = None
-		self.depth = 0
-		self.children = []
-		self.atoms = []
+		self._odd = False
+		self.depth_epoch = 0
+		self._children = None
+		self._source = None
+		self._fingerprint = None
+		self._atoms = None
+		self._child_prints = None
+		self._stale_children = None
 		self.id = 0
+		self.sheet = self
+		self.levels = {0: self}
+		self.next_id = 1
+		self.history = None
 		
-		self.context_repr = 'Sheet id 0'
-		
-		print('Sheet id 0 created')
+		if _sink:
+			_sink.emit(Event(Event.CREATED, self, depth = 0))
 		
 	################## String Representation ###############
 	
 	#def __repr__(self):
-	#	This function works just fine as imported.
\ No newline at end of file
+	#	This function works just fine as imported.
\ No newline at end of file
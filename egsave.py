@@ -0,0 +1,280 @@
+#	Existential Graph Manipulation Library
+#
+#	egsave.py
+#
+#	Saving and loading graphs: a Sheet of assertion, plus any disconnected Levels (like the ones from "create level").
+#
+#	There are two formats, and load() tells them apart by the first bytes of the file.
+#
+#	The text format has one graph per line, the Sheet first.  A graph is written as its atoms followed by its
+#	child Levels, each in parentheses, e.g.:
+#
+#		A ((B) (C))
+#
+#	is the Sheet with the atom A and a cut holding two cuts, one around B and one around C.
+#
+#	The binary format is a run of little-endian 32-bit words, after the 8 byte header EGMLBIN1:
+#
+#		<length> <names>			the atom names, joined by newlines (<length> bytes, padded to a whole word)
+#		<graphs>					how many graphs follow (the Sheet first)
+#		<nodes> <node> <node> ...	each graph: how many Levels it has, then every Level in pre-order as
+#									<children> <pairs> <symbol> <count> <symbol> <count> ...
+#									(<symbol> is the atom's place in <names>, <count> how many of it there are in a row)
+#
+#	In both formats the atoms of a Level are written in the order it keeps them in (see Level.atoms), so a graph that is
+#	saved and loaded again prints the same.
+#
+#	Levels get new ids when they are loaded.  Loading builds each graph directly, in one pass, rather than with create():
+#	the event sink gets a single SETUP Event (the action "load") for each graph loaded, not one for every Level and atom.
+#	(A ProofLog records a loaded Sheet as the creates that would have built it.)
+
+from egml import Sheet, Level, intern_atom, is_atom_name, preorder
+import array
+import io
+import itertools
+import re
+import sys
+
+BINARY_HEADER = b"EGMLBIN1"
+
+# EGLoadError: errors raised from malformed save files.
+class EGLoadError(Exception):
+	def __init__(self, str):
+		self.string = str
+	def __str__(self):
+		return self.string
+
+################### Text Format ###################
+
+# Writes the atoms and child Levels of level to stream in the text format (without a newline), size parts at a time.
+def dump_text(level, stream, size = 1000):
+	parts = []
+	spaced = False	# Whether the next atom or "(" needs a space before it
+	stack = [level]
+	while stack:
+		item = stack.pop()
+		if item is None:
+			parts.append(")")
+			spaced = True
+			continue
+		if not item is level:
+			parts.append(" (" if spaced else "(")
+			stack.append(None)
+			spaced = False
+		for atom in item.atoms:
+			parts.append(" " + atom if spaced else atom)
+			spaced = True
+		stack.extend(reversed(item.children))
+		if len(parts) >= size:
+			stream.write("".join(parts))
+			parts = []
+	stream.write("".join(parts))
+
+def format_text(level):
+	buffer = io.StringIO()
+	dump_text(level, buffer)
+	return buffer.getvalue()
+
+_TOKENS = re.compile(r"\(|\)|[^\s()]+")
+
+# Raises an EGLoadError if text is not a graph in the text format.
+def check_text(text):
+	open_cuts = 0
+	for match in _TOKENS.finditer(text):
+		token = match.group()
+		if token == "(":
+			open_cuts += 1
+		elif token == ")":
+			if not open_cuts:
+				raise EGLoadError("unbalanced parentheses.")
+			open_cuts -= 1
+		elif not is_atom_name(token):
+			raise EGLoadError("'%s' is not an atom name." % token)
+	if open_cuts:
+		raise EGLoadError("unbalanced parentheses.")
+
+# Builds the graph written in the text format into level (a new Sheet, or a new disconnected Level), and returns level.
+# (The text is checked first, so nothing is built from a bad graph.)
+def load_text(text, level):
+	check_text(text)
+	built = []
+	stack = [[level, {}]]	# [Level, the count of each of its atoms so far, by symbol]
+	for match in _TOKENS.finditer(text):
+		token = match.group()
+		if token == "(":
+			child = stack[-1][0]._build_child()
+			built.append(child)
+			stack.append([child, {}])
+		elif token == ")":
+			child, atoms = stack.pop()
+			child._build_atoms(atoms)
+		else:
+			symbol = intern_atom(token)
+			atoms = stack[-1][1]
+			atoms[symbol] = atoms.get(symbol, 0) + 1
+	level._build_atoms(stack[0][1])
+	level._built(built)
+	return level
+
+################## Binary Format ##################
+
+def dump_binary(graphs, stream):
+	symbols = {}
+	names = []
+	words = array.array("I")
+	words.append(len(graphs))
+	for graph in graphs:
+		count = len(words)
+		words.append(0)
+		for level in preorder(graph):
+			words[count] += 1
+			pairs = [(atom, len(list(run))) for atom, run in itertools.groupby(level.atoms)]
+			words.append(len(level.children))
+			words.append(len(pairs))
+			for atom, atom_count in pairs:
+				if not atom in symbols:
+					symbols[atom] = len(names)
+					names.append(atom)
+				words.append(symbols[atom])
+				words.append(atom_count)
+	blob = "\n".join(names).encode()
+	blob += b"\0" * (-len(blob) % 4)
+	header = array.array("I", [len(blob)])
+	if sys.byteorder == "big":
+		header.byteswap()
+		words.byteswap()
+	stream.write(BINARY_HEADER)
+	stream.write(header.tobytes())
+	stream.write(blob)
+	stream.write(words.tobytes())
+
+# Splits a binary file into its atom names and its words (starting with the count of graphs).
+# Both passes over the words (check_words() and load_words()) are single, non-recursive passes.
+def read_binary(data):
+	if not data.startswith(BINARY_HEADER) or len(data) < 16 or len(data) % 4:
+		raise EGLoadError("truncated file.")
+	words = array.array("I")
+	words.frombytes(data[8:])
+	if sys.byteorder == "big":
+		words.byteswap()
+	blob_end = 12 + words[0]
+	if blob_end > len(data) - 4 or words[0] % 4:
+		raise EGLoadError("truncated file.")
+	try:
+		names = data[12:blob_end].rstrip(b"\0").decode().split("\n") if words[0] else []
+	except UnicodeDecodeError:
+		raise EGLoadError("bad atom name.")
+	if not all(is_atom_name(name) for name in names):
+		raise EGLoadError("bad atom name.")
+	return names, words[(blob_end - 8) // 4:]
+
+# Raises an EGLoadError unless words (see read_binary()) hold at least one whole graph, and nothing after the last one.
+def check_words(words, names):
+	end = len(words)
+	position = 1
+	for number in range(words[0]):
+		if position >= end:
+			raise EGLoadError("truncated file.")
+		nodes = words[position]
+		position += 1
+		pending = 1		# The Levels still to come (one for the root, then one for each child counted so far)
+		for node in range(nodes):
+			if position + 2 > end:
+				raise EGLoadError("truncated file.")
+			if not pending:
+				raise EGLoadError("a graph has more Levels than its Levels have children.")
+			pending += words[position] - 1
+			pairs_end = position + 2 + 2 * words[position + 1]
+			if pairs_end > end:
+				raise EGLoadError("truncated file.")
+			for symbol in words[position + 2:pairs_end:2]:
+				if symbol >= len(names):
+					raise EGLoadError("bad atom number %d." % symbol)
+			position = pairs_end
+		if pending:
+			raise EGLoadError("a graph has fewer Levels than its Levels have children.")
+	if not words[0]:
+		raise EGLoadError("no Sheet in the file.")
+	if position != end:
+		raise EGLoadError("extra data at the end of the file.")
+
+# Builds the graphs from checked words in one pass, the first into sheet (a new one) and the rest as new disconnected
+# Levels.  Returns the list of graphs.
+def load_words(words, names, sheet):
+	symbols = [intern_atom(name) for name in names]
+	graphs = []
+	position = 1
+	for number in range(words[0]):
+		if number == 0:
+			root = sheet
+		else:
+			root = Level(None, sheet = sheet)
+		graphs.append(root)
+		built = []
+		parents = []	# The Levels with children still to come (the innermost last)
+		pending = []	# How many children each of them still has to come
+		nodes = words[position]
+		position += 1
+		for node in range(nodes):
+			if node:
+				while not pending[-1]:
+					pending.pop()
+					parents.pop()
+				pending[-1] -= 1
+				level = parents[-1]._build_child()
+				built.append(level)
+			else:
+				level = root
+			children = words[position]
+			pairs_end = position + 2 + 2 * words[position + 1]
+			if pairs_end > position + 2:
+				atoms = {}
+				for pair in range(position + 2, pairs_end, 2):
+					if words[pair + 1]:
+						symbol = symbols[words[pair]]
+						atoms[symbol] = atoms.get(symbol, 0) + words[pair + 1]
+				level._build_atoms(atoms)
+			position = pairs_end
+			if children:
+				parents.append(level)
+				pending.append(children)
+		root._built(built)
+	return graphs
+
+#################### Save Files ####################
+
+# Saves sheet and the disconnected Levels in graphs to stream (opened in binary mode).
+def save(stream, sheet, graphs = (), binary = False):
+	graphs = [sheet] + list(graphs)
+	if binary:
+		dump_binary(graphs, stream)
+		return
+	text = io.TextIOWrapper(stream, encoding = "utf-8", newline = "\n")
+	for graph in graphs:
+		dump_text(graph, text)
+		text.write("\n")
+	text.flush()
+	text.detach()
+
+# Loads a save file from stream (opened in binary mode), in either format.
+# Returns the new Sheet and a list of the disconnected Levels that were saved with it.
+# The whole file is checked before the Sheet is made, so a bad file leaves nothing behind (not even in a ProofLog).
+def load(stream):
+	data = stream.read()
+	if data.startswith(BINARY_HEADER):
+		names, words = read_binary(data)
+		check_words(words, names)
+		sheet = Sheet()
+		graphs = load_words(words, names, sheet)
+	else:
+		try:
+			lines = data.decode().splitlines() or [""]
+		except UnicodeDecodeError:
+			raise EGLoadError("not an EGML save file.")
+		for line in lines:
+			check_text(line)
+		sheet = Sheet()
+		graphs = [load_text(lines[0], sheet)]
+		for line in lines[1:]:
+			graphs.append(load_text(line, Level(None, sheet = sheet)))
+	return graphs[0], graphs[1:]
@@ -0,0 +1,595 @@
+#	Existential Graph Manipulation Library
+#
+#	egsearch.py
+#
+#	Proof search: finds a sequence of rule applications that turns a Sheet of assertion into a goal graph.
+#
+#	The search is an iterative-deepening depth-first search over the legal moves (applications of the six rules) from
+#	each graph.  It works on a copy of the start Sheet, undoing each move with the Sheet's History when it backs up, and
+#	keeps a transposition table of the graphs it has already expanded (by fingerprint), so a graph reached again by
+#	another route is only expanded again if there are more moves left to spend on it.
+#
+#	The moves that can be tried are:
+#		insert doublecut		around any Level, around any one atom, or (on the Sheet) an empty doublecut
+#		remove doublecut		of any Level the rule can be applied to
+#		insert					any atom of the start or goal graph, or any subgraph of the goal graph, into an odd Level
+#		remove					any atom or child Level of an even Level
+#		iterate					any atom or subgraph that justifies it
+#		deiterate				any atom or child Level that has a justification
+#
+#	A proof is a list of Moves, which use the ids of the start Sheet (and of the Levels made along the way, which get the
+#	same ids each time the proof is replayed on the start Sheet).
+#
+#	LegalMoves lists the moves that can be made on a Sheet right now (for reason.py's "suggest"), and keeps that list up
+#	to date as rules are applied, a change at a time.
+
+from egml import Sheet, Level, copy_graph, preorder, ancestors, set_sink
+from egml import EGDoublecutError, EGInsertionError, EGRemovalError, EGIterationError, EGCopyError
+import collections
+import egsave
+
+# The errors a move that can't be made raises (the move is then just skipped).
+_MOVE_ERRORS = (EGDoublecutError, EGInsertionError, EGRemovalError, EGIterationError, EGCopyError, ValueError)
+
+# A Move is one rule application:
+#	rule - "ins_doublecut", "rem_doublecut", "insert", "remove", "iterate" or "deiterate"
+#	id - the id of the Level the rule is applied to
+#	atom - the atom (or, for ins_doublecut, the list of atoms) it is applied to, if any
+#	graph - for insert, the subgraph inserted (in egsave's text format); for remove, iterate and deiterate, the id of the
+#		child Level removed, the Level iterated, or the child Level deiterated
+# (An insert with neither atom nor graph is just a place where anything can be inserted, and can't be applied.)
+class Move:
+	def __init__(self, rule, id, atom = None, graph = None):
+		self.rule = rule
+		self.id = id
+		self.atom = atom
+		self.graph = graph
+
+	# Applies the move to sheet (which must have the Levels the move names).
+	def apply(self, sheet):
+		level = sheet.find(self.id)
+		if not level:
+			raise ValueError("There is no Level with id %d." % self.id)
+		if self.rule == "ins_doublecut":
+			level.ins_doublecut(self.atom)
+		elif self.rule == "rem_doublecut":
+			level.rem_doublecut()
+		elif self.atom:
+			getattr(level, self.rule)(atom = self.atom)
+		elif self.rule == "insert":
+			if self.graph is None:
+				raise ValueError("Nothing to insert.")
+			level.insert(level = egsave.load_text(self.graph, Level(None, sheet = sheet)))
+		elif self.rule == "iterate":
+			# The copy is made in full, so its Levels have their ids (for the moves after this one) straight away.
+			copy = copy_graph(sheet, sheet.find(self.graph))
+			copy.materialize()
+			level.iterate(level = copy)
+		else:
+			getattr(level, self.rule)(level = sheet.find(self.graph))
+
+	def __str__(self):
+		if self.atom and type(self.atom) is list:
+			return "%s %d around %s" % (self.rule, self.id, ",".join(self.atom))
+		elif self.atom:
+			return "%s %d %s" % (self.rule, self.id, self.atom)
+		elif self.rule == "insert" and self.graph is not None:
+			return "insert %d (%s)" % (self.id, self.graph)
+		elif self.graph is not None:
+			return "%s %d %d" % (self.rule, self.id, self.graph)
+		return "%s %d" % (self.rule, self.id)
+
+	def __repr__(self):
+		return "Move(%s)" % self
+
+# Applies the moves of a proof, in order, to sheet.
+def replay(sheet, moves):
+	for move in moves:
+		move.apply(sheet)
+
+# Copies sheet into a new Sheet whose Levels have the same ids.
+def clone(sheet):
+	new_sheet = Sheet()
+	new_sheet.next_id = sheet.next_id
+	copies = {sheet: new_sheet}
+	for level in preorder(sheet):
+		if level is sheet:
+			new_level = new_sheet
+		else:
+			new_parent = copies[level.parent]
+			new_level = Level(new_parent, new_id = level.id)
+			new_parent._add_child(new_level)
+			new_parent._attached(new_level, False)
+		for atom in level.atoms:
+			new_level._add_atom(atom)
+		copies[level] = new_level
+	return new_sheet
+
+# Returns the legal moves from the graph on sheet.
+# atoms are the atoms that may be inserted, and graphs the subgraphs (in egsave's text format).
+def legal_moves(sheet, atoms, graphs):
+	moves = []
+	for level in preorder(sheet):
+		id = level.id
+		own_atoms = sorted(set(level.atoms))
+		# Doublecuts
+		moves.append(Move("ins_doublecut", id))
+		for atom in own_atoms:
+			moves.append(Move("ins_doublecut", id, [atom]))
+		if not level is sheet:
+			parent = level.parent
+			if (type(parent) is Level and len(parent.children) == 1 and not parent.atoms) or (len(level.children) == 1 and not level.atoms):
+				moves.append(Move("rem_doublecut", id))
+		# Insertion and removal
+		if level.odd:
+			for atom in atoms:
+				moves.append(Move("insert", id, atom))
+			for graph in graphs:
+				moves.append(Move("insert", id, graph = graph))
+		else:
+			for atom in own_atoms:
+				moves.append(Move("remove", id, atom))
+			for child in level.children:
+				moves.append(Move("remove", id, graph = child.id))
+		if level is sheet:
+			continue
+		# Iteration and deiteration
+		for atom in sorted(level.visible_atoms()):
+			moves.append(Move("iterate", id, atom))
+		path = None
+		context = level
+		while context:
+			for child in context.children:
+				if not child is path and level.justification(level = child):
+					moves.append(Move("iterate", id, graph = child.id))
+			path = context
+			context = context.parent
+		for atom in own_atoms:
+			if level.justification(atom = atom, copies = 2):
+				moves.append(Move("deiterate", id, atom))
+		for child in level.children:
+			if level.justification(level = child, copies = 2):
+				moves.append(Move("deiterate", id, graph = child.id))
+	return moves
+
+# LegalMoves follows a Sheet and lists the legal moves on it (see moves() and all()).  After a rule has been applied (or
+# undone), only the Levels the change touched, and the moves that depended on them, are looked at again; the changes are
+# read from the Sheet's History (which this starts), so the Sheet must only be changed by the rules while it is followed.
+#
+# Most of what can be done at a Level only depends on the Level itself (its atoms and children, and whether it is odd),
+# and is worked out when it is asked for.  What is kept is:
+#	- the Levels with one child and no atoms (a doublecut can be removed at them, and at their child)
+#	- for each atom and child Level that might be deiterated, the Level that justifies it (or that nothing does), with
+#	  an index from each justifying Level, and from each atom and subgraph that has no justification, back to them
+# so that a change to a Level only costs the deiterations it can actually affect: those it justified, and those
+# below it that were waiting for what it now holds.  (An atom's key is its name, and a subgraph's its fingerprint.)
+#
+# Iterations aren't kept, since every atom and subgraph can be iterated into every Level under the one holding it, and
+# there can be (number of Levels) ** 2 of them.  moves(level) lists the ones into level, by walking out to the Sheet.
+class LegalMoves:
+	def __init__(self, sheet):
+		self.sheet = sheet
+		self._history = sheet.start_history()
+		self._applied = []		# The changes of the History that have been taken into account
+		self._prints = {}		# Level -> its fingerprint, for every Level followed
+		self._counts = collections.Counter()	# fingerprint -> how many Levels followed have it
+		self._parents = {}		# Level -> its parent
+		self._atoms = {}		# Level -> how many of each atom it has (if it has any)
+		self._wrapped = set()
+		self._entries = {}		# Level -> atom or child Level -> (key, the Level justifying its deiteration or None)
+		self._justifies = {}	# justifying Level -> key -> set of (Level, atom or child Level)
+		self._unjustified = {}	# key -> set of (Level, atom or child Level)
+		self._recheck = set()
+		self._build()
+
+	# The legal moves at level (the Sheet or a Level on it), as Moves.  The iterations are left out if iterations is False.
+	def moves(self, level, iterations = True):
+		self.update()
+		return self._moves(level, iterations)
+
+	# Every legal move on the Sheet but the iterations, Level by Level.
+	def all(self):
+		self.update()
+		moves = []
+		for level in preorder(self.sheet):
+			moves.extend(self._moves(level, False))
+		return moves
+
+	def _moves(self, level, iterations):
+		id = level.id
+		atoms = sorted(self._atoms.get(level, ()))
+		moves = [Move("ins_doublecut", id)]
+		for atom in atoms:
+			moves.append(Move("ins_doublecut", id, [atom]))
+		if level in self._wrapped or level.parent in self._wrapped:
+			moves.append(Move("rem_doublecut", id))
+		if level.odd:
+			moves.append(Move("insert", id))
+		else:
+			for atom in atoms:
+				moves.append(Move("remove", id, atom))
+			for child in level.children:
+				moves.append(Move("remove", id, graph = child.id))
+		if level is self.sheet:
+			return moves
+		if iterations:
+			for atom in sorted(level.visible_atoms()):
+				moves.append(Move("iterate", id, atom))
+			path = None
+			for context in ancestors(level):
+				for child in context.children:
+					if not child is path:
+						moves.append(Move("iterate", id, graph = child.id))
+				path = context
+		entries = self._entries.get(level, {})
+		for atom in atoms:
+			if entries[atom][1]:
+				moves.append(Move("deiterate", id, atom))
+		for child in level.children:
+			if entries[child][1]:
+				moves.append(Move("deiterate", id, graph = child.id))
+		return moves
+
+	# Takes in the changes made to the Sheet (or undone) since the last time.
+	def update(self):
+		changes = self._history.changes
+		version = self._history.version
+		common = min(len(self._applied), version)
+		while common and not self._applied[common - 1] is changes[common - 1]:
+			common -= 1
+		steps = []
+		for change in self._applied[common:] + changes[common:version]:
+			steps.extend(change)
+		del self._applied[common:]
+		self._applied.extend(changes[common:version])
+		if not steps:
+			return
+		# The Levels whose atoms or children changed, and the Levels linked or unlinked
+		changed = set()
+		moved = set()
+		for step in steps:
+			changed.add(step[1])
+			if type(step[2]) is Level:
+				moved.add(step[2])
+		removed = set()
+		added = set()
+		for level in moved:
+			attached = self._attached(level)
+			if level in self._prints and not attached:
+				removed.update(item for item in preorder(level) if item in self._prints and not self._attached(item))
+			elif attached and not level in self._prints:
+				added.update(item for item in preorder(level) if not item in self._prints)
+		self._unfollow(removed)
+		for level in added:
+			self._follow(level)
+		for level in added:
+			if not level.parent in added:
+				self._gained(level.parent, level)
+		for level in moved:
+			if level in self._prints and not level in added and not self._parents[level] is level.parent:
+				self._move(level, added)
+		for level in changed:
+			if level in self._prints:
+				self._changed_atoms(level)
+				self._wrap(level)
+		# The fingerprints of the changed Levels and of everything containing them have changed too
+		seen = set()
+		for level in changed:
+			if not level in self._prints:
+				continue
+			for context in ancestors(level):
+				if context in seen or context is self.sheet:
+					break
+				seen.add(context)
+				old = self._prints[context]
+				new = context.fingerprint()
+				if old != new:
+					self._prints[context] = new
+					self._uncount(old)
+					self._counts[new] += 1
+					self._recheck.add((context.parent, context))
+					self._recheck_all(self._justifies.get(context.parent, {}).get(old))
+					self._recheck_below(context.parent, self._unjustified.get(new))
+		self._flush()
+
+	# Follows every Level on the Sheet, and works out the deiterations, in one pre-order pass.  The pass carries down, for
+	# each atom and child fingerprint, the Levels above that have it (innermost last), so each justification is found
+	# without looking up through the Levels above, as justification() does.  (A Level doesn't justify the child it is
+	# being gone into, unless it has another child with the same fingerprint.)
+	def _build(self):
+		atom_holders = collections.defaultdict(list)
+		print_holders = collections.defaultdict(list)
+		# Each entry is [Level, the count of its children's fingerprints, the children still to go into, the fingerprint
+		# of the Level that was taken out of print_holders on the way into it (or None)]
+		stack = [[self.sheet, None, None, None]]
+		while stack:
+			entry = stack[-1]
+			level = entry[0]
+			if entry[1] is None:
+				self._follow(level, recheck = False)
+				atoms = self._atoms.get(level, {})
+				prints = entry[1] = collections.Counter(child.fingerprint() for child in level.children)
+				if not level is self.sheet:
+					for atom in atoms:
+						holders = atom_holders.get(atom)
+						self._set(level, atom, atom, level if atoms[atom] >= 2 else holders[-1] if holders else None)
+					for child in level.children:
+						key = child.fingerprint()
+						holders = print_holders.get(key)
+						self._set(level, child, key, level if prints[key] >= 2 else holders[-1] if holders else None)
+				for atom in atoms:
+					atom_holders[atom].append(level)
+				for key in prints:
+					print_holders[key].append(level)
+				entry[2] = list(reversed(level.children))
+			if entry[2]:
+				child = entry[2].pop()
+				key = child.fingerprint()
+				if entry[1][key] == 1:
+					print_holders[key].pop()
+				else:
+					key = None
+				stack.append([child, None, None, key])
+				continue
+			stack.pop()
+			for atom in self._atoms.get(level, ()):
+				atom_holders[atom].pop()
+			for key in entry[1]:
+				print_holders[key].pop()
+			if entry[3] is not None:
+				print_holders[entry[3]].append(stack[-1][0])
+
+	def _attached(self, level):
+		return self.sheet.levels.get(level.id) is level
+
+	# Starts following a Level that has just joined the Sheet (its deiterations are left to _flush() if recheck is set).
+	def _follow(self, level, recheck = True):
+		self._prints[level] = level.fingerprint()
+		self._counts[self._prints[level]] += 1
+		self._parents[level] = level.parent
+		atoms = collections.Counter(level.atoms)
+		if atoms:
+			self._atoms[level] = atoms
+		self._wrap(level)
+		if recheck and not level is self.sheet:
+			for atom in atoms:
+				self._recheck.add((level, atom))
+			for child in level.children:
+				self._recheck.add((level, child))
+
+	# Stops following Levels that have left the Sheet.  What they justified has to be looked at again.
+	def _unfollow(self, levels):
+		parents = {}
+		for level in levels:
+			parents[level] = (self._parents.pop(level), self._prints.pop(level))
+			self._uncount(parents[level][1])
+			self._atoms.pop(level, None)
+			self._wrapped.discard(level)
+		for level in levels:
+			for item in list(self._entries.get(level, ())):
+				self._drop(level, item)
+			self._entries.pop(level, None)
+			for entries in self._justifies.pop(level, {}).values():
+				self._recheck_all(entries)
+			parent, key = parents[level]
+			if parent in self._prints:
+				self._lost(parent, level, key)
+
+	# A Level that was moved from one parent to another (by a doublecut, or by undoing one).  A moved Level stays under
+	# the Levels it was under, other than those that left the Sheet (which _unfollow() has seen to), and may now be under
+	# new ones (added) as well, whose atoms and children can justify deiterations under it.  (If it somehow isn't under
+	# its old parent any more, everything under it is looked at again.)
+	def _move(self, level, added):
+		old = self._parents[level]
+		self._parents[level] = level.parent
+		if old in self._prints:
+			self._lost(old, level, self._prints[level])
+			if not any(context is old for context in ancestors(level)):
+				for item in preorder(level):
+					for entry in self._entries.get(item, ()):
+						self._recheck.add((item, entry))
+		path = level
+		for context in ancestors(level.parent):
+			if not context in added:
+				break
+			for atom in self._atoms.get(context, ()):
+				self._recheck_below(level, self._unjustified.get(atom))
+			for child in context.children:
+				if not child is path:
+					self._recheck_below(level, self._unjustified.get(self._prints[child]))
+			path = context
+		self._gained(level.parent, level)
+
+	def _uncount(self, key):
+		self._counts[key] -= 1
+		if not self._counts[key]:
+			del self._counts[key]
+
+	def _lost(self, parent, child, key):
+		self._drop(parent, child)
+		self._recheck_all(self._justifies.get(parent, {}).get(key))
+
+	def _gained(self, parent, child):
+		self._recheck.add((parent, child))
+		self._recheck_below(parent, self._unjustified.get(self._prints[child]))
+
+	def _changed_atoms(self, level):
+		old = self._atoms.get(level, {})
+		new = collections.Counter(level.atoms)
+		for atom in set(old) | set(new):
+			if old.get(atom, 0) != new.get(atom, 0):
+				self._recheck.add((level, atom))
+				if not old.get(atom):
+					self._recheck_below(level, self._unjustified.get(atom))
+				if not new.get(atom):
+					self._recheck_all(self._justifies.get(level, {}).get(atom))
+		if new:
+			self._atoms[level] = new
+		else:
+			self._atoms.pop(level, None)
+
+	def _wrap(self, level):
+		if level.parent and len(level.children) == 1 and not level in self._atoms:
+			self._wrapped.add(level)
+		else:
+			self._wrapped.discard(level)
+
+	def _recheck_all(self, entries):
+		if entries:
+			self._recheck.update(entries)
+
+	# Looks again at the entries that are in level or under it.  Whichever is smaller is walked: the Levels under level,
+	# or the entries (each out to the Sheet).
+	def _recheck_below(self, level, entries):
+		if not entries:
+			return
+		under = set()
+		for item in preorder(level):
+			under.add(item)
+			if len(under) > len(entries):
+				break
+		else:
+			self._recheck.update(entry for entry in entries if entry[0] in under)
+			return
+		for entry in entries:
+			if any(context is level for context in ancestors(entry[0])):
+				self._recheck.add(entry)
+
+	def _flush(self):
+		while self._recheck:
+			level, item = self._recheck.pop()
+			self._drop(level, item)
+			if not level in self._prints or level is self.sheet:
+				continue
+			if type(item) is str:
+				if not item in self._atoms.get(level, ()):
+					continue
+				key = item
+				justification = level.justification(atom = item, copies = 2)
+			else:
+				if not (item in self._prints and item.parent is level):
+					continue
+				key = self._prints[item]
+				# (A subgraph no other Level on the Sheet matches can't be justified, and there is no need to look up.)
+				justification = level.justification(level = item, copies = 2) if self._counts[key] > 1 else None
+			self._set(level, item, key, justification)
+
+	# Records whether item (an atom or child of level, known by key) can be deiterated, and what justifies it.
+	def _set(self, level, item, key, justification):
+		self._entries.setdefault(level, {})[item] = (key, justification)
+		if justification:
+			self._justifies.setdefault(justification, {}).setdefault(key, set()).add((level, item))
+		else:
+			self._unjustified.setdefault(key, set()).add((level, item))
+
+	def _drop(self, level, item):
+		entries = self._entries.get(level)
+		if not entries or not item in entries:
+			return
+		key, justification = entries.pop(item)
+		if justification:
+			# (The index of a justifying Level that left the Sheet is already gone.)
+			index = self._justifies.get(justification)
+			if index is None:
+				return
+		else:
+			index = self._unjustified
+		index[key].discard((level, item))
+		if not index[key]:
+			del index[key]
+			if justification and not index:
+				del self._justifies[justification]
+
+# A Search looks for a proof from start (a Sheet, which is left alone) to goal (a Sheet or a disconnected Level).
+#	max_depth - the longest proof to look for
+#	max_states - how many graphs the transposition table holds; past that, the least recently seen ones are evicted
+#	max_expansions - how many graphs to expand in all before giving up (None for no limit)
+#	atoms - the atoms that may be inserted (by default, every atom in start and goal)
+#	graphs - the subgraphs that may be inserted, as Levels (by default, every cut in goal)
+# After run(), expanded is how many graphs were expanded and evicted how many were evicted from the table.
+class Search:
+	def __init__(self, start, goal, max_depth = 6, max_states = 100000, max_expansions = None, atoms = None, graphs = None):
+		self.start = start
+		self.goal = goal
+		self.max_depth = max_depth
+		self.max_states = max_states
+		self.max_expansions = max_expansions
+		if atoms is None:
+			atoms = set()
+			for graph in (start, goal):
+				for level in preorder(graph):
+					atoms.update(level.atoms)
+		self.atoms = sorted(atoms)
+		if graphs is None:
+			graphs = [level for level in preorder(goal) if not level is goal]
+		texts = {}
+		for graph in graphs:
+			texts.setdefault(graph.fingerprint(), egsave.format_text(graph))
+		self.graphs = sorted(texts.values())
+		self.expanded = 0
+		self.evicted = 0
+
+	# Returns the shortest proof (a list of Moves) no longer than max_depth, or None if there isn't one within the limits.
+	def run(self):
+		previous_sink = set_sink(None)
+		try:
+			sheet = clone(self.start)
+			sheet.start_history()
+			goal_print = self.goal.fingerprint()
+			if sheet.fingerprint() == goal_print:
+				return []
+			table = collections.OrderedDict()	# fingerprint -> how many moves were left when the graph was expanded
+			for limit in range(1, self.max_depth + 1):
+				proof = self._deepen(sheet, goal_print, limit, table)
+				if proof is not None or self._exhausted():
+					return proof
+			return None
+		finally:
+			set_sink(previous_sink)
+
+	def _exhausted(self):
+		return self.max_expansions is not None and self.expanded >= self.max_expansions
+
+	# One depth-first pass, looking no more than limit moves ahead.
+	def _deepen(self, sheet, goal_print, limit, table):
+		path = []		# (Move, the Sheet's next id before it) for each move made
+		stack = [iter(legal_moves(sheet, self.atoms, self.graphs))]
+		self.expanded += 1
+		while stack:
+			move = next(stack[-1], None)
+			if move is None:
+				stack.pop()
+				if path:
+					self._undo(sheet, path.pop()[1])
+				continue
+			next_id = sheet.next_id
+			try:
+				move.apply(sheet)
+			except _MOVE_ERRORS:
+				sheet.next_id = next_id
+				continue
+			state = sheet.fingerprint()
+			if state == goal_print:
+				return [entry[0] for entry in path] + [move]
+			left = limit - len(path) - 1
+			if not left or table.get(state, -1) >= left or self._exhausted():
+				self._undo(sheet, next_id)
+				continue
+			table[state] = left
+			table.move_to_end(state)
+			if len(table) > self.max_states:
+				table.popitem(last = False)
+				self.evicted += 1
+			path.append((move, next_id))
+			stack.append(iter(legal_moves(sheet, self.atoms, self.graphs)))
+			self.expanded += 1
+		return None
+
+	# Takes back the last move, and the ids it used, so the next move gets the same ids it would in a replay.
+	def _undo(self, sheet, next_id):
+		sheet.history.undo()
+		sheet.next_id = next_id
+
+# Looks for a proof from start to goal (see Search for the options).  Returns a list of Moves, or None.
+def search(start, goal, **options):
+	return Search(start, goal, **options).run()
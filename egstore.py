@@ -0,0 +1,304 @@
+#	Existential Graph Manipulation Library
+#
+#	egstore.py
+#
+#	A hash-consed store of graphs: every distinct subgraph is stored once, as an immutable node, however many times it
+#	appears.  Graphs are then DAGs of shared nodes rather than trees of Levels, so memory goes with how much distinct
+#	structure there is, not with the total size (e.g. a proof that iterates the same cut over and over adds next to
+#	nothing).
+#
+#	A node is a number, standing for a multiset of atoms and a multiset of child nodes.  Store.node() looks a node up in
+#	the Store's unique table (making it if it is new), so two structurally equal graphs (up to the order of their atoms
+#	and children, as with Level.equal()) are always the same node, and comparing them is comparing two numbers.
+#
+#	Where a node appears in a graph is an Occurrence: a small handle holding what belongs to that one place (its parent
+#	Occurrence, its place among its parent's children, and its depth).  Occurrences are made as they are needed.  The
+#	solve mode rules work on Occurrences just as egml's do on Levels, except that nothing is changed: each rule returns
+#	the top Occurrence of a new graph, which shares every node the rule didn't touch with the old one (only the nodes on
+#	the path up from the change are new).  The top of a graph is treated like the Sheet of assertion.
+#
+#	To move graphs between the two: Store.intern(level) stores the graph under a Level (or a Sheet), and
+#	Store.build(node, level) makes it into Levels again.
+
+from egml import EGDoublecutError, EGInsertionError, EGRemovalError, EGIterationError, is_atom_name, postorder
+
+class Store:
+	# The following variables are defined:
+	#	_atoms - the atoms of each node (a sorted tuple of names, repeated as many times as they occur)
+	#	_children - the children of each node (a sorted tuple of nodes)
+	#	_unique - the unique table: (atoms, children) -> node
+	#	_prints - the node of each Level fingerprint seen by intern()
+	def __init__(self):
+		self._atoms = [()]
+		self._children = [()]
+		self._unique = {((), ()): 0}
+		self._prints = {}
+
+	# The empty graph.
+	EMPTY = 0
+
+	# How many distinct nodes the Store holds.
+	def __len__(self):
+		return len(self._atoms)
+
+	# Returns the node with these atoms (names) and child nodes, in any order.
+	def node(self, atoms = (), children = ()):
+		key = (tuple(sorted(atoms)), tuple(sorted(children)))
+		node = self._unique.get(key)
+		if node is None:
+			node = self._unique[key] = len(self._atoms)
+			self._atoms.append(key[0])
+			self._children.append(key[1])
+		return node
+
+	def atoms(self, node):
+		return list(self._atoms[node])
+
+	def children(self, node):
+		return list(self._children[node])
+
+	# Stores the graph under level and returns its node.  Subgraphs already stored (by fingerprint) aren't looked at again.
+	def intern(self, level):
+		for item in postorder(level, lambda item: not item.fingerprint() in self._prints):
+			key = item.fingerprint()
+			if not key in self._prints:
+				self._prints[key] = self.node(item.atoms, [self._prints[child.fingerprint()] for child in item.children])
+		return self._prints[level.fingerprint()]
+
+	# Makes the graph of node in level (a Sheet, or a new disconnected Level), with create(), and returns level.
+	def build(self, node, level):
+		stack = [(node, level)]
+		while stack:
+			item, into = stack.pop()
+			for atom in self._atoms[item]:
+				into.create(atom)
+			for child in self._children[item]:
+				into.create()
+				stack.append((child, into.children[-1]))
+		return level
+
+	# How many distinct nodes the graph of node is made of (counting node itself).
+	def distinct(self, node):
+		seen = set([node])
+		stack = [node]
+		while stack:
+			for child in self._children[stack.pop()]:
+				if not child in seen:
+					seen.add(child)
+					stack.append(child)
+		return len(seen)
+
+	# How many Levels the graph of node would be as a tree (counting node itself), worked out without unfolding it.
+	def tree_size(self, node):
+		sizes = {}
+		stack = [(node, False)]
+		while stack:
+			item, visited = stack.pop()
+			if item in sizes:
+				continue
+			if visited:
+				sizes[item] = 1 + sum(sizes[child] for child in self._children[item])
+			else:
+				stack.append((item, True))
+				stack.extend((child, False) for child in self._children[item] if not child in sizes)
+		return sizes[node]
+
+	# The top Occurrence of the graph of node.
+	def top(self, node):
+		return Occurrence(self, node)
+
+# An Occurrence is one place where a node appears in a graph.
+#	store - the Store the node is in
+#	node - the node
+#	parent - the Occurrence of the node containing this one (None at the top)
+#	index - where this node is in its parent's children
+#	depth - how many cuts this is below the top
+class Occurrence:
+	__slots__ = ("store", "node", "parent", "index", "depth")
+
+	def __init__(self, store, node, parent = None, index = None):
+		self.store = store
+		self.node = node
+		self.parent = parent
+		self.index = index
+		self.depth = parent.depth + 1 if parent else 0
+
+	@property
+	def atoms(self):
+		return self.store.atoms(self.node)
+
+	@property
+	def children(self):
+		return [Occurrence(self.store, child, self, index) for index, child in enumerate(self.store._children[self.node])]
+
+	@property
+	def odd(self):
+		return self.depth % 2 == 1
+
+	# The indexes of the children leading from the top down to this Occurrence.
+	@property
+	def path(self):
+		path = []
+		occurrence = self
+		while occurrence.parent:
+			path.append(occurrence.index)
+			occurrence = occurrence.parent
+		path.reverse()
+		return tuple(path)
+
+	# Returns the Occurrence at path (see above) under this one.
+	def find(self, path):
+		occurrence = self
+		for index in path:
+			occurrence = Occurrence(self.store, self.store._children[occurrence.node][index], occurrence, index)
+		return occurrence
+
+	def __repr__(self):
+		return "Occurrence(%d at %s)" % (self.node, self.path)
+
+	# Returns the top of a new graph, with node in place of this one.  Only the nodes on the path up to the top are new.
+	def _replace(self, node):
+		store = self.store
+		occurrence = self
+		while occurrence.parent:
+			children = list(store._children[occurrence.parent.node])
+			children[occurrence.index] = node
+			node = store.node(store._atoms[occurrence.parent.node], children)
+			occurrence = occurrence.parent
+		return Occurrence(store, node)
+
+	# Returns the top of a new graph, with atoms and child nodes added to (or, with remove = True, taken from) this one.
+	def _with(self, atoms = (), children = (), remove = False):
+		store = self.store
+		own_atoms = list(store._atoms[self.node])
+		own_children = list(store._children[self.node])
+		if remove:
+			for atom in atoms:
+				own_atoms.remove(atom)
+			for child in children:
+				own_children.remove(child)
+		else:
+			own_atoms.extend(atoms)
+			own_children.extend(children)
+		return self._replace(store.node(own_atoms, own_children))
+
+	# Like Level.justification(): the Occurrence holding a copy of atom or node (other than the item itself, with
+	# copies = 2) in this Occurrence or one containing it, or None.
+	def justification(self, atom = None, node = None, copies = 1):
+		path = None
+		context = self
+		while context:
+			if atom:
+				found = self.store._atoms[context.node].count(atom)
+			else:
+				found = self.store._children[context.node].count(node)
+				if path and path.node == node:
+					found -= 1
+			if found >= copies:
+				return context
+			copies = 1
+			path = context
+			context = context.parent
+		return None
+
+	################ Solve Mode Functions ################
+
+	# Each of these returns the top Occurrence of the new graph.
+
+	def ins_doublecut(self, atoms = None):
+		store = self.store
+		if not atoms:
+			if not self.parent:
+				return self._with(children = [store.node((), [store.node()])])
+			return self._replace(store.node((), [store.node((), [self.node])]))
+		if type(atoms) is str:
+			atoms = [atoms]
+		elif type(atoms) is not list:
+			raise TypeError("atoms can only be an atom name or a list of atom names.")
+		own = list(store._atoms[self.node])
+		for atom in atoms:
+			if not atom in own:
+				raise EGDoublecutError("One of the passed atoms is not in the list of atoms.")
+			own.remove(atom)
+		doublecut = store.node((), [store.node(atoms)])
+		return self._replace(store.node(own, list(store._children[self.node]) + [doublecut]))
+
+	def rem_doublecut(self):
+		store = self.store
+		parent = self.parent
+		if parent and parent.parent and len(store._children[parent.node]) == 1 and not store._atoms[parent.node]:
+			outer, inner = parent, self
+		elif self.parent and len(store._children[self.node]) == 1 and not store._atoms[self.node]:
+			outer, inner = self, self.children[0]
+		else:
+			raise EGDoublecutError("This Occurrence is not eligible for the doublecut rule.")
+		context = outer.parent
+		atoms = list(store._atoms[context.node]) + list(store._atoms[inner.node])
+		children = list(store._children[context.node])
+		del children[outer.index]
+		children.extend(store._children[inner.node])
+		return context._replace(store.node(atoms, children))
+
+	def insert(self, atom = None, node = None):
+		if not self.odd:
+			raise EGInsertionError("To use insertion, level must be odd.")
+		if atom and node is not None:
+			raise EGInsertionError("Only pass EITHER a new atom OR a new node to insert at this point.")
+		if atom:
+			if not is_atom_name(atom):
+				raise ValueError("Atom name must be a letter followed by letters, digits or underscores.")
+			return self._with(atoms = [atom])
+		if node is None:
+			raise ValueError("Either the atom or the node must be set.")
+		return self._with(children = [node])
+
+	# Removes atom, or the child Occurrence child, from this Occurrence.
+	def remove(self, atom = None, child = None):
+		if self.odd:
+			raise EGRemovalError("You attempted to make a removal on an odd level.")
+		if atom and child:
+			raise EGRemovalError("Only set either atom OR child.")
+		if atom:
+			if not atom in self.store._atoms[self.node]:
+				raise ValueError("atom not in this level's atoms.")
+			return self._with(atoms = [atom], remove = True)
+		if not child:
+			raise ValueError("Either the atom or the child must be set.")
+		if not child.parent or child.parent.path != self.path:
+			raise EGRemovalError("child is not a child of this Occurrence.")
+		return self._with(children = [child.node], remove = True)
+
+	def iterate(self, atom = None, node = None):
+		if not self.parent:
+			raise EGIterationError("Unable to iterate to the top of the graph.")
+		if atom and node is not None:
+			raise EGIterationError("Only specify either the node (subgraph) OR atom to iterate.")
+		if atom:
+			if not self.justification(atom = atom):
+				raise EGIterationError("atom not found in this or any of the containing Levels.")
+			return self._with(atoms = [atom])
+		if node is None:
+			raise ValueError("Either the atom or the node must be set.")
+		if not self.justification(node = node):
+			raise EGIterationError("node not found in this level or any of the levels above it.")
+		return self._with(children = [node])
+
+	# Deiterates atom, or the child Occurrence child, from this Occurrence.
+	def deiterate(self, atom = None, child = None):
+		if not self.parent:
+			raise EGIterationError("Unable to deiterate from the top of the graph.")
+		if atom and child:
+			raise EGIterationError("Only specify either the child (subgraph) OR atom to deiterate.")
+		if atom:
+			if not atom in self.store._atoms[self.node]:
+				raise EGIterationError("atom not found in this level's atoms.")
+			if not self.justification(atom = atom, copies = 2):
+				raise EGIterationError("atom not found in this or any of the containing Levels.")
+			return self._with(atoms = [atom], remove = True)
+		if not child:
+			raise ValueError("Either the atom or the child must be set.")
+		if not child.parent or child.parent.path != self.path:
+			raise EGIterationError("child not found in this level's children.")
+		if not self.justification(node = child.node, copies = 2):
+			raise EGIterationError("child not found in this level or any of the levels above it.")
+		return self._with(children = [child.node], remove = True)
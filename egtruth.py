@@ -0,0 +1,129 @@
+#	Existential Graph Manipulation Library
+#
+#	egtruth.py
+#
+#	Truth tables: what an alpha graph means, as a formula of propositional logic.
+#
+#	A graph is true when everything on it is: an atom is true when that atom is assigned true, and a cut is true when what
+#	is inside it is false.  (The Sheet, or the top of a disconnected graph, is not a cut itself; an empty graph is true,
+#	and an empty cut is false.)
+#
+#	A graph is evaluated under every assignment of its atoms at once.  The truth values are held as bit vectors (NumPy
+#	arrays of 64-bit words, one bit per assignment), so that an atom or a cut costs a single AND or NOT over the whole
+#	vector.  Assignment i sets the k-th atom (in sorted order) to bit k of i.  Graphs with many atoms are done a chunk of
+#	CHUNK_WORDS words at a time, so memory stays the same however many assignments there are; up to MAX_ATOMS atoms are
+#	allowed.  Within a chunk, each distinct subgraph (by fingerprint) is evaluated only once, however often it appears.
+#
+#	NumPy is needed for this module (and only for this module).
+
+from egml import postorder
+
+try:
+	import numpy
+except ImportError:
+	numpy = None
+
+MAX_ATOMS = 26
+CHUNK_WORDS = 2 ** 14		# 2 ** 20 assignments, 128 KB per vector
+
+# The bits of a word for each of the first six atoms: atom k is true in bit j when bit k of j is set.
+_PATTERNS = [0xAAAAAAAAAAAAAAAA, 0xCCCCCCCCCCCCCCCC, 0xF0F0F0F0F0F0F0F0, 0xFF00FF00FF00FF00, 0xFFFF0000FFFF0000,
+	0xFFFFFFFF00000000]
+
+# EGTruthError: raised when a graph can't be evaluated (too many atoms, or no NumPy).
+class EGTruthError(Exception):
+	def __init__(self, str):
+		self.string = str
+	def __str__(self):
+		return self.string
+
+# Returns the sorted atoms that appear anywhere in graphs.
+def graph_atoms(graphs):
+	atoms = set()
+	for graph in graphs:
+		for level in postorder(graph):
+			atoms.update(level.atoms)
+	return sorted(atoms)
+
+# The vector of atom k (of n) for the chunk of words starting at the word base.
+def _column(k, n, base, size):
+	if k < 6:
+		return numpy.full(size, _PATTERNS[k], dtype = numpy.uint64)
+	words = numpy.arange(base, base + size, dtype = numpy.uint64)
+	return numpy.where((words >> numpy.uint64(k - 6)) & numpy.uint64(1), numpy.uint64(2 ** 64 - 1), numpy.uint64(0))
+
+# Yields (base, vectors) for each chunk of the truth table: base is the number of the chunk's first word, and vectors are
+# the truth values of each of graphs.  Bits past the last assignment (when there are fewer than 64) are cleared.
+def truth_vectors(graphs, atoms = None):
+	if numpy is None:
+		raise EGTruthError("NumPy is needed to evaluate graphs.")
+	if atoms is None:
+		atoms = graph_atoms(graphs)
+	n = len(atoms)
+	if n > MAX_ATOMS:
+		raise EGTruthError("Too many atoms to evaluate (%d; at most %d)." % (n, MAX_ATOMS))
+	total = max(1, 2 ** n // 64)
+	mask = numpy.uint64(2 ** 64 - 1 if n >= 6 else 2 ** 2 ** n - 1)
+	for base in range(0, total, CHUNK_WORDS):
+		size = min(CHUNK_WORDS, total - base)
+		columns = {}
+		memo = {}		# fingerprint -> the vector of what is inside a Level with that fingerprint
+		vectors = []
+		for graph in graphs:
+			for level in postorder(graph, lambda level: not level.fingerprint() in memo):
+				key = level.fingerprint()
+				if key in memo:
+					continue
+				vector = numpy.full(size, mask, dtype = numpy.uint64)
+				for atom in set(level.atoms):
+					if not atom in columns:
+						columns[atom] = _column(atoms.index(atom), n, base, size)
+					vector &= columns[atom]
+				for child in level.children:
+					vector &= ~memo[child.fingerprint()]
+				memo[key] = vector
+			vectors.append(memo[graph.fingerprint()])
+		yield base, vectors
+
+# Returns the first assignment (a dict from atom to True or False) under which combine(vectors) has its bit set,
+# or None if there is none.  combine() gets the truth vectors of graphs, in order.
+def find_assignment(graphs, combine):
+	atoms = graph_atoms(graphs)
+	for base, vectors in truth_vectors(graphs, atoms):
+		found = combine(vectors)
+		if len(atoms) < 6:
+			found &= numpy.uint64(2 ** 2 ** len(atoms) - 1)
+		words = numpy.flatnonzero(found)
+		if words.size:
+			word = int(found[words[0]])
+			index = (base + int(words[0])) * 64 + (word & -word).bit_length() - 1
+			return dict((atom, bool(index >> k & 1)) for k, atom in enumerate(atoms))
+	return None
+
+# An assignment that makes graph true, or None.
+def model(graph):
+	return find_assignment([graph], lambda vectors: vectors[0])
+
+# An assignment that makes graph false, or None.
+def counterexample(graph):
+	return find_assignment([graph], lambda vectors: ~vectors[0])
+
+# An assignment under which graph and other differ, or None.
+def difference(graph, other):
+	return find_assignment([graph, other], lambda vectors: vectors[0] ^ vectors[1])
+
+def is_satisfiable(graph):
+	return model(graph) is not None
+
+def is_valid(graph):
+	return counterexample(graph) is None
+
+def is_equivalent(graph, other):
+	return difference(graph, other) is None
+
+# How many assignments make graph true.
+def count_models(graph):
+	count = 0
+	for base, vectors in truth_vectors([graph]):
+		count += int(numpy.unpackbits(vectors[0].view(numpy.uint8)).sum())
+	return count
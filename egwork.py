@@ -0,0 +1,199 @@
+#	Existential Graph Manipulation Library
+#
+#	egwork.py
+#
+#	Workspaces: many named sheets in one process.  Each sheet is kept in an Entry, together with everything reason.py
+#	works on for it: the disconnected Levels made for it (e.g. with "create level"), the Level selected in it and its mode.
+#	One Entry is current at a time.
+#
+#	The sheets are kept in memory up to a budget of max_levels Levels between them (counting Sheets, and the Levels of
+#	their disconnected graphs).  Past that, the least recently used sheets are spilled to disk, in egsave's binary format,
+#	and are loaded again (with the same ids, so the ids the user knows still work) as soon as they are switched to.  The
+#	current sheet is never spilled, however big it gets.  A sheet comes back from disk without its History: in solve mode,
+#	undo starts again from the version it was spilled at.
+#
+#	Closing a sheet drops it and everything made for it, and clear() closes every sheet and removes the spill files.
+
+from egml import preorder, set_sink
+import array
+import collections
+import egsave
+import os
+import shutil
+import tempfile
+
+MAX_LEVELS = 1000000
+
+# EGWorkspaceError: raised for sheets that don't exist (or already do).
+class EGWorkspaceError(Exception):
+	def __init__(self, str):
+		self.string = str
+	def __str__(self):
+		return self.string
+
+# An Entry is one named sheet of a Workspace.  While it is in memory:
+#	items - the Sheet (at 0, once there is one) and the disconnected Levels made for it, by id
+#	context - the selected Level (None until there is a Sheet)
+#	mode - "setup" or "solve"
+# While it is spilled, items and context are None, and path is the file it was spilled to.
+class Entry:
+	def __init__(self, name):
+		self.name = name
+		self.items = {}
+		self.context = None
+		self.mode = "setup"
+		self.size = 0			# How many Levels it had when it was last current
+		self.path = None
+		self._ids = None		# The id of each Level in the file, in the order egsave writes them
+		self._next_id = None
+		self._context_id = None
+
+	@property
+	def loaded(self):
+		return self.path is None
+
+	# How many Levels it has now.
+	def count(self):
+		levels = 0
+		for id in self.items:
+			if id == 0:
+				levels += len(self.items[0].levels)
+			else:
+				levels += sum(1 for item in preorder(self.items[id]))
+		return levels
+
+class Workspace:
+	# The following variables are defined:
+	#	max_levels - how many Levels the sheets in memory may have between them
+	#	directory - where sheets are spilled (a new temporary directory, made the first time one is, if not given)
+	#	current - the current Entry (a new Workspace has one, called "main", with nothing in it)
+	#	_entries - every Entry by name, the least recently used first
+	#	_resident - how many Levels the Entries in memory have, other than the current one
+	def __init__(self, max_levels = MAX_LEVELS, directory = None):
+		self.max_levels = max_levels
+		self.directory = directory
+		self._temporary = directory is None
+		self._entries = collections.OrderedDict()
+		self._resident = 0
+		self.current = Entry("main")
+		self._entries["main"] = self.current
+
+	def __contains__(self, name):
+		return name in self._entries
+
+	def __len__(self):
+		return len(self._entries)
+
+	# The Entries, in order of their names.
+	def entries(self):
+		return [self._entries[name] for name in sorted(self._entries)]
+
+	# Makes a new, empty Entry called name, and makes it current.
+	def open(self, name):
+		if name in self._entries:
+			raise EGWorkspaceError("There is already a sheet called %s." % name)
+		self._entries[name] = Entry(name)
+		return self.switch(name)
+
+	# Makes the Entry called name current (loading it again if it was spilled), and returns it.
+	def switch(self, name):
+		if not name in self._entries:
+			raise EGWorkspaceError("There is no sheet called %s." % name)
+		entry = self._entries[name]
+		if entry is not self.current:
+			if entry.loaded:
+				self._resident -= entry.size
+			else:
+				self._reload(entry)
+			self.current.size = self.current.count()
+			self._resident += self.current.size
+			self.current = entry
+		self._entries.move_to_end(name)
+		self.check()
+		return entry
+
+	# Drops the Entry called name (which can't be the current one).
+	def close(self, name):
+		if not name in self._entries:
+			raise EGWorkspaceError("There is no sheet called %s." % name)
+		entry = self._entries[name]
+		if entry is self.current:
+			raise EGWorkspaceError("Can't close the current sheet (switch to another one first).")
+		if entry.loaded:
+			self._resident -= entry.size
+		else:
+			os.remove(entry.path)
+		del self._entries[name]
+
+	# Closes every Entry but a new, empty current one (called "main"), and removes the spill files.
+	def clear(self):
+		for entry in self._entries.values():
+			if not entry.loaded:
+				os.remove(entry.path)
+		if self._temporary and self.directory:
+			shutil.rmtree(self.directory, ignore_errors = True)
+			self.directory = None
+		self._entries.clear()
+		self._resident = 0
+		self.current = Entry("main")
+		self._entries["main"] = self.current
+
+	# Spills the least recently used Entries until the ones in memory fit in max_levels (or only the current one is left).
+	def check(self):
+		if not self._resident:
+			return
+		levels = self._resident + self.current.count()
+		for entry in list(self._entries.values()):
+			if levels <= self.max_levels:
+				break
+			if entry is not self.current and entry.loaded and entry.size:
+				self._spill(entry)
+				levels -= entry.size
+
+	def _spill(self, entry):
+		if self.directory is None:
+			self.directory = tempfile.mkdtemp(prefix = "egwork-")
+		elif not os.path.isdir(self.directory):
+			os.makedirs(self.directory)
+		descriptor, path = tempfile.mkstemp(suffix = ".egb", dir = self.directory)
+		sheet = entry.items[0]
+		graphs = [entry.items[id] for id in sorted(entry.items) if id != 0]
+		ids = array.array("I")
+		for graph in [sheet] + graphs:
+			ids.extend(item.id for item in preorder(graph))
+		with os.fdopen(descriptor, "wb") as stream:
+			egsave.save(stream, sheet, graphs, binary = True)
+		entry._ids = ids
+		entry._next_id = sheet.next_id
+		entry._context_id = entry.context.id if entry.context else None
+		entry.path = path
+		entry.items = None
+		entry.context = None
+		self._resident -= entry.size
+
+	# Loads a spilled Entry, and gives its Levels back their ids.  (Nothing is sent to the event sink: as far as
+	# anyone watching the graph is concerned, the sheet never went anywhere.)
+	def _reload(self, entry):
+		previous_sink = set_sink(None)
+		try:
+			with open(entry.path, "rb") as stream:
+				sheet, graphs = egsave.load(stream)
+		finally:
+			set_sink(previous_sink)
+		ids = iter(entry._ids)
+		found = {}
+		for graph in [sheet] + graphs:
+			for item in preorder(graph):
+				item.id = next(ids)
+				found[item.id] = item
+		sheet.levels = dict((item.id, item) for item in preorder(sheet))
+		sheet.next_id = entry._next_id
+		if entry.mode == "solve":
+			sheet.start_history()
+		entry.items = {0: sheet}
+		for graph in graphs:
+			entry.items[graph.id] = graph
+		entry.context = found.get(entry._context_id, sheet)
+		os.remove(entry.path)
+		entry.path = None
+		entry._ids = None
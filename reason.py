@@ -1,377 +1,754 @@
 #	Existential Graph Manipulation Library
-#	
+#
 #	reason.py
 #
 #	The user interface to the EGML objects.
+#
+#	Interactively:			python3 reason.py  (or python3 -m reason)
+#	From a file of commands:	python3 -m reason --batch commands.txt [--yes] [--json]
+#	(use "--batch -" to read the commands from stdin; "python3 -m reason --help" lists the other options)
+#	Either way, "--log proof.log" records everything done to the sheet in a proof log (see eglog.py).
 
-from egml import Sheet, Level, copy_graph
+from egml import Sheet, Level, copy_graph, is_atom_name, render, BufferedSink, MultiSink, set_sink
+from egml import enable_stats, disable_stats, stats_enabled, get_stats
+from eglog import ProofLog
+import egsave
+import egsearch
+import egwork
+import argparse
+import io
+import json
+import shutil
 import sys
-import traceback
-
-def EG_reason():
-	context = None	# The item commands are being run on
-	all_items = {}	# All items not otherwise connected (the sheet of assertion plus any other disconnected graph portions.
-					# NOTE: the sheet of assertion will always be all_items[0].  Any other disconnected graph pieces (like pieces created using "create") are stored in here by ID.
-	mode = "setup"	# "setup" means that any action is allowed.  "solve" means that only logical EG actions can be performed on the tree.
-	
-	while True:
-		command = None
-		if mode == "setup" and context:
-			context_representation = context.context_repr + "*"
-		elif mode == "setup":
-			context_representation = "*"
-		elif mode == "solve" and context:
-			context_representation = context.context_repr
-		elif mode == "solve" and not context:
+
+# How many graphs "prove" may look at before it gives up.
+PROVE_EXPANSIONS = 20000
+
+VERSION = "\tEGML version 0.1a4140\n\tThis version does not include spam."
+
+# Background: it's necessary in every Python program to make a reference to Monty Python.  Here's mine.  ~Trevor
+SPAM = "\n".join([
+	"\tMenu:",
+	"\tEgg and spam",
+	"\tEgg, bacon, and spam",
+	"\tEgg, bacon, sausage, and spam",
+	"\tSpam, bacon, sausage, and spam",
+	"\tSpam, egg, spam, spam, bacon, and spam",
+	"\tSpam, spam, spam, egg, and spam",
+	"\tSpam, spam, spam, spam, spam, spam, baked beans, spam, spam, spam, and spam"])
+
+SOLVE_HELP = "\n".join([
+	"Here are a list of possible commands to run:",
+	"\thelp                         Shows this dialog.",
+	"\tversion                      Shows the version number.",
+	"\tspam                         Does nothing.  (No really.  This is not a Monty Python joke.)",
+	"\tselect <id>                  Changes the selected Level (what is in between the [ and ]) to the object",
+	"\t                             with id <id>.",
+	"\tinsert doublecut [atoms]     Inserts 2 Levels (around the selected Level or, if supplied, around [atoms]",
+	"\t                             (comma-separated) in this level.",
+	"\tremove doublecut             Intelligently removes 2 Levels, either the selected Level and the one above, or",
+	"\t                             the Level and the one below.",
+	"\tinsert <atom>                Inserts <atom> at the Level selected.",
+	"\tinsert <id>                  Inserts the graph with the id of <id> at the selected Level.",
+	"\tremove <atom>                Removes <atom> from the selected Level.",
+	"\tremove <id>                  Removes the graph with the id of <id> from the selected Level.",
+	"\titerate <atom>               Inserts <atom> at the selected Level using a Level above as the logical",
+	"\t                             justification.",
+	"\titerate <id>                 Inserts Level with id <id> at the selected Level, finding the justification",
+	"\t                             automagically.",
+	"\tdeiterate <atom>             Removes <atom> from the selected Level using a Level above as the logical",
+	"\t                             justification.",
+	"\tdeiterate <id>               Removes Level with id <id> from the selected Level, finding the justification",
+	"\t                             automagically.",
+	"\tundo                         Undoes the last rule applied to the sheet.",
+	"\tredo                         Applies the last undone rule again.",
+	"\tcheckout <version>           Goes back (or forward) to <version> of the sheet.  Version 0 is the sheet as it",
+	"\t                             was when solve mode started, and each rule applied makes a new version.",
+	"\tsuggest                      Lists the rules that can be applied at the selected Level right now.",
+	"\tsuggest all                  Lists the rules that can be applied anywhere on the sheet right now (except",
+	"\t                             iteration: use \"suggest\" at a Level to see what can be iterated into it).",
+	"\tsimplify                     Removes every doublecut with nothing else in it, and everything that could be",
+	"\t                             deiterated (or, on the sheet, removed as a second copy), under the selected Level,",
+	"\t                             and lists the steps taken.",
+	"\tprove <id> [depth]           Looks for a proof (of at most [depth] steps, 4 if not given) that turns the sheet",
+	"\t                             into the nonconnected Level with id <id>, and lists its steps.",
+	"\tcreate level                 Creates a new, nonconnected Level.  You can add things to that Level freely.  This",
+	"\t                             Level can only be used for iteration or insertion.",
+	"\tdelete level                 Deletes the selected nonconnected Level (one made with \"create level\").",
+	"\tprint                        Prints the current state of the EG at the selected Level.  Go to level id 0",
+	"\t                             (sheet) to print the whole EG.",
+	"\tprint <depth> [width]        Prints only <depth> Levels down from the selected Level (and, if given, only",
+	"\t                             the first [width] children of each Level).",
+	"\tinfo                         Prints information about the selected level.",
+	"\tstats                        Prints how many times each rule and helper was called and how long they took.",
+	"\tstats on|off                 Starts (over) or stops counting for \"stats\".",
+	"\tsave <file>                  Saves the sheet and any levels made with \"create level\" to <file> (in the",
+	"\t                             binary format if <file> ends in .egb).",
+	"\topen <name> [file]           Opens a new sheet called <name> (loaded from [file], if given) and switches to it.",
+	"\t                             Each sheet has its own levels, selection and mode.",
+	"\tswitch <name>                Switches to the sheet called <name>.",
+	"\tclose <name>                 Closes the sheet called <name>, and drops the levels made for it.",
+	"\tsheets                       Lists the open sheets.",
+	"\tquit                         Quits the reason() loop."])
+
+SETUP_HELP = "\n".join([
+	"Here are a list of possible commands to run:",
+	"\thelp                         Shows this dialog.",
+	"\tversion                      Shows the version number.",
+	"\tspam                         Does nothing.  (No really.  This is not a Monty Python joke.)",
+	"\tnew sheet                    Creates a new sheet of assertion (only if one doesn't already exist).",
+	"\tload <file>                  Loads a saved sheet (only if one doesn't already exist).",
+	"\tselect <id>                  Changes the selected Level (what is in between the [ and ]) to the object",
+	"\t                             with id <id>.",
+	"\tmode solve                   Switch to problem solving mode.",
+	"\tcreate atom <atom>           Creates a new atom in the selected level.",
+	"\tcreate level                 Creates a new level and makes it a child of the selected level.",
+	"\tdelete atom <atom>           Deletes atom <atom> from the selected level.",
+	"\tdelete level                 Deletes the selected level.",
+	"\tprint                        Prints the current state of the EG at the selected Level.  Go to level id 0",
+	"\t                             (sheet) to print the whole EG.",
+	"\tprint <depth> [width]        Prints only <depth> Levels down from the selected Level (and, if given, only",
+	"\t                             the first [width] children of each Level).",
+	"\tinfo                         Prints information about the selected level.",
+	"\tstats                        Prints how many times each rule and helper was called and how long they took.",
+	"\tstats on|off                 Starts (over) or stops counting for \"stats\".",
+	"\tsave <file>                  Saves the sheet to <file> (in the binary format if <file> ends in .egb).",
+	"\topen <name> [file]           Opens a new sheet called <name> (loaded from [file], if given) and switches to it.",
+	"\t                             Each sheet has its own levels, selection and mode.",
+	"\tswitch <name>                Switches to the sheet called <name>.",
+	"\tclose <name>                 Closes the sheet called <name>, and drops the levels made for it.",
+	"\tsheets                       Lists the open sheets.",
+	"\tquit                         Quits the reason() loop."])
+
+# EGCommandError: errors in the commands themselves (as opposed to the errors egml raises when a rule is broken).
+class EGCommandError(Exception):
+	def __init__(self, str):
+		self.string = str
+	def __str__(self):
+		return self.string
+
+# EGPagerQuit: raised by a Pager when the user stops the output part way through.
+class EGPagerQuit(Exception):
+	pass
+
+# Pager: passes text on to stream a screenful (lines lines) at a time, asking the user to go on after each one.
+class Pager:
+	def __init__(self, stream, lines, ask = input):
+		self.stream = stream
+		self.lines = max(lines, 1)
+		self.ask = ask
+		self.count = 0
+
+	# Starts a new screenful (call this whenever the user has just been prompted).
+	def reset(self):
+		self.count = 0
+
+	def write(self, text):
+		for line in text.splitlines(True):
+			if self.count >= self.lines:
+				self.stream.flush()
+				if self.ask("-- more -- (enter to go on, q to stop) ").strip() == "q":
+					raise EGPagerQuit()
+				self.count = 0
+			self.stream.write(line)
+			self.count += 1
+
+	def flush(self):
+		self.stream.flush()
+
+# The outcome of one command:
+#	command - the command as it was given
+#	ok - False if the command was not recognized or failed
+#	output - what the command printed (None if nothing)
+#	error - why the command failed (None if it didn't)
+class Result:
+	def __init__(self, command, ok = True, output = None, error = None):
+		self.command = command
+		self.ok = ok
+		self.output = output
+		self.error = error
+
+	def as_dict(self):
+		return {"command": self.command, "ok": self.ok, "output": self.output, "error": self.error}
+
+# A session holds everything one run of reason() works on, and runs commands against it one at a time with execute().
+class EGSession:
+	# The following variables are defined:
+	#	workspace - the sheets the session works on (an egwork.Workspace); these three belong to the current one:
+	#	context - the item commands are being run on
+	#	all_items - all items not otherwise connected (the sheet of assertion plus any other disconnected graph portions).
+	#		NOTE: the sheet of assertion will always be all_items[0].  Any other disconnected graph pieces (like pieces created using "create") are stored in here by ID.
+	#	mode - "setup" means that any action is allowed.  "solve" means that only logical EG actions can be performed on the tree.
+	#	confirm - called with no arguments to confirm "mode solve"; switches only if it returns True
+	#	running - False once "quit" has been run
+	#	log - the ProofLog recording this session (if any); it has to be told about the switch to solve mode
+	#	out - if set, "print" writes the graph straight to this file-like object (e.g. a Pager) instead of returning it
+	#	legal_moves - the egsearch.LegalMoves following the sheet for "suggest" (made the first time it is needed)
+	#	inserted - the disconnected Levels put into a sheet with "insert <id>", so that they can go back into all_items
+	#		when the insertion is undone (and out again when it is redone)
+
+	def __init__(self, confirm = None, log = None, out = None, workspace = None):
+		if workspace is None:
+			workspace = egwork.Workspace()
+		self.workspace = workspace
+		self.confirm = confirm
+		self.running = True
+		self.log = log
+		self.out = out
+		self.legal_moves = None
+		self.inserted = set()
+
+	@property
+	def context(self):
+		return self.workspace.current.context
+
+	@context.setter
+	def context(self, context):
+		self.workspace.current.context = context
+
+	@property
+	def all_items(self):
+		return self.workspace.current.items
+
+	@property
+	def mode(self):
+		return self.workspace.current.mode
+
+	@mode.setter
+	def mode(self, mode):
+		self.workspace.current.mode = mode
+
+	# The text between the [ and ] of the prompt.
+	def prompt(self):
+		if self.context:
+			context_representation = self.context.context_repr
+		else:
 			context_representation = ""
-			
-		command = input('[' + context_representation + '] ')
-		
+		if self.mode == "setup":
+			context_representation += "*"
+		if len(self.workspace) > 1:
+			context_representation = self.workspace.current.name + ": " + context_representation
+		return '[' + context_representation + '] '
+
+	# Runs a single command, and returns its Result.  Commands are looked up by mode, first word and number of words.
+	def execute(self, command):
 		command_args = command.split(' ')
-		recognized = True
-		
-		if mode == "solve":
-			if len(command_args) == 1:
-				if command_args[0] == 'help' or command_args[0] == '?':
-					print("Here are a list of possible commands to run:")
-					print("\thelp                         Shows this dialog.")
-					print("\tversion                      Shows the version number.")
-					print("\tspam                         Does nothing.  (No really.  This is not a Monty Python joke.)")
-					print("\tselect <id>                  Changes the selected Level (what is in between the [ and ]) to the object")
-					print("\t                             with id <id>.")
-					print("\tinsert doublecut [atoms]     Inserts 2 Levels (around the selected Level or, if supplied, around [atoms]")
-					print("\t                             (comma-separated) in this level.")
-					print("\tremove doublecut             Intelligently removes 2 Levels, either the selected Level and the one above, or")
-					print("\t                             the Level and the one below.")
-					print("\tinsert <atom>                Inserts <atom> at the Level selected.")
-					print("\tinsert <id>                  Inserts the graph with the id of <id> at the selected Level.")
-					print("\tremove <atom>                Removes <atom> from the selected Level.")
-					print("\tremove <id>                  Removes the graph with the id of <id> from the selected Level.")
-					print("\titerate <atom>               Inserts <atom> at the selected Level using a Level above as the logical")
-					print("\t                             justification.")
-					print("\titerate <id>                 Inserts Level with id <id> at the selected Level, finding the justification")
-					print("\t                             automagically.")
-					print("\tdeiterate <atom>             Removes <atom> from the selected Level using a Level above as the logical")
-					print("\t                             justification.")
-					print("\tdeiterate <id>               Removes Level with id <id> from the selected Level, finding the justification")
-					print("\t                             automagically.")
-					print("\tcreate level                 Creates a new, nonconnected Level.  You can add things to that Level freely.  This")
-					print("\t                             Level can only be used for iteration or insertion.")
-					print("\tprint                        Prints the current state of the EG at the selected Level.  Go to level id 0")
-					print("\t                             (sheet) to print the whole EG.")
-					print("\tinfo                         Prints information about the selected level.")
-					print("\tquit                         Quits the reason() loop.")
-					
-				elif command_args[0] == 'version':
-					print("\tEGML version 0.1a4140")
-					print("\tThis version does not include spam.")
-					
-				elif command_args[0] == 'spam':
-					# Background: it's necessary in every Python program to make a reference to Monty Python.  Here's mine.  ~Trevor
-					print("\tMenu:")
-					print("\tEgg and spam")
-					print("\tEgg, bacon, and spam")
-					print("\tEgg, bacon, sausage, and spam")
-					print("\tSpam, bacon, sausage, and spam")
-					print("\tSpam, egg, spam, spam, bacon, and spam")
-					print("\tSpam, spam, spam, egg, and spam")
-					print("\tSpam, spam, spam, spam, spam, spam, baked beans, spam, spam, spam, and spam")
-					
-				elif command_args[0] == 'print':
-					try:
-						print(context)
-					except:
-						type_, value_, tb_ = sys.exc_info()
-						print(value_)
-						
-				elif command_args[0] == 'info':
-					print("\t" + context.context_repr + ":")
-					print("\tid: " + str(context.id))
-					if type(context) is Level:
-						print("\tparent: " + str(context.parent.context_repr))
-					elif type(context) is Sheet:
-						print("\tparent: " + str(context.parent))
-					print("\tdepth: " + str(context.depth))
-					print("\tatoms: " + str(context.atoms))
-					print("\tchildren: ")
-					for child in context.children:
-						print("\t\t" + child.context_repr)
-						
-				elif command_args[0] == 'quit':
-					break
-					
-				elif command_args[0] == '':
-					pass
-					
-				else:
-					recognized = False
-					
-			elif len(command_args) == 2:
-				if command_args[0] == 'insert' and command_args[1] == 'doublecut':
-					try:
-						context.ins_doublecut()
-					except:
-						type_, value_, tb_ = sys.exc_info()
-						print(value_)
-						
-				elif command_args[0] == 'remove' and command_args[1] == 'doublecut':
-					try:
-						new_context = context.rem_doublecut()
-						context = new_context
-					except:
-						type_, value_, tb_ = sys.exc_info()
-						print(value_)
-						
-				elif command_args[0] == 'select':
-					if command_args[1].isdigit():
-						new_context = all_items[0].find(int(command_args[1]))
-						if not new_context:
-							try:
-								new_context = all_items[int(command_args[1])]
-							except:
-								new_context = context
-								print("ERROR: id not found")
-						context = new_context
-					else:
-						print("ERROR: that's no id!")
-						
-				elif command_args[0] == 'insert':
-					if command_args[1].isalpha():
-						try:
-							context.insert(atom = command_args[1])
-						except:
-							type_, value_, tb_ = sys.exc_info()
-							print(value_)
-					elif command_args[1].isdigit():
-						# NOTE: you can only do this if you use "create level" to create a new, disconnected level and then add things to it.  Then pass that level as the id in insert.
-						#try:
-							context.insert(level = all_items[int(command_args[1])])
-							del all_items[int(command_args[1])]					# Removes the disconnected level from all_items
-						#except:
-							#type_, value_, tb_ = sys.exc_info()
-							#print(value_)
-						
-				elif command_args[0] == 'remove':
-					if command_args[1].isalpha():
-						try:
-							context.remove(atom = command_args[1])
-						except:
-							type_, value_, tb_ = sys.exc_info()
-							print(value_)
-							
-					elif command_args[1].isdigit():
-						found_item = all_items[0].find(int(command_args[1]))
-						if found_item:
-							try:
-								context.remove(level = found_item)
-							except:
-								type_, value_, tb_ = sys.exc_info()
-								print(value_)
-						else:
-							print("ERROR: given id not found.")
-					else:
-						print("ERROR: that's not an atom or id!")
-
-				elif command_args[0] == 'iterate':
-					if command_args[1].isalpha():
-						try:
-							context.iterate(atom = command_args[1])
-						except:
-							type_, value_, tb_ = sys.exc_info()
-							print(value_)
-							
-					elif command_args[1].isdigit():
-						found_item = all_items[0].find(int(command_args[1]))
-						if found_item:
-							try:
-								# This extra step makes a copy of the subgraph to iterate...that way we don't make pointer mistakes in the graph.
-								copy_found_item = copy_graph(all_items[0], found_item)
-								context.iterate(level = copy_found_item)
-							except:
-								type_, value_, tb_ = sys.exc_info()
-								print(value_)
-						
-				elif command_args[0] == 'deiterate':
-					if command_args[1].isalpha():
-						try:
-							context.deiterate(atom = command_args[1])
-						except:
-							type_, value_, tb_ = sys.exc_info()
-							print(value_)
-							
-					elif command_args[1].isdigit():
-						found_item = all_items[0].find(int(command_args[1]))
-						if found_item:
-							try:
-								context.deiterate(level = found_item)
-							except:
-								type_, value_, tb_ = sys.exc_info()
-								print(value_)
-					
-				elif command_args[0] == 'create' and command_args[1] == 'level':
-					try:
-						new_level = Level(None, new_id = all_items[0].get_next_id())
-						all_items[new_level.id] = new_level
-					except:
-						type_, value_, tb_ = sys.exc_info()
-						print(value_)
-					
-				else:
-					recognized = False
-					
-			elif len(command_args) == 3:
-				if command_args[0] == 'insert' and command_args[1] == 'doublecut':
-					if command_args[2].isalpha():
-						try:
-							context.ins_doublecut(command_args[2])
-						except:
-							type_, value_, tb_ = sys.exc_info()
-							print(value_)
-							
-					else:
-						try:
-							context.ins_doublecut(command_args[2].split(','))
-						except:
-							type_, value_, tb_ = sys.exc_info()
-							print(value_)
-							
-				else:
-					recognized = False
-					
+		handler = EGSession.COMMANDS[self.mode].get((command_args[0], len(command_args)))
+		if not handler:
+			return Result(command, False, error = "ERROR: command not recognized.")
+		if self.context is None and not handler in EGSession.NO_CONTEXT:
+			return Result(command, False, error = "ERROR: nothing is selected (use \"new sheet\" or \"select <id>\" first).")
+		try:
+			return Result(command, output = handler(self, command_args))
+		except Exception:
+			type_, value_, tb_ = sys.exc_info()
+			return Result(command, False, error = str(value_))
+		finally:
+			self.workspace.check()
+
+	################## Any Mode Commands ##################
+
+	def _help(self, command_args):
+		if self.mode == "solve":
+			return SOLVE_HELP
+		return SETUP_HELP
+
+	def _version(self, command_args):
+		return VERSION
+
+	def _spam(self, command_args):
+		return SPAM
+
+	# print [depth [width]]: the graph is rendered a piece at a time, to self.out if it is set.
+	def _print(self, command_args):
+		limits = command_args[1:]
+		if not all(limit.isdigit() for limit in limits):
+			raise EGCommandError("ERROR: depth and width must be numbers.")
+		limits = [int(limit) for limit in limits] + [None, None]
+		if self.out is None:
+			buffer = io.StringIO()
+			render(self.context, buffer, limits[0], limits[1])
+			return buffer.getvalue()
+		try:
+			render(self.context, self.out, limits[0], limits[1])
+		except EGPagerQuit:
+			pass
+		self.out.flush()
+
+	def _info(self, command_args):
+		context = self.context
+		lines = ["\t" + context.context_repr + ":", "\tid: " + str(context.id)]
+		if type(context) is Level and context.parent:
+			lines.append("\tparent: " + str(context.parent.context_repr))
+		else:
+			lines.append("\tparent: " + str(context.parent))
+		lines.append("\tdepth: " + str(context.depth))
+		lines.append("\tatoms: " + str(context.atoms))
+		lines.append("\tchildren: ")
+		for child in context.children:
+			lines.append("\t\t" + child.context_repr)
+		return "\n".join(lines)
+
+	def _stats(self, command_args):
+		if len(command_args) == 2:
+			if command_args[1] == "on":
+				enable_stats()
+			elif command_args[1] == "off":
+				disable_stats()
+			else:
+				raise EGCommandError("ERROR: command not recognized.")
+			return
+		stats = get_stats(self.all_items.get(0))
+		lines = []
+		if "levels" in stats:
+			lines.append("\tlevels: %d  atoms: %d" % (stats["levels"], stats["atoms"]))
+		if not stats_enabled():
+			lines.append("\tnot counting calls (use \"stats on\").")
+			return "\n".join(lines)
+		lines.append("\t%-14s %8s %12s %10s %10s %10s" % ("", "calls", "total ms", "p50 us", "p90 us", "p99 us"))
+		calls = stats["calls"]
+		for name in sorted(calls, key = lambda name: -calls[name]["total"]):
+			call = calls[name]
+			lines.append("\t%-14s %8d %12.3f %10.1f %10.1f %10.1f" % (name, call["count"], call["total"] * 1e3,
+				call["p50"] * 1e6, call["p90"] * 1e6, call["p99"] * 1e6))
+		return "\n".join(lines)
+
+	def _quit(self, command_args):
+		self.running = False
+
+	def _nothing(self, command_args):
+		pass
+
+	def _select(self, command_args):
+		if not command_args[1].isdigit():
+			raise EGCommandError("ERROR: that's no id!")
+		id = int(command_args[1])
+		new_context = False
+		if 0 in self.all_items:
+			new_context = self.all_items[0].find(id)
+		if not new_context:
+			new_context = self.all_items.get(id)
+		if not new_context:
+			raise EGCommandError("ERROR: id not found")
+		self.context = new_context
+
+	# Saves the sheet (and the disconnected Levels) in the format given by the file name (see egsave.py).
+	def _save(self, command_args):
+		graphs = [self.all_items[id] for id in sorted(self.all_items) if id != 0]
+		with open(command_args[1], "wb") as stream:
+			egsave.save(stream, self.all_items[0], graphs, binary = command_args[1].endswith(".egb"))
+
+	# open <name> [file]: the new sheet starts in setup mode, with nothing but the sheet of assertion (or the saved graphs).
+	def _open(self, command_args):
+		self._one_sheet()
+		name = command_args[1]
+		if name in self.workspace:
+			raise EGCommandError("ERROR: there is already a sheet called " + name + ".")
+		if len(command_args) == 3:
+			with open(command_args[2], "rb") as stream:
+				sheet, graphs = egsave.load(stream)
+		else:
+			sheet, graphs = Sheet(), []
+		self.workspace.open(name)
+		self.all_items[0] = sheet
+		for graph in graphs:
+			self.all_items[graph.id] = graph
+		self.context = sheet
+
+	def _switch(self, command_args):
+		self._one_sheet()
+		self.workspace.switch(command_args[1])
+
+	def _close(self, command_args):
+		self.workspace.close(command_args[1])
+
+	def _sheets(self, command_args):
+		lines = []
+		for entry in self.workspace.entries():
+			if entry is self.workspace.current:
+				where = "%d levels" % entry.count()
+			elif entry.loaded:
+				where = "%d levels" % entry.size
+			else:
+				where = "on disk"
+			lines.append("\t%s %-20s %s (%s)" % ("*" if entry is self.workspace.current else " ", entry.name, entry.mode, where))
+		return "\n".join(lines)
+
+	# A ProofLog records what is done to one sheet, so switching sheets isn't allowed while there is one.
+	def _one_sheet(self):
+		if self.log:
+			raise EGCommandError("ERROR: only one sheet can be used while recording a proof log.")
+
+	# Looks up an id given to a solve mode command in the sheet of assertion.
+	def _find(self, id):
+		found_item = self.all_items[0].find(int(id))
+		if not found_item:
+			raise EGCommandError("ERROR: given id not found.")
+		return found_item
+
+	################# Setup Mode Commands #################
+
+	def _new(self, command_args):
+		if command_args[1] != 'sheet':
+			raise EGCommandError("ERROR: command not recognized.")
+		if self.context:
+			raise EGCommandError("ERROR: you already have a sheet of assertion.")
+		self.context = Sheet()
+		self.all_items[0] = self.context
+
+	def _load(self, command_args):
+		if self.context:
+			raise EGCommandError("ERROR: you already have a sheet of assertion.")
+		with open(command_args[1], "rb") as stream:
+			sheet, graphs = egsave.load(stream)
+		self.context = sheet
+		self.all_items[0] = sheet
+		for graph in graphs:
+			self.all_items[graph.id] = graph
+
+	def _mode(self, command_args):
+		if command_args[1] != 'solve':
+			raise EGCommandError("ERROR: command not recognized.")
+		if not (self.confirm and self.confirm()):
+			raise EGCommandError("ERROR: solve mode was not confirmed.")
+		self.mode = "solve"
+		if self.log:
+			self.log.solve()
+		if 0 in self.all_items:
+			self.all_items[0].start_history()
+
+	def _create(self, command_args):
+		if len(command_args) == 2 and command_args[1] == 'level':
+			self.context.create()
+		elif len(command_args) == 3 and command_args[1] == 'atom':
+			self.context.create(atom = command_args[2])
+		else:
+			raise EGCommandError("ERROR: command not recognized.")
+
+	def _delete(self, command_args):
+		if len(command_args) == 2 and command_args[1] == 'level':
+			self.context = self.context.delete()
+		elif len(command_args) == 3 and command_args[1] == 'atom':
+			self.context.delete(atom = command_args[2])
+		else:
+			raise EGCommandError("ERROR: command not recognized.")
+
+	################# Solve Mode Commands #################
+
+	def _solve_insert(self, command_args):
+		if len(command_args) == 3:
+			if command_args[1] != 'doublecut':
+				raise EGCommandError("ERROR: command not recognized.")
+			if is_atom_name(command_args[2]):
+				self.context.ins_doublecut(command_args[2])
+			else:
+				self.context.ins_doublecut(command_args[2].split(','))
+		elif command_args[1] == 'doublecut':
+			self.context.ins_doublecut()
+		elif is_atom_name(command_args[1]):
+			self.context.insert(atom = command_args[1])
+		elif command_args[1].isdigit():
+			# NOTE: you can only do this if you use "create level" to create a new, disconnected level and then add things to it.  Then pass that level as the id in insert.
+			id = int(command_args[1])
+			if not id in self.all_items or id == 0:
+				raise EGCommandError("ERROR: given id is not a disconnected level.")
+			self.context.insert(level = self.all_items[id])
+			self.inserted.add(self.all_items.pop(id))	# Removes the disconnected level from all_items
+		else:
+			raise EGCommandError("ERROR: that's not an atom or id!")
+
+	def _solve_remove(self, command_args):
+		if command_args[1] == 'doublecut':
+			self.context = self.context.rem_doublecut()
+		elif is_atom_name(command_args[1]):
+			self.context.remove(atom = command_args[1])
+		elif command_args[1].isdigit():
+			self.context.remove(level = self._find(command_args[1]))
+		else:
+			raise EGCommandError("ERROR: that's not an atom or id!")
+
+	def _solve_iterate(self, command_args):
+		if is_atom_name(command_args[1]):
+			self.context.iterate(atom = command_args[1])
+		elif command_args[1].isdigit():
+			# This extra step makes a copy of the subgraph to iterate...that way we don't make pointer mistakes in the graph.
+			copy_found_item = copy_graph(self.all_items[0], self._find(command_args[1]))
+			self.context.iterate(level = copy_found_item)
+		else:
+			raise EGCommandError("ERROR: that's not an atom or id!")
+
+	def _solve_deiterate(self, command_args):
+		if is_atom_name(command_args[1]):
+			self.context.deiterate(atom = command_args[1])
+		elif command_args[1].isdigit():
+			self.context.deiterate(level = self._find(command_args[1]))
+		else:
+			raise EGCommandError("ERROR: that's not an atom or id!")
+
+	def _undo(self, command_args):
+		self.all_items[0].history.undo()
+		return self._version_moved()
+
+	def _redo(self, command_args):
+		self.all_items[0].history.redo()
+		return self._version_moved()
+
+	def _checkout(self, command_args):
+		if not command_args[1].isdigit():
+			raise EGCommandError("ERROR: that's no version!")
+		self.all_items[0].history.checkout(int(command_args[1]))
+		return self._version_moved()
+
+	# After the sheet goes to another version, the selected Level may not be in it any more (then the sheet is selected).
+	# The graphs inserted with "insert <id>" that are disconnected again in this version are back in all_items.
+	def _version_moved(self):
+		sheet = self.all_items[0]
+		for level in self.inserted:
+			if level.sheet is sheet and level.parent is None:
+				self.all_items[level.id] = level
+			elif level.sheet is sheet:
+				self.all_items.pop(level.id, None)
+		if not (self.context.get_sheet() or self.context.id in self.all_items):
+			self.context = sheet
+		return "\tversion %d of %d" % (sheet.history.version, sheet.history.latest)
+
+	# Searches for a proof from the sheet to a disconnected Level (see egsearch.py).  The sheet itself is left alone.
+	def _prove(self, command_args):
+		if not all(arg.isdigit() for arg in command_args[1:]):
+			raise EGCommandError("ERROR: that's no id!")
+		id = int(command_args[1])
+		if not id in self.all_items or id == 0:
+			raise EGCommandError("ERROR: given id is not a disconnected level.")
+		depth = int(command_args[2]) if len(command_args) == 3 else 4
+		proof = egsearch.search(self.all_items[0], self.all_items[id], max_depth = depth, max_expansions = PROVE_EXPANSIONS)
+		if proof is None:
+			return "\tno proof found."
+		lines = ["\tproof in %d steps:" % len(proof)]
+		for number, move in enumerate(proof):
+			lines.append("\t%d. %s" % (number + 1, move))
+		return "\n".join(lines)
+
+	# Lists the legal moves (see egsearch.LegalMoves), as "<rule> <id> ..." with the rule named as in egml.
+	def _suggest(self, command_args):
+		if len(command_args) == 2 and command_args[1] != "all":
+			raise EGCommandError("ERROR: command not recognized.")
+		sheet = self.all_items[0]
+		if self.legal_moves is None or not self.legal_moves.sheet is sheet:
+			self.legal_moves = egsearch.LegalMoves(sheet)
+		if len(command_args) == 2:
+			moves = self.legal_moves.all()
+		elif self.context.get_sheet():
+			moves = self.legal_moves.moves(self.context)
+		else:
+			raise EGCommandError("ERROR: the selected Level is not on the sheet.")
+		if not moves:
+			return "\tno legal moves."
+		return "\n".join("\t" + str(move) for move in moves)
+
+	# Simplifies the graph under the selected Level (see egml's Level.simplify()), and lists the steps it took.
+	def _simplify(self, command_args):
+		if not self.context.get_sheet():
+			raise EGCommandError("ERROR: the selected Level is not on the sheet.")
+		steps = self.context.simplify()
+		if not steps:
+			return "\tnothing to simplify."
+		lines = ["\tsimplified in %d steps:" % len(steps)]
+		for number, (rule, id, item) in enumerate(steps):
+			if type(item) is int:
+				move = egsearch.Move(rule, id, graph = item)
 			else:
-				recognized = False
-		elif mode == "setup":
-			if len(command_args) == 1:
-				if command_args[0] == "help" or command_args[0] == '?':
-					print("Here are a list of possible commands to run:")
-					print("\thelp                         Shows this dialog.")
-					print("\tversion                      Shows the version number.")
-					print("\tspam                         Does nothing.  (No really.  This is not a Monty Python joke.)")
-					print("\tnew sheet                    Creates a new sheet of assertion (only if one doesn't already exist).")
-					print("\tselect <id>                  Changes the selected Level (what is in between the [ and ]) to the object")
-					print("\t                             with id <id>.")
-					print("\tmode solve                   Switch to problem solving mode.")
-					print("\tcreate atom <atom>           Creates a new atom in the selected level.")
-					print("\tcreate level                 Creates a new level and makes it a child of the selected level.")
-					print("\tdelete atom <atom>           Deletes atom <atom> from the selected level.")
-					print("\tdelete level                 Deletes the selected level.")
-					print("\tprint                        Prints the current state of the EG at the selected Level.  Go to level id 0")
-					print("\t                             (sheet) to print the whole EG.")
-					print("\tinfo                         Prints information about the selected level.")
-					print("\tquit                         Quits the reason() loop.")
-					
-				elif command_args[0] == "info":
-					print("\t" + context.context_repr + ":")
-					print("\tid: " + str(context.id))
-					if type(context) is Level:
-						print("\tparent: " + str(context.parent.context_repr))
-					elif type(context) is Sheet:
-						print("\tparent: " + str(context.parent))
-					print("\tdepth: " + str(context.depth))
-					print("\tatoms: " + str(context.atoms))
-					print("\tchildren: ")
-					for child in context.children:
-						print("\t\t" + child.context_repr)
-						
-				elif command_args[0] == "spam":
-					# Background: it's necessary in every Python program to make a reference to Monty Python.  Here's mine.  ~Trevor
-					print("\tMenu:")
-					print("\tEgg and spam")
-					print("\tEgg, bacon, and spam")
-					print("\tEgg, bacon, sausage, and spam")
-					print("\tSpam, bacon, sausage, and spam")
-					print("\tSpam, egg, spam, spam, bacon, and spam")
-					print("\tSpam, spam, spam, egg, and spam")
-					print("\tSpam, spam, spam, spam, spam, spam, baked beans, spam, spam, spam, and spam")
-					
-				elif command_args[0] == 'print':
-					try:
-						print(context)
-					except:
-						type_, value_, tb_ = sys.exc_info()
-						print(value_)
-					
-				elif command_args[0] == 'version':
-					print("\tEGML version 0.1a4140")
-					print("\tThis version does not include spam.")
-				
-				elif command_args[0] == 'quit':
-					break
-					
-				elif command_args[0] == '':
-					pass
-				
-				else:
-					recognized = False
-					
-			elif len(command_args) == 2:
-				if command_args[0] == 'new' and command_args[1] == 'sheet':
-					if not context:
-						try:
-							context = Sheet()
-							all_items[0] = context
-						except:
-							type_, value_, tb_ = sys.exc_info()
-							print(value_)
-					else:
-						print("ERROR: you already have a sheet of assertion.")
-				
-				elif command_args[0] == "mode" and command_args[1] == "solve":
-					print("NOTE: once you enter solve mode, you cannot re-enter setup mode.")
-					inp = input("Are you sure you want to continue? [yes/no] ")
-					if inp == 'yes':
-						mode = "solve"
-						
-				elif command_args[0] == "create" and command_args[1] == "level":
-					try:
-						context.create()
-					except:
-						type_, value_, tb_ = sys.exc_info()
-						print(value_)
-				
-				elif command_args[0] == "delete" and command_args[1] == "level":
-					try:
-						new_context = context.delete()
-						context = new_context
-					except:
-						type_, value_, tb_ = sys.exc_info()
-						print(value_)
-				
-				elif command_args[0] == 'select':
-					if command_args[1].isdigit():
-						new_context = all_items[0].find(int(command_args[1]))
-						if not new_context:
-							try:
-								new_context = all_items[int(command_args[1])]
-							except:
-								new_context = context
-								print("ERROR: id not found")
-						context = new_context
-					else:
-						print("ERROR: that's no id!")
-				
-				else:
-					recognized = False
-						
-			elif len(command_args) == 3:
-				if command_args[0] == "create" and command_args[1] == "atom":
-					try:
-						context.create(atom = command_args[2])
-					except:
-						type_, value_, tb_ = sys.exc_info()
-						print(value_)
-						
-				elif command_args[0] == "delete" and command_args[1] == "atom":
-					try:
-						context.delete(atom = command_args[2])
-					except:
-						type_, value_, tb_ = sys.exc_info()
-						print(value_)
-				
-				else:
-					recognized = False
-				
-		if not recognized:
-			print("ERROR: command not recognized.")
-
-EG_reason()
\ No newline at end of file
+				move = egsearch.Move(rule, id, item)
+			lines.append("\t%d. %s" % (number + 1, move))
+		return "\n".join(lines)
+
+	def _solve_create(self, command_args):
+		if command_args[1] != 'level':
+			raise EGCommandError("ERROR: command not recognized.")
+		new_level = Level(None, sheet = self.all_items[0])
+		self.all_items[new_level.id] = new_level
+
+	# Drops a disconnected Level that is no longer wanted (the sheet is selected instead).
+	def _solve_delete(self, command_args):
+		if command_args[1] != 'level':
+			raise EGCommandError("ERROR: command not recognized.")
+		if self.context.id == 0 or self.all_items.get(self.context.id) is not self.context:
+			raise EGCommandError("ERROR: only a nonconnected Level made with \"create level\" can be deleted.")
+		del self.all_items[self.context.id]
+		self.inserted.discard(self.context)
+		self.context = self.all_items[0]
+
+	# The commands of each mode, by (first word, number of words).
+	COMMANDS = {
+		"setup": {
+			("help", 1): _help, ("?", 1): _help, ("version", 1): _version, ("spam", 1): _spam,
+			("print", 1): _print, ("print", 2): _print, ("print", 3): _print, ("info", 1): _info,
+			("stats", 1): _stats, ("stats", 2): _stats, ("quit", 1): _quit, ("", 1): _nothing,
+			("new", 2): _new, ("load", 2): _load, ("save", 2): _save, ("mode", 2): _mode, ("select", 2): _select,
+			("create", 2): _create, ("create", 3): _create, ("delete", 2): _delete, ("delete", 3): _delete,
+			("open", 2): _open, ("open", 3): _open, ("switch", 2): _switch, ("close", 2): _close, ("sheets", 1): _sheets,
+		},
+		"solve": {
+			("help", 1): _help, ("?", 1): _help, ("version", 1): _version, ("spam", 1): _spam,
+			("print", 1): _print, ("print", 2): _print, ("print", 3): _print, ("info", 1): _info,
+			("stats", 1): _stats, ("stats", 2): _stats, ("quit", 1): _quit, ("", 1): _nothing,
+			("select", 2): _select, ("save", 2): _save, ("create", 2): _solve_create,
+			("insert", 2): _solve_insert, ("insert", 3): _solve_insert, ("remove", 2): _solve_remove,
+			("iterate", 2): _solve_iterate, ("deiterate", 2): _solve_deiterate,
+			("undo", 1): _undo, ("redo", 1): _redo, ("checkout", 2): _checkout, ("prove", 2): _prove, ("prove", 3): _prove,
+			("delete", 2): _solve_delete, ("suggest", 1): _suggest, ("suggest", 2): _suggest,
+			("simplify", 1): _simplify,
+			("open", 2): _open, ("open", 3): _open, ("switch", 2): _switch, ("close", 2): _close, ("sheets", 1): _sheets,
+		},
+	}
+
+	# The commands that can be run before anything is selected.
+	NO_CONTEXT = set([_help, _version, _spam, _quit, _nothing, _stats, _new, _load, _mode, _select, _open, _switch, _close,
+		_sheets])
+
+# Asks the user to confirm "mode solve" (in the interactive loop).
+def confirm_solve():
+	print("NOTE: once you enter solve mode, you cannot re-enter setup mode.")
+	inp = input("Are you sure you want to continue? [yes/no] ")
+	return inp == 'yes'
+
+# Returns the sink to use while commands run: the given ones (leaving out any that are None) combined.
+def _sink(*sinks):
+	sinks = [sink for sink in sinks if sink]
+	if len(sinks) > 1:
+		return MultiSink(*sinks)
+	elif sinks:
+		return sinks[0]
+	return None
+
+# The interactive loop: reads commands one at a time from the user until "quit".
+# If log (a ProofLog) is given, everything done to the sheet is recorded to it.
+# The sheets are kept in workspace (an egwork.Workspace) if it is given, or else in a new one that is cleared at the end.
+# On a terminal, printed graphs are shown a screenful at a time.
+def EG_reason(log = None, workspace = None):
+	if sys.stdin.isatty() and sys.stdout.isatty():
+		out = Pager(sys.stdout, shutil.get_terminal_size().lines - 1)
+	else:
+		out = sys.stdout
+	session = EGSession(confirm = confirm_solve, log = log, out = out, workspace = workspace)
+
+	# Show everything egml does to the graph as it happens.
+	previous_sink = set_sink(_sink(BufferedSink(sys.stdout, size = 1), log))
+
+	while session.running:
+		try:
+			command = input(session.prompt())
+		except EOFError:
+			break
+		if out is not sys.stdout:
+			out.reset()
+		result = session.execute(command)
+		if result.output is not None:
+			print(result.output)
+		if result.error is not None:
+			print(result.error)
+		if log:
+			log.flush()
+
+	set_sink(previous_sink)
+	if workspace is None:
+		session.workspace.clear()
+
+# Batch mode: runs every command from lines (an iterable of lines, e.g. an open file) without prompting, until "quit".
+# Each Result is passed to report (if given) as soon as the command has run.  If out is given, "print" writes to it directly.
+# Returns the number of commands that failed.  (Recording to a ProofLog is up to the caller, see main().)
+# The sheets are kept in workspace as with EG_reason().
+def EG_batch(lines, confirm = False, report = None, stop_on_error = False, log = None, out = None, workspace = None):
+	session = EGSession(confirm = lambda: confirm, log = log, out = out, workspace = workspace)
+	failures = 0
+	try:
+		for line in lines:
+			result = session.execute(line.rstrip("\r\n"))
+			if not result.ok:
+				failures += 1
+			if report:
+				report(result)
+			if not session.running or (stop_on_error and not result.ok):
+				break
+	finally:
+		if workspace is None:
+			session.workspace.clear()
+	return failures
+
+# The command line entry point (python3 -m reason, or python3 reason.py).
+# Exit codes: 0 if every command succeeded, 1 if any command failed, 2 if the arguments or command file were bad.
+def main(argv = None):
+	parser = argparse.ArgumentParser(prog = "reason", description = "Existential graph manipulation.")
+	parser.add_argument("--batch", metavar = "FILE", help = "run the commands in FILE (- for stdin) without prompting")
+	parser.add_argument("--yes", action = "store_true", help = "answer yes when \"mode solve\" asks for confirmation")
+	parser.add_argument("--json", action = "store_true", help = "report the result of each command as a line of JSON")
+	parser.add_argument("--events", action = "store_true", help = "also print what egml does to the graph")
+	parser.add_argument("--stop-on-error", action = "store_true", help = "stop at the first command that fails")
+	parser.add_argument("--log", metavar = "FILE", help = "record everything done to the sheet in a proof log")
+	parser.add_argument("--stats", action = "store_true", help = "count calls from the start (see the stats command)")
+	parser.add_argument("--max-levels", metavar = "N", type = int, default = egwork.MAX_LEVELS,
+		help = "keep at most N levels in memory between the open sheets, spilling the rest to disk")
+	parser.add_argument("--spill", metavar = "DIR", help = "spill sheets to DIR (a new temporary directory if not given)")
+	args = parser.parse_args(argv)
+
+	if args.stats:
+		enable_stats()
+
+	log = None
+	if args.log:
+		try:
+			log = ProofLog(open(args.log, "w"))
+		except IOError:
+			type_, value_, tb_ = sys.exc_info()
+			sys.stderr.write("reason: " + str(value_) + "\n")
+			return 2
+
+	workspace = egwork.Workspace(args.max_levels, args.spill)
+
+	if args.batch is None:
+		try:
+			EG_reason(log, workspace)
+		finally:
+			workspace.clear()
+			if log:
+				log.close()
+		return 0
+
+	# With --json the graph has to be part of each Result; otherwise it is written out as it is rendered.
+	out = None
+	if args.json:
+		def report(result):
+			sys.stdout.write(json.dumps(result.as_dict()) + "\n")
+	else:
+		out = sys.stdout
+		def report(result):
+			if result.output is not None:
+				sys.stdout.write(result.output + "\n")
+			if result.error is not None:
+				sys.stdout.write(result.error + "\n")
+
+	if args.events:
+		previous_sink = set_sink(_sink(BufferedSink(sys.stdout, size = 1), log))
+	else:
+		previous_sink = set_sink(log)
+	try:
+		if args.batch == "-":
+			failures = EG_batch(sys.stdin, args.yes, report, args.stop_on_error, log, out, workspace)
+		else:
+			with open(args.batch) as lines:
+				failures = EG_batch(lines, args.yes, report, args.stop_on_error, log, out, workspace)
+	except IOError:
+		type_, value_, tb_ = sys.exc_info()
+		sys.stderr.write("reason: " + str(value_) + "\n")
+		return 2
+	finally:
+		set_sink(previous_sink)
+		workspace.clear()
+		if log:
+			log.close()
+
+	if failures:
+		return 1
+	return 0
+
+if __name__ == "__main__":
+	sys.exit(main())
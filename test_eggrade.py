@@ -0,0 +1,49 @@
+#	Existential Graph Manipulation Library
+#
+#	test_eggrade.py
+#
+#	Tests for the grading service's queue (run with python3 -m unittest or pytest).
+
+import eggrade
+import asyncio
+import json
+import unittest
+
+# Stands in for the stream writer of an HTTP connection, keeping what is written.
+class _Writer:
+	def __init__(self):
+		self.data = b""
+	def write(self, data):
+		self.data += data
+	async def drain(self):
+		pass
+
+class BatchTest(unittest.TestCase):
+	# A big batch is let into the queue a few logs at a time, so that a log sent to /grade alongside it still gets in.
+	def test_batch_leaves_room(self):
+		async def run():
+			service = eggrade.GradingService(workers = 2, queue_size = 4, timeout = 10.0)
+			try:
+				body = "".join(json.dumps({"id": i, "log": "log %d\n" % i}) + "\n" for i in range(500)).encode()
+				writer = _Writer()
+				batch = asyncio.ensure_future(service._batch(writer, body))
+				# Nothing takes logs from the queue yet, so the batch fills as much of it as it is going to.
+				for i in range(100):
+					await asyncio.sleep(0)
+				self.assertEqual(service.queue.qsize(), 2)
+				single = asyncio.ensure_future(service.grade(b"a log of its own\n"))
+				await asyncio.sleep(0)
+				self.assertFalse(single.done())		# Queued (not turned away as busy), and waiting for a worker.
+				self.assertEqual(service.queue.qsize(), 3)
+				service.start()
+				verdict = await asyncio.wait_for(single, 60)
+				self.assertFalse(verdict["cached"])
+				await asyncio.wait_for(batch, 120)
+				self.assertEqual(service.counts["busy"], 0)
+				self.assertEqual(writer.data.count(b"\"id\": "), 500)
+			finally:
+				service.close()
+		asyncio.run(run())
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,64 @@
+#	Existential Graph Manipulation Library
+#
+#	test_egwork.py
+#
+#	Tests for spilling sheets to disk and loading them again (run with python3 -m unittest or pytest).
+
+from egml import Sheet, Level, preorder, set_sink
+import egwork
+import tempfile
+import unittest
+
+class SpillTest(unittest.TestCase):
+	def setUp(self):
+		self.previous_sink = set_sink(None)
+		self.directory = tempfile.TemporaryDirectory()
+
+	def tearDown(self):
+		set_sink(self.previous_sink)
+		self.directory.cleanup()
+
+	# Fills the current Entry of workspace with a sheet whose atoms are not in sorted order (including a Level with more
+	# atoms than are kept in a tuple), and a disconnected Level.
+	def fill(self, workspace):
+		sheet = Sheet()
+		for atom in ["Q", "B", "Q", "A"]:
+			sheet.create(atom)
+		sheet.create()
+		sheet.create()
+		cut = sheet.children[0]
+		for atom in ["Z", "Y", "X", "W", "Y", "V", "U", "T", "S", "Z", "R"]:
+			cut.create(atom)
+		cut.create()
+		cut.children[0].create("M")
+		cut.children[0].create("C")
+		sheet.children[1].create("D")
+		graph = Level(None, sheet = sheet)
+		graph.create("K")
+		graph.create("B")
+		entry = workspace.current
+		entry.items = {0: sheet, graph.id: graph}
+		entry.context = cut
+		return entry
+
+	# A sheet that is spilled and switched back to prints the same, atoms and all, and keeps its ids.
+	def test_round_trip(self):
+		workspace = egwork.Workspace(max_levels = 4, directory = self.directory.name)
+		entry = self.fill(workspace)
+		sheet = entry.items[0]
+		graph_id = max(entry.items)
+		before = repr(sheet)
+		graph_before = repr(entry.items[graph_id])
+		ids = [item.id for item in preorder(sheet)]
+		workspace.open("other")
+		self.assertFalse(entry.loaded)
+		workspace.switch("main")
+		self.assertTrue(entry.loaded)
+		sheet = entry.items[0]
+		self.assertEqual(repr(sheet), before)
+		self.assertEqual(repr(entry.items[graph_id]), graph_before)
+		self.assertEqual([item.id for item in preorder(sheet)], ids)
+		self.assertIs(entry.context, sheet.children[0])
+
+if __name__ == "__main__":
+	unittest.main()